@@ -0,0 +1,55 @@
+'''
+
+Benchmark for the construction of ExcitedStateAbsorptionSpectrum objects
+
+Measures the time and the memory needed per instance when constructing many ESA spectra, both bare and filled with data as done by the loaders.
+
+Usage:
+
+    python benchmarks/bench_esa_construction.py [number of spectra]
+
+'''
+
+import sys
+import time
+import tracemalloc
+import numpy
+import dynamictaxes as dt
+
+
+def construct(num_spectra, num_states):
+    esa_spectra = []
+    for i in range(num_spectra):
+        esa = dt.ExcitedStateAbsorptionSpectrum()
+        if num_states > 0:
+            esa.time = i * 0.05
+            esa.energies = numpy.linspace(1.0, 5.0, num=num_states)
+            esa.transition_moments = numpy.full(num_states, 0.1)
+            esa.excited_state_labels = ["S" + str(j+2) for j in range(num_states)]
+        esa_spectra.append(esa)
+    return esa_spectra
+
+def measure(num_spectra, num_states):
+    start = time.perf_counter()
+    esa_spectra = construct(num_spectra, num_states)
+    duration = time.perf_counter() - start
+    del esa_spectra
+
+    tracemalloc.start()
+    esa_spectra = construct(num_spectra, num_states)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del esa_spectra
+    return duration / num_spectra, memory / num_spectra
+
+def main():
+    num_spectra = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dt.init_configs()
+    dt.ExcitedStateAbsorptionSpectrum()  # The module is imported on first use, which should not be timed
+    for num_states in (0, 20):
+        duration, memory = measure(num_spectra, num_states)
+        print("%d spectra with %2d states: %8.2f us and %8.1f bytes per spectrum" % (num_spectra, num_states, duration * 1e6, memory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+
+Benchmark for the import time of the command line paths
+
+Each path is imported in a fresh interpreter with python -X importtime. The cumulative import time of all top-level imports is reported together with the heavy modules that were pulled in. If a limit is given, the benchmark fails when a path exceeds it, such that regressions can be caught.
+
+Usage:
+
+    python benchmarks/bench_import_time.py [limit for the package import in ms]
+
+'''
+
+import os
+import subprocess
+import sys
+
+
+PATHS = {
+    "package": "import dynamictaxes",
+    "config (dt --config)": "import dynamictaxes.main",
+    "conversion (--load-dir --save-json)": "import dynamictaxes as dt; dt.init_configs(); dt.Loader()",
+    "render (--ta)": "import dynamictaxes as dt; dt.init_configs(); dt.TransientAbsorptionSpectrum(); import matplotlib.pyplot",
+}
+HEAVY_MODULES = ("numpy", "matplotlib", "matplotlib.pyplot")
+
+
+def import_time(code, repeat=3):
+    '''
+    Returns the smallest cumulative import time in ms of the given code over several runs and the heavy modules it imports.
+    '''
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.pathsep + env.get("PYTHONPATH", "")
+    check = code + "; import sys; print(','.join(m for m in " + repr(HEAVY_MODULES) + " if m in sys.modules))"
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", check], capture_output=True, text=True, env=env, check=True)
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            # Top-level imports are not indented
+            if not name.startswith("  "):
+                total += int(cumulative_us)
+        if best is None or total < best:
+            best = total
+    heavy = [m for m in result.stdout.strip().split(",") if m]
+    return best / 1000, heavy
+
+def main():
+    limit = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    failed = False
+    for name, code in PATHS.items():
+        ms, heavy = import_time(code)
+        print("%-40s %8.1f ms   %s" % (name, ms, ", ".join(heavy) if heavy else "-"))
+        if name == "package" and limit is not None and ms > limit:
+            failed = True
+    if failed:
+        print("The package import exceeds the limit of %.1f ms" % limit)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
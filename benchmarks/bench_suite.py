@@ -0,0 +1,166 @@
+'''
+
+Benchmark suite for the load, density, slice and render paths
+
+A synthetic trajectory (see synthetic.py) of the requested size is written to a temporary directory as OUT-Files and as a JSON file. Each path is then timed over several repeats and its peak memory is measured with tracemalloc in a separate run. Rendering uses the Agg backend, so no display is needed. The results are written to a JSON file together with the commit and the versions used, and can be compared with the results of another commit.
+
+Usage:
+
+    python benchmarks/bench_suite.py [--timesteps 500] [--states 20] [--repeat 3] [--output results.json] [--compare baseline.json] [--max-slowdown 1.2] [--only name,...]
+
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dynamictaxes as dt
+import synthetic
+
+
+def load_dir(dirpath):
+    loader = dt.Loader()
+    # load_from_dir prints the list of files, which would flood the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader.load_from_dir(dirpath, workers=1, use_cache=False)
+    return loader
+
+def load_json(jsonpath):
+    loader = dt.Loader()
+    loader.load_from_json(jsonpath)
+    return loader
+
+def make_cases(workdir, timesteps, states):
+    '''
+    Writes the synthetic data and returns a dictionary of the benchmarked paths. Each path is a function without arguments.
+    '''
+    dirpath = os.path.join(workdir, "out")
+    jsonpath = os.path.join(workdir, "content.json")
+    synthetic.generate_out_dir(dirpath, timesteps, states)
+    synthetic.generate_json(jsonpath, timesteps, states)
+    ta = load_json(jsonpath).ta_spectrum
+    esa = ta.esa_spectra[0]
+
+    def density():
+        ta.invalidate()
+        ta.get_spectral_density()
+
+    def avg_slice():
+        ta.invalidate()
+        ta.render_avg_slice(450, 50, os.path.join(workdir, "avg_slice.png"))
+
+    def ta_render():
+        ta.invalidate()
+        ta.render(os.path.join(workdir, "ta.png"))
+
+    return {
+        "load_from_dir": lambda: load_dir(dirpath),
+        "load_from_json": lambda: load_json(jsonpath),
+        "get_spectral_density": density,
+        "render_avg_slice": avg_slice,
+        "render_ta": ta_render,
+        "esa_render": lambda: esa.render(os.path.join(workdir, "esa.png")),
+    }
+
+def measure(function, repeat):
+    '''
+    Returns the durations of repeat calls of function and the peak memory traced during one additional call.
+    '''
+    function()  # warm up imports and caches that are not part of the path
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return durations, peak
+
+def get_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def compare(results, baseline, max_slowdown):
+    '''
+    Prints the ratio of the durations to a baseline and returns the names of all paths that are slower than max_slowdown times the baseline.
+    '''
+    regressions = []
+    print("\nComparison with " + str(baseline["meta"].get("commit")))
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["seconds"] / baseline["results"][name]["seconds"]
+        memory_ratio = result["peak_bytes"] / max(1, baseline["results"][name]["peak_bytes"])
+        print("%-22s %6.2fx time   %6.2fx memory" % (name, ratio, memory_ratio))
+        if max_slowdown is not None and ratio > max_slowdown:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of dynamictaxes")
+    parser.add_argument("--timesteps", type=int, default=500, help="Number of timesteps of the synthetic trajectory")
+    parser.add_argument("--states", type=int, default=20, help="Number of excited states per timestep")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed repeats of each path")
+    parser.add_argument("--output", default=None, help="JSON file to which the results are written")
+    parser.add_argument("--compare", default=None, help="JSON file of a previous run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=None, help="Fail if a path is slower than this factor times the baseline")
+    parser.add_argument("--only", default=None, help="Comma separated names of the paths to run")
+    args = parser.parse_args()
+
+    dt.init_configs()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = make_cases(workdir, args.timesteps, args.states)
+        names = list(cases) if args.only is None else [n.strip() for n in args.only.split(",")]
+        for name in names:
+            durations, peak = measure(cases[name], args.repeat)
+            results[name] = {"seconds": min(durations), "mean_seconds": sum(durations) / len(durations), "repeats": len(durations), "peak_bytes": peak}
+            print("%-22s %10.4f s  %10.1f MiB" % (name, min(durations), peak / 2**20))
+
+    report = {
+        "meta": {
+            "commit": get_commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "timesteps": args.timesteps,
+            "states": args.states,
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "matplotlib": matplotlib.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as of:
+            json.dump(report, of, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_slowdown)
+        if len(regressions) > 0:
+            print("Slower than %.2fx the baseline: %s" % (args.max_slowdown, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''
+
+Generator for synthetic trajectories
+
+Writes QChem-like OUT-Files or JSON files of a given number of timesteps and excited states, such that the loaders and renderers can be benchmarked at any scale without real simulation data. The data is random but reproducible for a given seed.
+
+Usage:
+
+    python benchmarks/synthetic.py <directory or file.json> [timesteps] [states]
+
+'''
+
+import json
+import os
+import sys
+import numpy
+
+
+def random_states(rng, num_states):
+    '''
+    Returns sorted excitation energies in eV from the ground state and the transition strengths from the first excited state to all higher states.
+    '''
+    energies = numpy.sort(rng.uniform(2.0, 8.0, size=num_states))
+    strengths = rng.uniform(0.0, 1.0, size=num_states-1)
+    return energies, strengths
+
+def write_out_file(path, excitation_energies, strengths):
+    '''
+    Writes a minimal QChem-like OUT-File with the sections read by dynamictaxes.loader.parse_out_file.
+    '''
+    lines = ["Welcome to Q-Chem", "$molecule", "0 1", "O 0.0 0.0 0.0", "$end", "", "TDDFT Excitation Energies", ""]
+    for i, e in enumerate(excitation_energies):
+        lines.append(" Excited state %3d: excitation energy (eV) =    %.4f" % (i+1, e))
+        lines.append(" Total energy for state %3d:              -76.00000000 au" % (i+1))
+        lines.append("    Multiplicity: Singlet")
+        lines.append("")
+    lines.append("                    Transition Moments Between Ground and Excited States")
+    lines.append(" " + "-" * 68)
+    lines.append("    States   X           Y           Z           Strength(a.u.)")
+    lines.append(" " + "-" * 68)
+    for i in range(len(excitation_energies)):
+        lines.append("    0 %4d    0.100000    0.100000    0.100000    0.010000" % (i+1))
+    lines.append("")
+    lines.append("                    Transition Moments Between Excited States")
+    lines.append(" " + "-" * 68)
+    lines.append("    States   X           Y           Z           Strength(a.u.)")
+    lines.append(" " + "-" * 68)
+    for i in range(1, len(excitation_energies)):
+        for j in range(i+1, len(excitation_energies)+1):
+            strength = strengths[j-2] if i == 1 else 0.5
+            lines.append("    %d %4d    0.100000    0.100000    0.100000    %.6f" % (i, j, strength))
+    lines.append(" " + "-" * 68)
+    lines.append("Thank you very much for using Q-Chem.")
+    with open(path, "w") as of:
+        of.write("\n".join(lines) + "\n")
+
+def generate_out_dir(dirpath, timesteps, states, seed=0):
+    '''
+    Writes one OUT-File per timestep into dirpath, named traj_<step>.out.
+
+    Parameters
+    ----------
+    dirpath : str
+        The directory, which is created if necessary.
+    timesteps : int
+        Number of OUT-Files.
+    states : int
+        Number of excited states per file. The resulting ESA spectra contain states-1 excitations.
+    seed : int, optional
+        Seed of the random data. Default 0
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    for step in range(timesteps):
+        energies, strengths = random_states(rng, states)
+        write_out_file(os.path.join(dirpath, "traj_" + str(step) + ".out"), energies, strengths)
+
+def generate_json(jsonpath, timesteps, states, seed=0, timestep=0.05):
+    '''
+    Writes a JSON file in the format of dynamictaxes.loader.Loader.save_to_json.
+
+    Parameters
+    ----------
+    jsonpath : str
+        The path of the JSON file.
+    timesteps : int
+        Number of ESA spectra.
+    states : int
+        Number of excited states per timestep. The ESA spectra contain states-1 excitations.
+    seed : int, optional
+        Seed of the random data. Default 0
+    timestep : float, optional
+        Time between two ESA spectra. Default 0.05
+    '''
+    directory = os.path.dirname(jsonpath)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    json_dict = {}
+    for step in range(timesteps):
+        energies, strengths = random_states(rng, states)
+        json_dict["esa" + str(step)] = {
+            "time": step * timestep,
+            "absorption_energies": [float(e) for e in energies[1:] - energies[0]],
+            "transition_moments": [float(s) for s in strengths],
+            "state_number": 1,
+            "multiplicity": 1,
+        }
+    with open(jsonpath, "w") as jsonfile:
+        json.dump(json_dict, jsonfile)
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1]
+    timesteps = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    states = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    if path.endswith(".json"):
+        generate_json(path, timesteps, states)
+    else:
+        generate_out_dir(path, timesteps, states)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,28 +15,44 @@ installer.sh:
 
 '''
 
-import dynamictaxes.excited_state_absorption_spectrum as esa
-import dynamictaxes.transient_absorption_spectrum as tas
-import dynamictaxes.loader as loader
-import dynamictaxes.main as main
+import importlib
 
 
 configs = None
 
-def ExcitedStateAbsorptionSpectrum():
-    return esa.ExcitedStateAbsorptionSpectrum()
-
-def TransientAbsorptionSpectrum():
-    return tas.TransientAbsorptionSpectrum()
-
-def Loader():
-    return loader.Loader()
+# Submodules and the classes they contain are only imported when they are first accessed, such that e.g. dt --config does not import numpy or matplotlib.
+# After the first access, they are stored in the module namespace and accessed without overhead.
+_submodules = {
+    "esa": "dynamictaxes.excited_state_absorption_spectrum",
+    "tas": "dynamictaxes.transient_absorption_spectrum",
+    "loader": "dynamictaxes.loader",
+    "main": "dynamictaxes.main",
+}
+_classes = {
+    "ExcitedStateAbsorptionSpectrum": "esa",
+    "TransientAbsorptionSpectrum": "tas",
+    "Loader": "loader",
+}
+
+def __getattr__(name):
+    if name in _submodules:
+        value = importlib.import_module(_submodules[name])
+    elif name in _classes:
+        value = getattr(__getattr__(_classes[name]), name)
+    else:
+        raise AttributeError("module 'dynamictaxes' has no attribute '" + name + "'")
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules) + list(_classes))
 
 def debug_init_configs():
     configs = {}
     configs["testkey"] = "testval"
 
 def init_configs():
+    import dynamictaxes.main as main
     main.load_configs()
 
 def get_config(name):
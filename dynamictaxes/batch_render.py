@@ -0,0 +1,85 @@
+'''
+
+Parallel rendering of many ESA spectra
+
+This module renders batches of ESA spectra to image files. The spectra are distributed over a pool of worker processes that use the non-interactive Agg backend. Every worker reuses the ESA renderer of its process for all spectra it renders (see dynamictaxes.renderers), which avoids the cost of setting up a new matplotlib figure per frame.
+
+Methods
+-------
+render_esa_batch(esa_spectra, indices, path, filetype='png', workers=None)
+    Render the ESA spectra with the given indices to path_[index].
+
+'''
+
+import concurrent.futures
+import os
+import dynamictaxes as dt
+
+
+def _init_worker(configs):
+    '''
+    Initialises a worker process with the Agg backend and the configs of the parent process.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    dt.set_config(configs)
+
+def _render_chunk(tasks):
+    '''
+    Renders a list of (esa, path, filetype) tuples with the ESA renderer of this process.
+
+    Returns
+    -------
+    paths : list
+        The paths of all rendered images.
+    '''
+    import dynamictaxes.renderers as renderers
+    paths = []
+    for esa, path, filetype in tasks:
+        path = esa.prepare_path(path, filetype)
+        renderers.get_renderer(renderers.ESARenderer, esa.linegraph_size).update(esa).save(path, esa.dpi)
+        paths.append(path)
+    return paths
+
+def render_esa_batch(esa_spectra, indices, path, filetype='png', workers=None):
+    '''
+    This function renders the ESA spectra with the given indices to the files path_[index]. If more than one worker is used, the spectra are split into chunks that are rendered by a pool of worker processes.
+
+    Parameters
+    ----------
+    esa_spectra : list
+        List of ESA spectra.
+    indices : iterable
+        The indices of the spectra that should be rendered.
+    path : str
+        The base path of the images. The index of the spectrum is appended to it.
+    filetype : str, optional
+        The filetype of the images. Default png
+    workers : int, optional
+        Number of worker processes. 1 renders all spectra in this process, 0 uses all available cores. If None, the config render_workers is used. Default None
+
+    Returns
+    -------
+    paths : list
+        The paths of all rendered images in the order of indices.
+    '''
+    tasks = [(esa_spectra[i], path + "_" + str(i), filetype) for i in indices]
+    if workers is None:
+        workers = dt.get_config("render_workers")
+    if workers is None:
+        workers = 1
+    workers = int(workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(tasks)))
+
+    if workers == 1:
+        return _render_chunk(tasks)
+
+    chunksize = max(1, min(64, len(tasks) // (4 * workers)))
+    chunks = [tasks[i:i+chunksize] for i in range(0, len(tasks), chunksize)]
+    paths = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dt.configs,)) as executor:
+        for chunk_paths in executor.map(_render_chunk, chunks):
+            paths.extend(chunk_paths)
+    return paths
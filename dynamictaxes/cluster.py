@@ -0,0 +1,200 @@
+'''
+
+Splitting DT scripts into PBS job arrays
+
+For large datasets, a DT script can be executed as a chain of jobs instead of one serial job. The chain consists of up to three stages:
+
+parse
+    A job array in which every task parses one shard of cluster_shard_size OUT-Files of a directory and writes the result to a partial NPZ file.
+reduce
+    A single job that depends on the parse array. It merges the partial files and executes all commands of the script except for the rendering of multiple ESA spectra. If such commands exist, the merged data is saved to an NPZ file.
+render
+    A job array that depends on the reduce job. Every task renders cluster_shard_size of the requested ESA frames from the merged NPZ file.
+
+The jobs are submitted by a generated bash script that passes the job ids as dependencies. Each task requests cluster_nodes nodes with cluster_ppn cores, which are used for parallel parsing and rendering within the task.
+
+Methods
+-------
+uses_job_arrays(lines)
+    Return whether the DT script should be split into job arrays.
+make_cluster_jobs(lines, args_dict)
+    Generate the python executables, qsub scripts and the submission script of all stages.
+
+'''
+
+import json
+import math
+import dynamictaxes
+import dynamictaxes.dtsl as dtsl
+import dynamictaxes.loader as loader
+import dynamictaxes.main as main
+import dynamictaxes.trajectory_store as trajectory_store
+
+
+def _clean_lines(lines):
+    '''
+    Removes empty lines and comments from DT code.
+    '''
+    cleaned = []
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if len(line) > 0:
+            cleaned.append(line)
+    return cleaned
+
+def _command_name(line):
+    command = dtsl.parse_line(line)
+    if command is None:
+        return None
+    return command[0]
+
+def count_spectra(source):
+    '''
+    This function estimates the number of ESA spectra that are loaded from a source. For directories, this is the number of OUT-Files.
+
+    Parameters
+    ----------
+    source : str
+        A directory, JSON or NPZ file.
+
+    Returns
+    -------
+    num : int
+        The number of spectra.
+    '''
+    if source.endswith(".npz"):
+        return len(trajectory_store.TrajectoryStore(source))
+    if source.endswith(".json"):
+        with open(source, "r") as jsonfile:
+            return len(json.load(jsonfile))
+    return len(loader.find_out_files(source))
+
+def uses_job_arrays(lines):
+    '''
+    This function returns whether a DT script is split into job arrays. This is the case if cluster_shard_size is positive and the script loads a directory or renders multiple ESA spectra.
+
+    Parameters
+    ----------
+    lines : list
+        List of all lines of DT code.
+
+    Returns
+    -------
+    arrays : bool
+        Whether job arrays are used.
+    '''
+    shard_size = dynamictaxes.get_config("cluster_shard_size")
+    if shard_size is None or int(shard_size) <= 0:
+        return False
+    for line in _clean_lines(lines):
+        if _command_name(line) in ("load_dir", "render_esa_batch"):
+            return True
+    return False
+
+def _write(name, text):
+    with open(name, "w") as f:
+        f.write(text)
+
+def make_cluster_jobs(lines, args_dict):
+    '''
+    This function generates the python executables and qsub scripts of all stages as well as the bash script dttemp<selftime>.sh that submits them with the correct dependencies. See the module documentation for a description of the stages.
+
+    Parameters
+    ----------
+    lines : list
+        List of all lines of DT code.
+    args_dict : dict
+        Dictionary of arguments. The key 'selftime' has to be set.
+
+    Returns
+    -------
+    args_dict : dict
+        The modified dictionary of arguments. 'qsubscript' is the name of the submission script and 'job_array' is True.
+    '''
+    selftime = args_dict["selftime"]
+    shard_size = int(dynamictaxes.get_config("cluster_shard_size"))
+    ppn = int(dynamictaxes.get_config("cluster_ppn") or 1)
+    lines = _clean_lines(lines)
+    config_lines = [l for l in lines if l.startswith("set config")]
+    worker_lines = ["set config load_workers to " + str(ppn), "set config render_workers to " + str(ppn), "set config ensemble_workers to " + str(ppn)]
+    merged_path = "dtmerged" + selftime + ".npz"
+
+    shards = []
+    reduce_lines = []
+    render_lines = []
+    num_spectra = 0
+    for line in lines:
+        name = _command_name(line)
+        if name in ("load_dir", "load_json", "load_npz"):
+            source = dtsl.parse_line(line)[1]
+            num_spectra += count_spectra(source)
+            if name == "load_dir":
+                num_files = len(loader.find_out_files(source))
+                for start in range(0, num_files, shard_size):
+                    reduce_lines.append("load dtpart" + selftime + "_" + str(len(shards)) + ".npz")
+                    shards.append((source, start, min(num_files, start + shard_size)))
+                continue
+        elif name == "render_esa_batch":
+            render_lines.append(line)
+            continue
+        reduce_lines.append(line)
+
+    num_frames = 0
+    for line in render_lines:
+        offset, dist, path = dtsl.parse_line(line)[1:]
+        num_frames += len(range(offset, num_spectra, dist))
+    render_tasks = int(math.ceil(num_frames / shard_size))
+    if render_tasks > 0:
+        reduce_lines.append("save npz to " + merged_path)
+
+    submit = "#!/bin/bash\n# This is an automatically generated temp file that submits the jobs of one Dynamic-Taxes execution.\n\n"
+    reduce_depend = ""
+
+    # Parse stage
+    if len(shards) > 0:
+        pyscript = "pytemp" + selftime + "_parse"
+        pytext = main.gen_pytext(worker_lines + config_lines)
+        pytext += "import sys\n\n"
+        pytext += "shards = " + repr(shards) + "\n"
+        pytext += "task = int(sys.argv[1])\n"
+        pytext += "loader = dt.Loader()\n"
+        pytext += "loader.load_from_dir(shards[task][0], use_cache=False, file_range=shards[task][1:])\n"
+        pytext += "loader.save_to_npz(\"dtpart" + selftime + "_\" + str(task) + \".npz\")\n"
+        _write(pyscript + ".py", pytext)
+        _write("dttemp" + selftime + "_parse.sh", main.fill_qsub_template(pyscript, selftime, command="python " + pyscript + ".py $PBS_ARRAYID", cleanup=False))
+        submit += "PARSE_JOB=$(qsub -t 0-" + str(len(shards)-1) + " dttemp" + selftime + "_parse.sh)\n"
+        reduce_depend = "-W depend=afterokarray:$PARSE_JOB "
+
+    # Reduce stage
+    pyscript = "pytemp" + selftime
+    _write(pyscript + ".py", main.gen_pytext(worker_lines + reduce_lines))
+    _write("dttemp" + selftime + "_reduce.sh", main.fill_qsub_template(pyscript, selftime, cleanup=render_tasks == 0))
+    submit += "REDUCE_JOB=$(qsub " + reduce_depend + "dttemp" + selftime + "_reduce.sh)\n"
+    args_dict["pyscript"] = pyscript
+
+    # Render stage
+    if render_tasks > 0:
+        pyscript = "pytemp" + selftime + "_render"
+        pytext = main.gen_pytext(worker_lines + config_lines)
+        pytext += "import sys\n\n"
+        pytext += "task = int(sys.argv[1])\n"
+        pytext += "loader = dt.Loader()\n"
+        pytext += "loader.load_from_npz(\"" + merged_path + "\", lazy=True)\n"
+        pytext += "num_spectra = len(loader.ta_spectrum.esa_spectra)\n"
+        pytext += "frames = []\n"
+        for line in render_lines:
+            offset, dist, path = dtsl.parse_line(line)[1:]
+            pytext += "frames += [(i, \"" + path + "\") for i in range(" + str(offset) + ", num_spectra, " + str(dist) + ")]\n"
+        pytext += "frames = frames[task*" + str(shard_size) + ":(task+1)*" + str(shard_size) + "]\n"
+        pytext += "for path in dict.fromkeys(p for i, p in frames):\n"
+        pytext += "    loader.ta_spectrum.render_esa_batch([i for i, p in frames if p == path], path)\n"
+        _write(pyscript + ".py", pytext)
+        _write("dttemp" + selftime + "_render.sh", main.fill_qsub_template(pyscript, selftime, command="python " + pyscript + ".py $PBS_ARRAYID", cleanup=False))
+        _write("dttemp" + selftime + "_cleanup.sh", main.fill_qsub_template("pytemp" + selftime + "_cleanup", selftime, command="echo \"Removing temporary files\""))
+        submit += "RENDER_JOB=$(qsub -t 0-" + str(render_tasks-1) + " -W depend=afterok:$REDUCE_JOB dttemp" + selftime + "_render.sh)\n"
+        submit += "qsub -W depend=afterokarray:$RENDER_JOB dttemp" + selftime + "_cleanup.sh\n"
+
+    args_dict["qsubscript"] = "dttemp" + selftime
+    args_dict["job_array"] = True
+    _write(args_dict["qsubscript"] + ".sh", submit)
+    return args_dict
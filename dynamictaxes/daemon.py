@@ -0,0 +1,242 @@
+'''
+
+Persistent worker daemon for repeated local executions
+
+Starting Dynamic-Taxes requires starting Python, importing numpy and matplotlib and loading the dataset. The daemon keeps one interpreter running and listens on the Unix socket given by the config daemon_socket. When it is running, local executions of dt are forwarded to it and run in the daemon process.
+
+Loaded datasets are kept in memory. If a script loads the same sources as an earlier script and none of the source files has changed, the loader of the earlier script is reused and only the remaining commands are executed. At most daemon_cache_size datasets are kept.
+
+A request is a JSON object {"cwd": <working directory>, "commands": <list of DTSL commands>}, the response is a JSON object {"ok": <bool>, "output": <captured stdout>, "error": <traceback>}. The request {"stop": true} shuts the daemon down.
+
+Methods
+-------
+get_socket_path()
+    Return the path of the daemon socket.
+serve(socket_path=None)
+    Run the daemon until it is stopped.
+forward(commands, socket_path=None)
+    Execute commands in a running daemon.
+stop(socket_path=None)
+    Stop a running daemon.
+
+'''
+
+import collections
+import contextlib
+import glob
+import io
+import json
+import os
+import socket
+import traceback
+import dynamictaxes
+import dynamictaxes.dtsl as dtsl
+import dynamictaxes.loader as loader
+
+
+def get_socket_path():
+    '''
+    This function returns the path of the daemon socket, which is set in the config daemon_socket.
+
+    Returns
+    -------
+    socket_path : str
+        The absolute path of the socket.
+    '''
+    socket_path = dynamictaxes.get_config("daemon_socket")
+    if socket_path is None:
+        socket_path = "~/.dynamictaxes.sock"
+    return os.path.abspath(os.path.expanduser(str(socket_path)))
+
+def _source_signature(command):
+    '''
+    Returns the size and modification time of all files read by a load command, such that changes of the data invalidate cached datasets.
+    '''
+    if command[0] == "load_ensemble":
+        sources = sorted(glob.glob(command[1]))
+    else:
+        sources = [command[1]]
+    files = []
+    for source in sources:
+        source = os.path.abspath(source)
+        if os.path.isdir(source):
+            files += loader.find_out_files(source)
+        else:
+            files.append(source)
+    signature = []
+    for f in files:
+        st = os.stat(f)
+        signature.append((f, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+def _dataset_key(commands):
+    '''
+    Returns the cache key of the dataset loaded by a list of commands, or None if the dataset cannot be cached. This is the case if data is loaded after it has been saved or rendered.
+    '''
+    key = []
+    rendered = False
+    for command in commands:
+        if command[0].startswith("load"):
+            if rendered:
+                return None
+            key.append((command, _source_signature(command)))
+        elif command[0] == "set_config":
+            if not rendered:
+                key.append(command)
+        else:
+            rendered = True
+    if len(key) == 0:
+        return None
+    return tuple(key)
+
+def _recv_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode())
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode())
+
+class _Daemon:
+    '''
+    The state of a running daemon, i.e. the cache of loaded datasets.
+    '''
+
+    def __init__(self):
+        self.datasets = collections.OrderedDict()
+
+    def execute(self, cwd, commands):
+        '''
+        Executes a list of commands in the directory cwd, reusing a cached dataset if possible.
+        '''
+        commands = [tuple(c) for c in commands]
+        output = io.StringIO()
+        old_cwd = os.getcwd()
+        os.chdir(cwd)
+        try:
+            self._execute(commands, output)
+        finally:
+            os.chdir(old_cwd)
+        return output.getvalue()
+
+    def _execute(self, commands, output):
+        with contextlib.redirect_stdout(output):
+            key = _dataset_key(commands)
+            if key is not None and key in self.datasets:
+                self.datasets.move_to_end(key)
+                dtsl.run([c for c in commands if not c[0].startswith("load")], loader=self.datasets[key])
+            else:
+                ld = dtsl.run(commands)
+                if key is not None:
+                    self.datasets[key] = ld
+                    cache_size = dynamictaxes.get_config("daemon_cache_size")
+                    if cache_size is None:
+                        cache_size = 4
+                    while len(self.datasets) > max(0, int(cache_size)):
+                        self.datasets.popitem(last=False)
+
+def serve(socket_path=None):
+    '''
+    This function runs the daemon in the current process until it receives a stop request. Rendering uses the non-interactive Agg backend.
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The path of the socket. If None, get_socket_path is used. Default None
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    if socket_path is None:
+        socket_path = get_socket_path()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    daemon = _Daemon()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        server.listen(1)
+        print("Dynamic-Taxes daemon listening on " + socket_path)
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    request = _recv_all(conn)
+                except ValueError:
+                    continue
+                if request.get("stop", False):
+                    _send(conn, {"ok": True, "output": "", "error": ""})
+                    break
+                try:
+                    output = daemon.execute(request["cwd"], request["commands"])
+                    _send(conn, {"ok": True, "output": output, "error": ""})
+                except Exception:
+                    _send(conn, {"ok": False, "output": "", "error": traceback.format_exc()})
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def _request(message, socket_path=None):
+    '''
+    Sends a request to the daemon and returns its response, or None if no daemon is running.
+    '''
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    if socket_path is None:
+        socket_path = get_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+    with client:
+        _send(client, message)
+        client.shutdown(socket.SHUT_WR)
+        return _recv_all(client)
+
+def forward(commands, socket_path=None):
+    '''
+    This function executes a list of DTSL commands in a running daemon. The output of the daemon is printed. If the script fails in the daemon, a RuntimeError with the traceback of the daemon is raised, just like the script would raise when run in this process.
+
+    Parameters
+    ----------
+    commands : list
+        List of commands as returned by dynamictaxes.dtsl.parse_script.
+    socket_path : str, optional
+        The path of the socket. If None, get_socket_path is used. Default None
+
+    Returns
+    -------
+    forwarded : bool
+        Whether a daemon was running and executed the commands.
+    '''
+    response = _request({"cwd": os.getcwd(), "commands": commands}, socket_path)
+    if response is None:
+        return False
+    print(response["output"], end="")
+    if not response["ok"]:
+        raise RuntimeError("The script failed in the Dynamic-Taxes daemon:\n" + response["error"])
+    return True
+
+def stop(socket_path=None):
+    '''
+    This function stops a running daemon.
+
+    Parameters
+    ----------
+    socket_path : str, optional
+        The path of the socket. If None, get_socket_path is used. Default None
+
+    Returns
+    -------
+    stopped : bool
+        Whether a daemon was running.
+    '''
+    return _request({"stop": True}, socket_path) is not None
@@ -0,0 +1,250 @@
+'''
+
+Parsing and execution of DTSL (Dynamic-Taxes Scripting Language)
+
+A DT script is parsed into a list of commands, which can either be executed directly in the current process or be translated into a Python executable for the execution on a cluster. Every command is a tuple whose first entry is the name of the command, followed by its arguments:
+
+("set_config", key, value)
+("load_dir", path), ("load_json", path), ("load_npz", path)
+("load_ensemble", pattern, timestep)
+("save_json", path, compact), ("save_npz", path, compressed)
+("render_ta", path), ("render_ta_raw", path)
+("render_esa", index, path)
+("render_esa_batch", offset, dist, path)
+("render_esa_movie", path)
+("render_slice", wavelength, path)
+("render_avg_slice", wavelength, span, path)
+
+Methods
+-------
+parse_line(line)
+    Parse a single line of DT code into a command.
+parse_script(lines)
+    Parse DT code into a list of commands.
+to_pytext(commands)
+    Generate a Python executable from a list of commands.
+run(commands, loader=None, reset_configs=True)
+    Execute a list of commands in the current process.
+
+'''
+
+import dynamictaxes
+
+
+def _parse_set_config(line):
+    import dynamictaxes.main as main
+    return main.parse_set_config(line)
+
+def parse_line(line):
+    '''
+    This function parses a single line of DT code into a command. See the README for the syntax.
+
+    Parameters
+    ----------
+    line : str
+        The line of DT code.
+
+    Returns
+    -------
+    command : tuple or None
+        The command, or None if the line is empty, a comment or not a command.
+    '''
+    if '#' in line:
+        line = line.split('#')[0]
+    line = line.strip()
+    if len(line) == 0:
+        return None
+
+    if line.startswith("set config"):
+        key, val = _parse_set_config(line)
+        return ("set_config", key, val)
+    if line.startswith("load ensemble"):
+        line_list = line.split()
+        assert len(line_list) in (3, 5) and (len(line_list) == 3 or line_list[3] == "timestep"), f"Illegal syntax. Must be like \"load ensemble traj_*/ [timestep 0.5]\""
+        timestep = float(line_list[4]) if len(line_list) == 5 else None
+        return ("load_ensemble", line_list[2], timestep)
+    if line.startswith("load") or line.startswith("read"):
+        path = line[4:].strip()
+        if path.endswith(".json"):
+            return ("load_json", path)
+        elif path.endswith(".npz"):
+            return ("load_npz", path)
+        return ("load_dir", path)
+    if line.startswith("save json to") or line.startswith("save npz to"):
+        save_npz = line.startswith("save npz to")
+        prefix = "save npz to" if save_npz else "save json to"
+        line = line[len(prefix):].strip()
+        savepath = line.split()[0]
+        if save_npz or savepath.endswith(".npz"):
+            return ("save_npz", savepath, 'compressed' in line.lower())
+        return ("save_json", savepath, 'compact' in line.lower())
+    if line.startswith("render"):
+        line_list = line.split()
+        if line_list[1].lower() == 'ta' and line_list[2].lower() == "raw":
+            assert len(line_list) == 5 and line_list[3] == "to", f"Illegal syntax. Must be like \"render ta raw to ...\""
+            return ("render_ta_raw", line_list[4])
+        if line_list[1].lower() == 'ta':
+            assert line_list[2] == "to", f"Illegal syntax. Must be like \"render ta to ...\""
+            return ("render_ta", line_list[3])
+        elif line_list[1].lower() == "all" and line_list[2].lower() == "esa":
+            assert line_list[3] == "to", f"Illegal syntax. Must be like \"render all esa to ...\""
+            return ("render_esa_batch", 0, 1, line_list[4])
+        elif line_list[1].lower() == "every" and line_list[3].lower() == "esa":
+            dist = line_list[2]
+            offset = "0"
+            if '+' in line_list[2]:
+                dist = line_list[2].split("+")[0]
+                offset = line_list[2].split("+")[1]
+            assert dist.isdigit() and offset.isdigit() and line_list[4] == "to", f"Illegal syntax. Must be like \"render every 2[+1] esa to ...\""
+            assert int(dist) > 0, f"Stepsize in ESA rendering must be positive."
+            return ("render_esa_batch", int(offset), int(dist), line_list[5])
+        elif line_list[1].lower() == "esa" and line_list[2].lower() == "movie":
+            assert len(line_list) == 5 and line_list[3] == "to", f"Illegal syntax. Must be like \"render esa movie to out.mp4\""
+            return ("render_esa_movie", line_list[4])
+        elif line_list[1].lower() == "esa" and line_list[2].isdigit():
+            assert line_list[3] == "to", f"Illegal syntax. Must be like \"render esa 5 to ...\""
+            return ("render_esa", int(line_list[2]), line_list[4])
+        elif line_list[1].lower() == "slice":
+            assert line_list[2] == "at" and line_list[3] == "wavelength" and line_list[4].isdigit() and line_list[5] == "to", f"Illegal syntax. Must be like \"render slice at wavelength 250 to ...\""
+            return ("render_slice", int(line_list[4]), line_list[6])
+        elif (line_list[1].lower() == "averaged" or line_list[1].lower() == "avg") and line_list[2] == "slice":
+            assert line_list[3] == "at" and line_list[4] == "wavelength" and line_list[5].isdigit() and line_list[6] == "spanning" and line_list[7].isdigit() and line_list[8] == "to", f"Illegal syntax. Must be like \"render avg slice at wavelength 250 spanning 50 to ...\""
+            return ("render_avg_slice", int(line_list[5]), int(line_list[7]), line_list[9])
+    return None
+
+def parse_script(lines):
+    '''
+    This function parses DT code into a list of commands. Saving and rendering commands are only allowed after data has been loaded.
+
+    Parameters
+    ----------
+    lines : list
+        List of all lines of DT code.
+
+    Returns
+    -------
+    commands : list
+        List of commands.
+    '''
+    commands = []
+    loaded = False
+    for line in lines:
+        command = parse_line(line)
+        if command is None:
+            continue
+        if command[0].startswith("load"):
+            loaded = True
+        elif command[0].startswith("save") and not loaded:
+            raise Exception("Must load data first before in can be saved")
+        elif command[0].startswith("render") and not loaded:
+            raise Exception("Must load data first before it can be rendered.")
+        commands.append(command)
+    return commands
+
+def to_pytext(commands):
+    '''
+    This function generates a Python executable from a list of commands. This is used for the execution on a cluster.
+
+    Parameters
+    ----------
+    commands : list
+        List of commands as returned by parse_script.
+
+    Returns
+    -------
+    pytext : str
+        The content of the Python executable.
+    '''
+    pytext = "# This is an automatically generated temp file that is used for program execution.\n\nimport dynamictaxes as dt\ndt.init_configs()\n\n"
+    loader_exists = False
+    esa_shortcut = False
+    for command in commands:
+        name, args = command[0], command[1:]
+        if name == "set_config":
+            pytext += "dt.set_config_key(\"" + args[0] + "\", " + repr(args[1]) + ")\n"
+        elif name.startswith("load"):
+            if not loader_exists:
+                pytext += "loader = dt.Loader()\n"
+                loader_exists = True
+            if name == "load_ensemble":
+                pytext += "loader.load_ensemble(\"" + args[0] + "\", timestep=" + repr(args[1]) + ")\n"
+                continue
+            method = {"load_dir": "load_from_dir", "load_json": "load_from_json", "load_npz": "load_from_npz"}[name]
+            pytext += "loader." + method + "(\"" + args[0] + "\")\n"
+        elif name == "save_npz":
+            pytext += "loader.save_to_npz(\"" + args[0] + "\", compressed=" + str(args[1]) + ")\n"
+        elif name == "save_json":
+            pytext += "loader.save_to_json(\"" + args[0] + "\", compact=" + str(args[1]) + ")\n"
+        elif name == "render_ta":
+            pytext += "loader.ta_spectrum.render(\"" + args[0] + "\")\n"
+        elif name == "render_ta_raw":
+            pytext += "loader.ta_spectrum.render_raw(\"" + args[0] + "\")\n"
+        elif name == "render_esa_batch":
+            pytext += "loader.ta_spectrum.render_esa_batch(range(" + str(args[0]) + ", len(loader.ta_spectrum.esa_spectra), " + str(args[1]) + "), \"" + args[2] + "\")\n"
+        elif name == "render_esa_movie":
+            pytext += "loader.ta_spectrum.render_esa_movie(\"" + args[0] + "\")\n"
+        elif name == "render_esa":
+            if not esa_shortcut:
+                pytext += "esa_spectra = loader.ta_spectrum.esa_spectra\n"
+                esa_shortcut = True
+            pytext += "esa_spectra[" + str(args[0]) + "].render(\"" + args[1] + "\")\n"
+        elif name == "render_slice":
+            pytext += "loader.ta_spectrum.render_mono_slice(" + str(args[0]) + ", \"" + args[1] + "\")\n"
+        elif name == "render_avg_slice":
+            pytext += "loader.ta_spectrum.render_avg_slice(" + str(args[0]) + ", " + str(args[1]) + ", \"" + args[2] + "\")\n"
+    return pytext
+
+def run(commands, loader=None, reset_configs=True):
+    '''
+    This function executes a list of commands in the current process. This avoids starting a new interpreter and allows running several scripts in a row.
+
+    Parameters
+    ----------
+    commands : list
+        List of commands as returned by parse_script.
+    loader : dynamictaxes.Loader, optional
+        The loader on which the commands operate. If None, a new loader is created. Default None
+    reset_configs : bool, optional
+        Whether the configs are reloaded from default.config before execution, such that set config commands of earlier scripts have no effect. Default True
+
+    Returns
+    -------
+    loader : dynamictaxes.Loader
+        The loader containing the data after execution.
+    '''
+    if reset_configs:
+        dynamictaxes.init_configs()
+    if loader is None:
+        loader = dynamictaxes.Loader()
+    for command in commands:
+        name, args = command[0], command[1:]
+        ta_spectrum = loader.ta_spectrum
+        if name == "set_config":
+            dynamictaxes.set_config_key(args[0], args[1])
+        elif name == "load_dir":
+            loader.load_from_dir(args[0])
+        elif name == "load_json":
+            loader.load_from_json(args[0])
+        elif name == "load_npz":
+            loader.load_from_npz(args[0])
+        elif name == "load_ensemble":
+            loader.load_ensemble(args[0], timestep=args[1])
+        elif name == "save_npz":
+            loader.save_to_npz(args[0], compressed=args[1])
+        elif name == "save_json":
+            loader.save_to_json(args[0], compact=args[1])
+        elif name == "render_ta":
+            ta_spectrum.render(args[0])
+        elif name == "render_ta_raw":
+            ta_spectrum.render_raw(args[0])
+        elif name == "render_esa_batch":
+            ta_spectrum.render_esa_batch(range(args[0], len(ta_spectrum.esa_spectra), args[1]), args[2])
+        elif name == "render_esa_movie":
+            ta_spectrum.render_esa_movie(args[0])
+        elif name == "render_esa":
+            ta_spectrum.esa_spectra[args[0]].render(args[1])
+        elif name == "render_slice":
+            ta_spectrum.render_mono_slice(args[0], args[1])
+        elif name == "render_avg_slice":
+            ta_spectrum.render_avg_slice(args[0], args[1], args[2])
+    return loader
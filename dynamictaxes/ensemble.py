@@ -0,0 +1,346 @@
+'''
+
+Ensemble averaging of TA spectra over many trajectories
+
+The spectral density of each trajectory is evaluated on a common wavelength grid and added to time bins of width timestep, where bin k is centred at start + k*timestep. Only the mean, the sum of squared deviations from the mean and the number of spectra are stored per bin, so the memory required does not grow with the number of trajectories. New spectra and partial results are combined with the pairwise update of Chan et al., which keeps the variance accurate even if the spread is small compared to the mean. Accumulators of different processes can be merged, which allows parallelising the reduction.
+
+The ensemble average is rendered through the usual methods of TransientAbsorptionSpectrum by wrapping it in an EnsembleSpectrum.
+
+Methods
+-------
+accumulate_ensemble(sources, timestep, start=0.0, workers=None)
+    Accumulate the spectral densities of many trajectories, optionally in parallel.
+
+'''
+
+import concurrent.futures
+import os
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.spectral_density as sd
+import dynamictaxes.transient_absorption_spectrum as tas
+
+
+class EnsembleAccumulator:
+    '''
+    This class accumulates the time-binned spectral density of many trajectories.
+
+    Attributes
+    ----------
+    timestep : float
+        Width of the time bins.
+    start : float
+        Centre of the first time bin. Spectra at earlier times are ignored.
+    wavelength_range : float, float
+        Lower and upper end of the wavelength grid. Loaded from default.config unless given.
+    wavelength_res : int
+        Number of points of the wavelength grid. Loaded from default.config unless given.
+    peak_breadth : float
+        Breadth of a single Gaussian peak. Loaded from default.config unless given.
+    means : ndarray
+        Mean of the spectral densities in each bin, of shape (bins, wavelength_res).
+    m2 : ndarray
+        Sum of the squared deviations of the spectral densities from the mean in each bin, of shape (bins, wavelength_res).
+    counts : ndarray
+        Number of spectra in each bin.
+    num_trajectories : int
+        Number of accumulated trajectories.
+
+    Methods
+    -------
+    add_density(times, density, memory_budget=None)
+        Add the spectral density of one trajectory.
+    add_trajectory(source)
+        Load a trajectory and add its spectral density.
+    merge(other)
+        Add the data of another accumulator.
+    get_times()
+        Return the centres of all non-empty bins.
+    mean()
+        Return the mean spectral density of all non-empty bins.
+    variance()
+        Return the variance of the spectral density of all non-empty bins.
+    to_ta_spectrum()
+        Return the mean as an EnsembleSpectrum.
+    '''
+
+    def __init__(self, timestep, start=0.0, wavelength_range=None, wavelength_res=None, peak_breadth=None):
+        if timestep <= 0:
+            raise ValueError("The timestep of an ensemble must be positive.")
+        if wavelength_range is None:
+            wavelength_range = [dt.get_config("wavelength_range_lower"), dt.get_config("wavelength_range_upper")]
+        if wavelength_res is None:
+            wavelength_res = dt.get_config("wavelength_res")
+        if peak_breadth is None:
+            peak_breadth = dt.get_config("peak_breadth")
+        self.timestep = float(timestep)
+        self.start = float(start)
+        self.wavelength_range = [float(wavelength_range[0]), float(wavelength_range[1])]
+        self.wavelength_res = int(wavelength_res)
+        self.peak_breadth = float(peak_breadth)
+        self.means = numpy.zeros((0, self.wavelength_res))
+        self.m2 = numpy.zeros((0, self.wavelength_res))
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        self.num_trajectories = 0
+
+    def _grow(self, num_bins):
+        '''
+        Enlarges the arrays to at least num_bins bins.
+        '''
+        if num_bins <= len(self.counts):
+            return
+        extra = num_bins - len(self.counts)
+        self.means = numpy.concatenate((self.means, numpy.zeros((extra, self.wavelength_res))))
+        self.m2 = numpy.concatenate((self.m2, numpy.zeros((extra, self.wavelength_res))))
+        self.counts = numpy.concatenate((self.counts, numpy.zeros(extra, dtype=numpy.int64)))
+
+    def _combine(self, bins, counts, means, m2):
+        '''
+        Adds the statistics of counts spectra with the given means and m2 to the given bins.
+        '''
+        old_counts = self.counts[bins]
+        new_counts = old_counts + counts
+        delta = means - self.means[bins]
+        self.means[bins] += delta * (counts / new_counts)[:, None]
+        self.m2[bins] += m2 + delta * delta * (old_counts * counts / new_counts)[:, None]
+        self.counts[bins] = new_counts
+
+    def add_density(self, times, density, memory_budget=None):
+        '''
+        This method adds the spectral density of one trajectory.
+
+        Parameters
+        ----------
+        times : ndarray
+            Times of the spectra.
+        density : ndarray or numpy.memmap
+            Spectral density of shape (len(times), wavelength_res) on the wavelength grid of this accumulator.
+        memory_budget : int, optional
+            Memory in bytes available for the chunks of the density that are read at once, see dynamictaxes.spectral_density.row_chunks. If None, the default chunk size is used. Default None
+        '''
+        times = numpy.asarray(times, dtype=float)
+        if not hasattr(density, "shape"):
+            density = numpy.asarray(density, dtype=float)
+        if density.shape != (len(times), self.wavelength_res):
+            raise ValueError("The density has shape " + str(density.shape) + ", expected " + str((len(times), self.wavelength_res)))
+        all_bins = numpy.rint((times - self.start) / self.timestep).astype(numpy.int64)
+        self.num_trajectories += 1
+        if len(all_bins) > 0 and numpy.amax(all_bins) >= 0:
+            self._grow(int(numpy.amax(all_bins)) + 1)
+
+        # The density is read chunk by chunk, so memory mapped densities are never loaded at once
+        for start, stop in sd.row_chunks(len(times), self.wavelength_res, memory_budget):
+            bins = all_bins[start:stop]
+            valid = bins >= 0
+            if not numpy.any(valid):
+                continue
+            bins, chunk = bins[valid], numpy.asarray(density[start:stop], dtype=float)[valid]
+            order = numpy.argsort(bins, kind='stable')
+            bins, chunk = bins[order], chunk[order]
+            unique_bins, starts, counts = numpy.unique(bins, return_index=True, return_counts=True)
+            means = numpy.add.reduceat(chunk, starts, axis=0) / counts[:, None]
+            deviations = chunk - numpy.repeat(means, counts, axis=0)
+            self._combine(unique_bins, counts, means, numpy.add.reduceat(deviations * deviations, starts, axis=0))
+
+    def add_trajectory(self, source):
+        '''
+        This method loads a trajectory and adds its spectral density. The source is loaded in this process, see dynamictaxes.loader.Loader.
+
+        Parameters
+        ----------
+        source : str
+            A directory of OUT-Files, a JSON file or an NPZ file.
+        '''
+        loader = dt.Loader()
+        if source.endswith(".json"):
+            loader.load_from_json(source)
+        elif source.endswith(".npz"):
+            loader.load_from_npz(source)
+        else:
+            loader.load_from_dir(source, workers=1)
+        ta = loader.ta_spectrum
+        ta.wavelength_range = list(self.wavelength_range)
+        ta.wavelength_res = self.wavelength_res
+        ta.peak_breadth = self.peak_breadth
+        self.add_density(ta.get_times(), ta.get_spectral_density(), memory_budget=ta.get_memory_budget())
+
+    def merge(self, other):
+        '''
+        This method adds the data of another accumulator with the same grid.
+
+        Parameters
+        ----------
+        other : EnsembleAccumulator
+            The other accumulator.
+        '''
+        if (other.timestep, other.start, other.wavelength_range, other.wavelength_res, other.peak_breadth) != (self.timestep, self.start, self.wavelength_range, self.wavelength_res, self.peak_breadth):
+            raise ValueError("Only ensembles with the same time and wavelength grid can be merged.")
+        self._grow(len(other.counts))
+        filled = numpy.flatnonzero(other.counts)
+        self._combine(filled, other.counts[filled], other.means[filled], other.m2[filled])
+        self.num_trajectories += other.num_trajectories
+
+    def get_times(self):
+        '''
+        This method returns the centres of all bins that contain at least one spectrum.
+
+        Returns
+        -------
+        times : ndarray
+            1D ndarray of the bin centres.
+        '''
+        return self.start + self.timestep * numpy.flatnonzero(self.counts)
+
+    def mean(self):
+        '''
+        This method returns the mean spectral density of all bins that contain at least one spectrum.
+
+        Returns
+        -------
+        density : ndarray
+            2D ndarray of shape (len(get_times()), wavelength_res).
+        '''
+        return self.means[self.counts > 0]
+
+    def variance(self):
+        '''
+        This method returns the variance of the spectral density of all bins that contain at least one spectrum.
+
+        Returns
+        -------
+        variance : ndarray
+            2D ndarray of shape (len(get_times()), wavelength_res).
+        '''
+        filled = self.counts > 0
+        return self.m2[filled] / self.counts[filled, None]
+
+    def to_ta_spectrum(self):
+        '''
+        This method returns the mean spectral density as an EnsembleSpectrum, which can be rendered like a TransientAbsorptionSpectrum.
+
+        Returns
+        -------
+        ta_spectrum : EnsembleSpectrum
+            The ensemble averaged TA spectrum.
+        '''
+        return EnsembleSpectrum(self)
+
+
+class EnsembleSpectrum(tas.TransientAbsorptionSpectrum):
+    '''
+    A TA spectrum whose spectral density is the fixed mean of an ensemble. It contains no ESA spectra, all renders use the mean density, and it cannot be saved as JSON or NPZ. Intensities are only known on the wavelength grid of the ensemble and are interpolated in between, therefore averaged slices always use the grid mode. Mono slices are rendered with bands of one and two standard deviations of the ensemble around the mean.
+
+    Attributes
+    ----------
+    ensemble : EnsembleAccumulator
+        The accumulator from which the spectrum was created.
+
+    Methods
+    -------
+    get_stdev_density()
+        Return the standard deviation of the spectral density over the ensemble.
+    '''
+
+    def __init__(self, ensemble):
+        super().__init__()
+        self.ensemble = ensemble
+        self.wavelength_range = list(ensemble.wavelength_range)
+        self.wavelength_res = ensemble.wavelength_res
+        self.peak_breadth = ensemble.peak_breadth
+        self.timestep = ensemble.timestep
+        self._times = ensemble.get_times()
+        self._density = ensemble.mean()
+        self._density.flags.writeable = False
+        self._stdev_density = None
+
+    def get_times(self):
+        return self._times
+
+    def get_spectral_density(self, chunk_size=None):
+        return self._density
+
+    def get_stdev_density(self):
+        '''
+        This method returns the standard deviation of the spectral density over the trajectories of the ensemble. It is computed on first use and is read-only.
+
+        Returns
+        -------
+        stdev : ndarray
+            2D ndarray of the same shape as get_spectral_density().
+        '''
+        if self._stdev_density is None:
+            self._stdev_density = numpy.sqrt(self.ensemble.variance())
+            self._stdev_density.flags.writeable = False
+        return self._stdev_density
+
+    def get_mono_slice(self, wavelength):
+        intensities = self.interpolate_density(float(wavelength))
+        return intensities, self._interpolate_grid(self.get_stdev_density(), numpy.array([float(wavelength)]))[:, 0]
+
+    def get_avg_slice(self, centre, span, intres=100, mode=None):
+        return super().get_avg_slice(centre, span, intres=intres, mode="grid")
+
+    def evaluate(self, nm, chunk_size=None):
+        nm_vals = numpy.atleast_1d(numpy.asarray(nm, dtype=float))
+        if numpy.any(nm_vals < self.wavelength_range[0]) or numpy.any(nm_vals > self.wavelength_range[1]):
+            raise ValueError("An ensemble spectrum is only known between " + str(self.wavelength_range[0]) + " and " + str(self.wavelength_range[1]) + " nm.")
+        return self.interpolate_density(nm)
+
+
+def _init_worker(configs):
+    '''
+    Initialises a worker process with the configs of the parent process.
+    '''
+    dt.set_config(configs)
+
+def _accumulate_chunk(args):
+    '''
+    Accumulates a list of sources into a new accumulator.
+    '''
+    sources, grid = args
+    accumulator = EnsembleAccumulator(*grid)
+    for source in sources:
+        accumulator.add_trajectory(source)
+    return accumulator
+
+def accumulate_ensemble(sources, timestep, start=0.0, workers=None):
+    '''
+    This function accumulates the spectral densities of many trajectories. If more than one worker is used, the sources are distributed over a pool of worker processes, each of which accumulates its share before the partial results are merged.
+
+    Parameters
+    ----------
+    sources : list
+        Directories of OUT-Files, JSON files or NPZ files, one per trajectory.
+    timestep : float
+        Width of the time bins.
+    start : float, optional
+        Centre of the first time bin. Default 0.0
+    workers : int, optional
+        Number of worker processes. 1 accumulates all trajectories in this process, 0 uses all available cores. If None, the config ensemble_workers is used. Default None
+
+    Returns
+    -------
+    accumulator : EnsembleAccumulator
+        The accumulated ensemble.
+    '''
+    accumulator = EnsembleAccumulator(timestep, start=start)
+    grid = (accumulator.timestep, accumulator.start, accumulator.wavelength_range, accumulator.wavelength_res, accumulator.peak_breadth)
+    if workers is None:
+        workers = dt.get_config("ensemble_workers")
+    if workers is None:
+        workers = 1
+    workers = int(workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(sources)))
+
+    if workers == 1:
+        for source in sources:
+            accumulator.add_trajectory(source)
+        return accumulator
+
+    chunks = [(sources[i::workers], grid) for i in range(workers)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dt.configs,)) as executor:
+        for partial in executor.map(_accumulate_chunk, chunks):
+            accumulator.merge(partial)
+    return accumulator
@@ -7,19 +7,70 @@ This class serves as a container for all ESA data as well as a wrapper for the i
 '''
 
 import numpy
-import matplotlib.pyplot as plt
-import matplotlib
-import matplotlib.colors as colours
-import json
-import re
 import os
 import dynamictaxes as dt
+import dynamictaxes.spectral_density as sd
+
+# matplotlib is imported inside the drawing methods, such that loading and converting data does not import it.
+
+
+_colourmap = None
+
+def _get_colourmap():
+    '''
+    This function returns the colourmap and normalisation used for colouring wavelengths. Both are created on first use and shared by all ESA spectra.
+
+    Returns
+    -------
+    cmap : matplotlib.colors.Colormap
+        The spectral colourmap.
+    norm : matplotlib.colors.Normalize
+        Normalisation of the visible range of wavelengths.
+    '''
+    global _colourmap
+    if _colourmap is None:
+        import matplotlib
+        import matplotlib.colors as colours
+        _colourmap = (matplotlib.colormaps['Spectral'], colours.Normalize(vmin=350, vmax=820, clip=False))
+    return _colourmap
+
+def _config_property(name, *config_keys):
+    '''
+    This function creates a property for a render setting. Unless the setting has been set explicitly on an instance, it is read from the configs on access. Settings consisting of multiple config keys are returned as a list.
+
+    Parameters
+    ----------
+    name : str
+        The name of the setting.
+    config_keys : str
+        One or more config keys from which the setting is read.
+
+    Returns
+    -------
+    prop : property
+        The property.
+    '''
+    def getter(self):
+        if self._settings is not None and name in self._settings:
+            return self._settings[name]
+        if len(config_keys) == 1:
+            return dt.get_config(config_keys[0])
+        return [dt.get_config(key) for key in config_keys]
+
+    def setter(self, val):
+        if self._settings is None:
+            self._settings = {}
+        self._settings[name] = val
+
+    return property(getter, setter)
 
 
 class ExcitedStateAbsorptionSpectrum:
     '''
     This class is used to store required attributes of Excited State Absorption (ESA) Spectra as well as contain the methods required for rendering and utilities.
 
+    The class uses __slots__ to keep instances small. Render settings are not copied into each instance, they are read from the configs on access unless they have been set explicitly for this instance. The colourmap is created on first use and shared between all instances.
+
     Attributes
     ----------
     state_num : int
@@ -34,8 +85,12 @@ class ExcitedStateAbsorptionSpectrum:
         Array of transition moments. Note that this has to have the exact same shape as energies
     excited_state_labels : str
         Labels of excited states for rendering purposes
+    time : float
+        Time of the spectrum.
     peak_breadth : float
         Breadth of drawn Gaussians in nm. Loaded from default.config
+    density_tolerance : float
+        Relative tolerance below which Gaussians are truncated in evaluate. 0 evaluates all Gaussians everywhere. Loaded from default.config
     resolution : int
         Number of points considered on the x-axis. Loaded from default.config
     dpi : int
@@ -51,6 +106,8 @@ class ExcitedStateAbsorptionSpectrum:
 
     Methods
     -------
+    prepare_path(path, filetype='png')
+        Adds the file ending to the given path if necessary and creates required folders.
     render(path, filetype='png')
         Renders the ESA spectrum to the given path and creates required folders.
     evaluate(nm)
@@ -65,23 +122,28 @@ class ExcitedStateAbsorptionSpectrum:
         Reformats the given state label into LaTeX appropriate markdown.
     '''
 
+    __slots__ = ("state_num", "multiplicity", "time", "energies", "transition_moments", "excited_state_labels", "_settings")
+
     def __init__(self):
         self.state_num = 0
         self.multiplicity = 1
         self.time = 0
         self.energies = numpy.zeros(1)
-        self.energy_unit = dt.get_config("energy_unit")
         self.transition_moments = numpy.zeros(1)
         self.excited_state_labels = ["S1"]
-        self.peak_breadth = dt.get_config("peak_breadth")
-        self.resolution = dt.get_config("wavelength_res")
-        self.dpi = dt.get_config("dpi")
-        self.wavelength_range = [dt.get_config("wavelength_range_lower"), dt.get_config("wavelength_range_upper")]
-        self.normalise_peakheight = dt.get_config("normalise_peak_height")
-        self.peak_style = dt.get_config("peak_style")
-        self._cmap = matplotlib.colormaps['Spectral']
-        self._norm = colours.Normalize(vmin=350, vmax=820, clip=False)
-        self.linegraph_size = (dt.get_config("linegraph_width"), dt.get_config("linegraph_height"))
+        self._settings = None
+
+    energy_unit = _config_property("energy_unit", "energy_unit")
+    peak_breadth = _config_property("peak_breadth", "peak_breadth")
+    density_tolerance = _config_property("density_tolerance", "density_tolerance")
+    resolution = _config_property("resolution", "wavelength_res")
+    dpi = _config_property("dpi", "dpi")
+    wavelength_range = _config_property("wavelength_range", "wavelength_range_lower", "wavelength_range_upper")
+    normalise_peakheight = _config_property("normalise_peakheight", "normalise_peak_height")
+    peak_style = _config_property("peak_style", "peak_style")
+    linegraph_size = _config_property("linegraph_size", "linegraph_width", "linegraph_height")
+    _cmap = property(lambda self: _get_colourmap()[0])
+    _norm = property(lambda self: _get_colourmap()[1])
 
     def __eq__(self, other):
         if len(self.energies) != len(other.energies):
@@ -93,6 +155,30 @@ class ExcitedStateAbsorptionSpectrum:
                 return False
         return True
 
+    def prepare_path(self, path, filetype='png'):
+        '''
+        This method prepares the given path for rendering. If the file name has no file ending, filetype is added. Directories of the path that do not exist are created.
+
+        Parameters
+        ----------
+        path : str
+            The path that should be prepared.
+        filetype : str, optional
+            The file ending that is added if the path has none. Default png
+
+        Returns
+        -------
+        path : str
+            The prepared path.
+        '''
+        ending = os.path.splitext(os.path.basename(path))[1][1:]
+        if not ending.isalpha():
+            path += "." + filetype
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+        return path
+
     def render(self, path, filetype='png'):
         '''
         Principal method of the ESA class. Renders the ESA spectrum to the given path with given filetype. If the directory of the path or parent directories thereof are not existant, they are created. Similarly, if the path already contains a file ending, the filetype attribute is ignored. Otherwise, it is added.
@@ -105,113 +191,66 @@ class ExcitedStateAbsorptionSpectrum:
             The file ending. Default png
 
         '''
-        filepattern = re.compile("[a-zA-Z0-9\-]*\." + filetype)
-        match1 = filepattern.match(path)
-        add_filetype = match1 is None
-        if not add_filetype:
-            add_filetype = match1.string != path
-        if not add_filetype:
-            filepattern2 = re.compile("[a-zA-Z0-9\-]*\.")
-            match2 = filepattern2.match(path)
-            add_point = match is None
-            if not add_point:
-                add_point = match2.string != path
-            if add_point:
-                path += "."
-            path += filetype
-        directory = path[:path.rfind("/")]
-        os.makedirs(directory, exist_ok=True)
-
-        wavelength_space = numpy.linspace(self.wavelength_range[0], self.wavelength_range[1], num=self.resolution)
-        norm_tm = numpy.copy(self.transition_moments)
-        if self.normalise_peakheight:
-            norm_tm /= numpy.amax(norm_tm)
-        
-        plt.figure()
-        fig, ax = plt.subplots(nrows=1, ncols=1, figsize=self.linegraph_size)
-       
-        ax.margins(x=0, y=0)
-        ax.set_xlim(self.wavelength_range[0], self.wavelength_range[1])
-        ax.set_xlabel("Wavelength [nm]")
-        ax.set_ylabel("Rel. Transition Moment")
-        gaussians = numpy.zeros((len(self.energies), self.resolution))
-        for i in range(len(gaussians)):
-            nm = 1239.841 / self.energies[i]
-            gaussians[i] = self.gaussian(wavelength_space, nm, norm_tm[i])
-
-        absorption = numpy.sum(gaussians, axis=0)
-        ax.set_ylim(0.0, numpy.amax(absorption)*1.1)
-
-        peak_styles = [s.strip() for s in self.peak_style.split(",")]
-        for i, g in enumerate(gaussians):
-            gc = self.col(1239.841 / self.energies[i])
-            label = self.get_multiplicity_label(self.multiplicity) + "$_" + str(self.state_num) + " \\rightarrow$ " + self.reformat_state_label(self.excited_state_labels[i]) 
-            if 'gauss' in peak_styles or 'band' in peak_styles:
-                gc = list(gc)
-                gc[3] = 0.5
-                gc = tuple(gc)
-                ax.plot(wavelength_space, g, c=gc, label=label)
-            if 'bar' in peak_styles:
-                ax.vlines(1239.841 / self.energies[i], 0, norm_tm[i], colors=[gc], label=label)
-
-        for i in range(self.resolution-1):
-            xs = wavelength_space[i:i+2]
-            ys = absorption[i:i+2]
-            ci = i * (self.wavelength_range[1] - self.wavelength_range[0]) / self.resolution + self.wavelength_range[0]
-            ax.plot(xs, ys, c=self.col(ci))
-
-        plt.legend()
-        plt.savefig(path, dpi=self.dpi, bbox_inches='tight')
-        plt.close()
+        import dynamictaxes.renderers as renderers
+        path = self.prepare_path(path, filetype)
+        renderers.get_renderer(renderers.ESARenderer, self.linegraph_size).update(self).save(path, self.dpi)
 
     def _eval_scalar(self, nm):
-        val = 0.0
-        for i in range(len(self.energies)):
-            val += self.gaussian(nm, 1239.841 / self.energies[i], self.transition_moments[i])
-        return val
+        return self.evaluate(numpy.array([nm], dtype=float))[0]
 
     def evaluate(self, nm):
         '''
-        This function returns the spectral intensity at a given array of wavelengths. If only one wavelength is given, this is rerouted to _eval_scalar.
+        This function returns the spectral intensity at a given array of wavelengths. All excitations are evaluated at all wavelengths at once by broadcasting. If density_tolerance is positive, each excitation is only evaluated near its centre, see dynamictaxes.spectral_density.sparse_spectral_density. If only one wavelength is given, this is rerouted to _eval_scalar.
 
         Parameters
         ----------
         nm : float or ndarray
-            The wavelength or 1D ndarray of wavelengths at which the spectrum is to be evaluated. 
+            The wavelength or ndarray of wavelengths at which the spectrum is to be evaluated. 
 
         Returns
         -------
         ints : float or ndarray
-            The intensity or 1D ndarray thereof at the given wavelength or wavelengths.
+            The intensity or ndarray thereof with the shape of nm at the given wavelength or wavelengths.
 
         '''
         if type(nm) is not numpy.ndarray:
             return self._eval_scalar(nm)
-        val = numpy.zeros(len(nm))
-        for i in range(len(self.energies)):
-            val += self.gaussian(nm, 1239.841 / self.energies[i], self.transition_moments[i])
-        return val
+        tolerance = self.density_tolerance
+        if tolerance is not None and float(tolerance) > 0:
+            energies = numpy.asarray(self.energies, dtype=float).ravel()
+            offsets = numpy.array([0, len(energies)])
+            ints = sd.sparse_spectral_density(nm.ravel(), offsets, energies, numpy.asarray(self.transition_moments, dtype=float).ravel(), self.peak_breadth, tolerance)
+            return ints[0].reshape(nm.shape)
+        with numpy.errstate(divide='ignore'):
+            centres = 1239.841 / numpy.asarray(self.energies, dtype=float)
+        gaussians = self.gaussian(nm.reshape(1, -1), centres[:, None], numpy.asarray(self.transition_moments, dtype=float)[:, None])
+        return numpy.sum(gaussians, axis=0).reshape(nm.shape)
 
     def col(self, nm):
         '''
-        This function returns the colour of a given wavelength as an RGBA tuple. If the given wavelength is outside the visible range, black is returned.
+        This function returns the colour of a given wavelength as an RGBA tuple. If the given wavelength is outside the visible range, black is returned. If an ndarray of wavelengths is given, all colours are computed with a single colourmap call.
 
         Parameters
         ----------
-        nm : float
-            Wavelength at which the colour is to be evlauated.
+        nm : float or ndarray
+            Wavelength or 1D ndarray of wavelengths at which the colour is to be evlauated.
 
         Returns
         -------
         col : ndarray
-            RGBA style ndarray with shape (4,) that contains the colour of the wavelength or black if invisible.
+            RGBA style ndarray with shape (4,) that contains the colour of the wavelength or black if invisible. For an ndarray of wavelengths, an ndarray of shape (len(nm), 4) is returned.
         '''
-        n = self._norm(nm)
         black = numpy.array([0.0, 0.0, 0.0, 1.0])
-        if n < 0 or n > 1:
-            return black
-        else:
-            return self._cmap(n)
+        if type(nm) is not numpy.ndarray:
+            n = self._norm(nm)
+            if n < 0 or n > 1:
+                return black
+            else:
+                return self._cmap(n)
+        n = numpy.ma.getdata(self._norm(nm))
+        cols = self._cmap(n)
+        cols[(n < 0) | (n > 1)] = black
+        return cols
 
     def gaussian(self, xvals, centre, height):
         '''
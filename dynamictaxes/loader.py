@@ -2,48 +2,200 @@
 
 A class that loads in the relevant information from the given files.
 
+Methods
+-------
+parse_out_file(outfile)
+    Extract the ESA data from a single QChem OUT-File.
+find_out_files(dirpath)
+    Return the sorted list of OUT-Files in a directory.
+
 '''
 
+import concurrent.futures
+import glob
 import json
+import mmap
 import numpy
 import os
 import re
 import dynamictaxes
+import dynamictaxes.parse_cache as parse_cache
+import dynamictaxes.spectral_density as sd
+import dynamictaxes.trajectory_store as trajectory_store
+
+
+def parse_out_file(outfile):
+    '''
+    This function extracts the ESA data from a single QChem OUT-File. It does not depend on the configs and can therefore be executed in worker processes. The file is memory mapped instead of being read into memory as a whole.
+
+    The multiplicity is read from the charge and multiplicity line of the $molecule section. The first excited state is taken as the reference state, the absorption energies are the excitation energies of all higher states relative to it. The transition moments are the strengths of all transitions from state 1 in the first table of transition moments after the one between the ground and excited states.
+
+    Parameters
+    ----------
+    outfile : str
+        The path of the OUT-File.
+
+    Returns
+    -------
+    record : dict
+        Dictionary with the keys 'time', 'state_number', 'multiplicity', 'absorption_energies' and 'transition_moments'.
+    '''
+    record = {}
+
+    # The file is memory mapped and searched with plain substring searches, which run in C and never copy the whole file into Python objects. All sections are searched in the order in which they appear, and the file is not read beyond the end of the table of transition moments between excited states.
+    with open(outfile, 'rb') as of, mmap.mmap(of.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # Load multiplicity
+        multiplicity = None
+        pos = mm.find(b'$molecule')
+        if pos > -1:
+            mm.seek(mm.find(b'\n', pos)+1)
+            line = mm.readline().strip()
+            while len(line) == 0 and mm.tell() < mm.size():
+                line = mm.readline().strip()
+            entry = line.split()
+            if len(entry) == 2 and entry[1].isdigit():
+                multiplicity = int(entry[1])
+        if multiplicity is None:
+            if mm.find(b'\n0 1\n') == -1:
+                raise ValueError("No charge and multiplicity found")
+            multiplicity = 1
+        record['multiplicity'] = multiplicity
+
+        # Load energies
+        marker = b'excitation energy (eV) ='
+        tm_ground_pos = mm.find(b'Transition Moments Between Ground')
+        if tm_ground_pos == -1:
+            raise ValueError("No transition moments between ground and excited states found")
+        ref_energy = None
+        energy_list = []
+        pos = mm.find(marker, 0, tm_ground_pos)
+        while pos > -1:
+            pos += len(marker)
+            ex_energy = float(mm[pos:mm.find(b'\n', pos)])
+            if ref_energy is None:
+                ref_energy = ex_energy
+            else:
+                energy_list.append(ex_energy-ref_energy)
+            pos = mm.find(marker, pos, tm_ground_pos)
+        if ref_energy is None:
+            raise ValueError("No excited states found")
+        record['absorption_energies'] = energy_list
+
+        # Transition moments
+        tm_start = mm.find(b'Transition Moments Between', tm_ground_pos+1)
+        if tm_start == -1:
+            raise ValueError("No transition moments between excited states found")
+        mm.seek(tm_start)
+        for i in range(4):
+            mm.readline()
+        tm_list = []
+        entry = mm.readline().split()
+        while len(entry) > 5 and entry[0] == b'1':
+            tm_list.append(float(entry[5]))
+            entry = mm.readline().split()
+        record['transition_moments'] = tm_list
+
+    # Timestamp
+    geo_removed = outfile.replace(".out", "")
+    num_index = 0
+    for i in range(len(geo_removed)):
+        if not geo_removed[len(geo_removed)-1-i].isdigit():
+            num_index = len(geo_removed)-i
+            break
+    record['time'] = float(geo_removed[num_index:]) * 0.05 # in fs
+
+    # State number
+    record['state_number'] = 1
+    return record
+
+def find_out_files(dirpath):
+    '''
+    This function returns the sorted list of all OUT-Files in the given directory that abide by the name structure described in Loader.load_from_dir.
+
+    Parameters
+    ----------
+    dirpath : str
+        The directory that is searched.
+
+    Returns
+    -------
+    out_files : list
+        Sorted list of the absolute paths of all OUT-Files.
+    '''
+    all_content = sorted(os.listdir(dirpath))
+    regex = re.compile(r"[a-zA-Z0-9_]*[0-9]+\.out")
+    out_files = list(filter(regex.match, all_content))
+    return [os.path.abspath(os.path.join(dirpath, of)) for of in out_files]
+
+def _parse_out_file_safe(outfile):
+    '''
+    Wrapper around parse_out_file that returns errors instead of raising them, such that a single broken file does not abort a parallel load.
+
+    Returns
+    -------
+    outfile : str
+        The path of the OUT-File.
+    record : dict or None
+        The parsed record or None if parsing failed.
+    error : str or None
+        Description of the error or None if parsing succeeded.
+    '''
+    try:
+        return outfile, parse_out_file(outfile), None
+    except Exception as e:
+        return outfile, None, type(e).__name__ + ": " + str(e)
+
 
 class Loader:
     '''
-    This class loads data from a directory containing QChem OUT-Files or from a JSON file.
+    This class loads data from a directory containing QChem OUT-Files, from a JSON file or from a binary NPZ file.
 
     Attributes
     ----------
     ta_spectrum : dynamictaxes.transient_absorption_spectrum.TransientAbsorptionSpectrum
         TA spectrum in which everything is saved.
+    failed_files : list
+        List of (path, error) tuples of all OUT-Files that could not be parsed.
 
     Methods
     -------
     reset()
         Delete all saved data.
-    load_from_dir(dirpath, save_json=False, jsonpath='./content.json', compact=False)
+    load_from_dir(dirpath, save_json=False, jsonpath='./content.json', compact=False, workers=None, use_cache=None, file_range=None)
         Load data from the directoy specified in dirpath. If save_json is True, it is saved into a JSON file.
+    add_record(record)
+        Create an ESA spectrum from a parsed record and add it.
     load_from_json(jsonpath)
         Load data from the JSON file specified in jsonpath
     save_to_json(jsonpath, compact=False)
         Write the saved data to the JSON file specified in jsonpath. If compact is True, whitespace and indentation are not included.
+    load_from_npz(npzpath, lazy=None)
+        Load data from the binary NPZ file specified in npzpath
+    save_to_npz(npzpath, compressed=False)
+        Write the saved data to the binary NPZ file specified in npzpath.
+    load_ensemble(pattern, timestep=None, workers=None)
+        Replace ta_spectrum by the average over all trajectories matching pattern.
     '''
 
     def __init__(self):
         self.ta_spectrum = dynamictaxes.TransientAbsorptionSpectrum()
+        self.failed_files = []
 
     def reset(self):
         '''
         Deletes all data save in ta_spectrum.
         '''
         self.ta_spectrum = dynamictaxes.TransientAbsorptionSpectrum()
+        self.failed_files = []
 
-    def load_from_dir(self, dirpath, save_json=False, jsonpath='./content.json', compact=False):
+    def load_from_dir(self, dirpath, save_json=False, jsonpath='./content.json', compact=False, workers=None, use_cache=None, file_range=None):
         '''
         Loads data from all relevant files in the given dirpath. Only files abiding by a specific name structure are included. Their name has to end in .out, it has to contain an underscore, which can be prefaced by any string, and must be followed by at least one number. The number after the underscore is interpreted as a timestamp.
 
+        The files are parsed by a pool of worker processes if more than one worker is requested. The parsed spectra are added in the sorted order of the file names, independent of the number of workers. Files that cannot be parsed are skipped and reported, they are stored in failed_files.
+
+        If the cache is used, the parsed records are stored in a cache file in dirpath (see dynamictaxes.parse_cache). On subsequent loads, only files that are new or whose size or modification time have changed are parsed again.
+
         Parameters
         ----------
         dirpath : str
@@ -54,88 +206,97 @@ class Loader:
             If save_json is True, the data is saved to this variable. Default './content.json'
         compact : bool, optional
             If save_json is True, this variable determines whether the JSON file is compact or not.
+        workers : int, optional
+            Number of worker processes. 1 parses all files in this process, 0 uses all available cores. If None, the config load_workers is used. Default None
+        use_cache : bool, optional
+            Whether the parse cache is used. If None, the config load_cache is used. Default None
+        file_range : (int, int), optional
+            If given, only the files with index start to stop-1 in the sorted list of OUT-Files (see find_out_files) are loaded. This is used for splitting a directory into shards. Default None
 
         '''
-        all_content = os.listdir(dirpath)
-        regex = re.compile("[a-zA-Z0-9]*[0-9]+\.out")
-        out_files = list(filter(regex.match, all_content))
-        out_files = [os.path.abspath(of) for of in out_files]
-        print(out_files)
-
-        for outfile_index, outfile in enumerate(out_files):
-            with open(outfile) as of:
-                esa = dynamictaxes.ExcitedStateAbsorptionSpectrum()
-                '''
-                The * mAGIC *
-
-                Fields to edit:
-                time
-                multiplicity
-                energies
-                transition_moments
-                excited_state_labels
-                '''
-                content = ''.join(of.read())
-                
-                # Load multiplicity
-                multiplicity_start = content.find('\n0 1\n')+3
-                multiplicity_content = content[multiplicity_start:multiplicity_start+1]
-                esa.multiplicity = int(multiplicity_content)
-                
-                # Load energies
-                ex_start = content.find('Excited state')+2
-                ref_energy_pos = content.find('excitation energy (eV) =', ex_start)+28
-                ref_energy = float(content[ref_energy_pos:content.find('\n', ref_energy_pos)])
-                energy_list = []
-                ex_start1 = content.find('Excited state', ex_start)
-                while ex_start1 > -1:
-                    ex_end = content.find('Total energy for state', ex_start1)-2
-                    ex_start2 = content.find('Excited state   ', ex_end)
-                    ex_content = content[ex_start1:ex_end]
-                    ex_energy = float(ex_content.split("=")[1].strip())-ref_energy
-                    energy_list.append(ex_energy)
-                    ex_start1 = content.find('Excited state', ex_end)                
-                esa.energies = numpy.array(energy_list)
-
-                # Transition moments
-                tm_list = []
-                tm_start_proxy = content.find('Transition Moments Between Ground')+1
-                tm_start = content.find('Transition Moments Between', tm_start_proxy)
-                tm_end_proxy = content.find('\n    1   20', tm_start)+3
-                tm_end = content.find('\n', tm_end_proxy)
-                tm_table = content[tm_start:tm_end].split('\n')[4:]
-                
-                for entry in tm_table:
-                    entry = entry.strip()
-                    tm_entry = float(entry.split()[5])
-                    tm_list.append(tm_entry)
-                
-                esa.transition_moments = numpy.array(tm_list)
-
-                # State labels
-                labels = ["S" + str(i+2) for i in range(len(tm_list))]
-                esa.excited_state_labels = labels
-
-                # Timestamp
-                geo_removed = outfile.replace(".out", "")
-                num_index = 0
-                for i in range(len(geo_removed)):
-                    if not geo_removed[len(geo_removed)-1-i].isdigit():
-                        num_index = len(geo_removed)-i
-                        break
-                timestamp = float(geo_removed[num_index:]) * 0.05 # in fs
-                esa.time = timestamp
-                
-                # State number
-                esa.state_num = 1
-
-                # Save ESA spectrum
-                self.ta_spectrum.add_esa_spectrum(esa)
-    
+        out_files = find_out_files(dirpath)
+        if file_range is not None:
+            out_files = out_files[file_range[0]:file_range[1]]
+
+        if use_cache is None:
+            use_cache = dynamictaxes.get_config("load_cache")
+        cache = None
+        records = [None] * len(out_files)
+        to_parse = list(range(len(out_files)))
+        if use_cache:
+            cache = parse_cache.ParseCache(dirpath, use_hash=bool(dynamictaxes.get_config("load_cache_hash")))
+            cache.load()
+            if file_range is None:
+                cache.prune(out_files)
+            to_parse = []
+            for i, outfile in enumerate(out_files):
+                records[i] = cache.lookup(outfile)
+                if records[i] is None:
+                    to_parse.append(i)
+
+        if workers is None:
+            workers = dynamictaxes.get_config("load_workers")
+        if workers is None:
+            workers = 1
+        workers = int(workers)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        workers = min(workers, max(1, len(to_parse)))
+
+        parse_files = [out_files[i] for i in to_parse]
+        if workers == 1:
+            results = map(_parse_out_file_safe, parse_files)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, len(parse_files) // (4 * workers))
+            results = executor.map(_parse_out_file_safe, parse_files, chunksize=chunksize)
+
+        failed_files = []
+        try:
+            for i, (outfile, record, error) in zip(to_parse, results):
+                if error is not None:
+                    failed_files.append((outfile, error))
+                    continue
+                records[i] = record
+                if cache is not None:
+                    cache.store(outfile, record)
+        finally:
+            if workers > 1:
+                executor.shutdown()
+            if cache is not None:
+                cache.save()
+
+        for record in records:
+            if record is not None:
+                self.add_record(record)
+
+        self.failed_files.extend(failed_files)
+        if len(failed_files) > 0:
+            print("Failed to parse " + str(len(failed_files)) + " of " + str(len(out_files)) + " files:")
+            for outfile, error in failed_files:
+                print("    " + outfile + ": " + error)
 
         if save_json:
             self.save_to_json(jsonpath, compact=compact)
 
+    def add_record(self, record):
+        '''
+        This method creates an ESA spectrum from a parsed record and adds it to ta_spectrum. A record is a dictionary with the same keys as a single entry of the JSON format, see save_to_json. If the multiplicity is missing, a singlet is assumed.
+
+        Parameters
+        ----------
+        record : dict
+            The parsed record.
+        '''
+        esa = dynamictaxes.ExcitedStateAbsorptionSpectrum()
+        esa.time = record['time']
+        esa.state_num = record['state_number']
+        esa.multiplicity = record.get('multiplicity', 1)
+        esa.energies = numpy.array(record['absorption_energies'])
+        esa.transition_moments = numpy.array(record['transition_moments'])
+        esa.excited_state_labels = ["S" + str(i+2) for i in range(len(esa.transition_moments))]
+        self.ta_spectrum.add_esa_spectrum(esa)
+
     def load_from_json(self, jsonpath):
         '''
         This method loads data from the specified json file.
@@ -150,14 +311,111 @@ class Loader:
             json_dict = json.load(jsonfile)
 
         for esa_key in json_dict:
+            self.add_record(json_dict[esa_key]) # json_dict['esa0']
+
+    def load_from_npz(self, npzpath, lazy=None):
+        '''
+        This method loads data from the specified binary NPZ file. See save_to_npz for the structure of the file.
+
+        In lazy mode, the file is memory mapped through a dynamictaxes.trajectory_store.TrajectoryStore and ESA spectra are only built when they are accessed. This is only possible if no data has been loaded before, otherwise all spectra are loaded into memory.
+
+        Parameters
+        ----------
+        npzpath : str
+            The path of the NPZ file from which the data should be loaded.
+        lazy : bool, optional
+            Whether the file should be memory mapped. If None, the config lazy_load is used. Default None
+        '''
+        if lazy is None:
+            lazy = dynamictaxes.get_config("lazy_load")
+        if lazy and len(self.ta_spectrum.esa_spectra) == 0:
+            self.ta_spectrum.esa_spectra = trajectory_store.TrajectoryStore(npzpath)
+            return
+
+        with numpy.load(npzpath) as npz:
+            times = npz['times']
+            state_numbers = npz['state_numbers']
+            multiplicities = npz['multiplicities']
+            offsets = npz['offsets']
+            energies = npz['absorption_energies']
+            transition_moments = npz['transition_moments']
+
+        for i in range(len(times)):
             esa = dynamictaxes.ExcitedStateAbsorptionSpectrum()
-            esa_dict = json_dict[esa_key] # esa_dict = json_dict['esa0']
-            esa.time = esa_dict['time']
-            esa.state_num = esa_dict['state_number']
-            esa.energies = numpy.array(esa_dict['absorption_energies'])
-            esa.transition_moments = numpy.array(esa_dict['transition_moments'])
+            esa.time = float(times[i])
+            esa.state_num = int(state_numbers[i])
+            esa.multiplicity = int(multiplicities[i])
+            esa.energies = energies[offsets[i]:offsets[i+1]]
+            esa.transition_moments = transition_moments[offsets[i]:offsets[i+1]]
+            esa.excited_state_labels = ["S" + str(j+2) for j in range(offsets[i+1]-offsets[i])]
             self.ta_spectrum.add_esa_spectrum(esa)
 
+    def load_ensemble(self, pattern, timestep=None, workers=None):
+        '''
+        This method averages the TA spectra of all trajectories matching the given glob pattern and replaces ta_spectrum by the average. Each trajectory can be a directory of OUT-Files, a JSON file or an NPZ file. See dynamictaxes.ensemble for details.
+
+        Parameters
+        ----------
+        pattern : str
+            Glob pattern of the trajectories, e.g. traj_*/
+        timestep : float, optional
+            Width of the time bins over which is averaged. If None, the config ensemble_timestep is used. Default None
+        workers : int, optional
+            Number of worker processes. If None, the config ensemble_workers is used. Default None
+        '''
+        import dynamictaxes.ensemble as ensemble
+        sources = sorted(glob.glob(pattern))
+        if len(sources) == 0:
+            raise ValueError("No trajectories match " + pattern)
+        if timestep is None:
+            timestep = dynamictaxes.get_config("ensemble_timestep")
+        accumulator = ensemble.accumulate_ensemble(sources, timestep, workers=workers)
+        self.ta_spectrum = accumulator.to_ta_spectrum()
+
+    def _check_savable(self):
+        '''
+        Raises a ValueError if ta_spectrum is an ensemble average, which has no ESA spectra that could be saved.
+        '''
+        import dynamictaxes.ensemble as ensemble
+        if isinstance(self.ta_spectrum, ensemble.EnsembleSpectrum):
+            raise ValueError("An ensemble average has no ESA spectra and cannot be saved as JSON or NPZ. Save the trajectories instead.")
+
+    def save_to_npz(self, npzpath, compressed=False):
+        '''
+        This method saves the data in ta_spectrum into a binary NPZ file specified in npzpath. The spectra are sorted by time before saving. The file contains the following arrays, where N is the number of ESA spectra and M the total number of excitations:
+
+        times : float array of shape (N,)
+        state_numbers : integer array of shape (N,)
+        multiplicities : integer array of shape (N,)
+        offsets : integer array of shape (N+1,). The excitations of spectrum i are stored at the indices offsets[i] to offsets[i+1]-1 of the following arrays.
+        absorption_energies : float array of shape (M,)
+        transition_moments : float array of shape (M,)
+
+        Parameters
+        ----------
+        npzpath : str
+            The path to which the NPZ file should be saved
+        compressed : bool, optional
+            Whether the arrays should be compressed. Uncompressed files are faster to read and can be memory mapped. Default False
+
+        '''
+        self._check_savable()
+        self.ta_spectrum.sort_esa_spectra()
+        esa_spectra = self.ta_spectrum.esa_spectra
+        offsets, energies, transition_moments = sd.pack_esa_spectra(esa_spectra)
+        arrays = {
+            "times": numpy.array([esa.time for esa in esa_spectra], dtype=float),
+            "state_numbers": numpy.array([esa.state_num for esa in esa_spectra], dtype=numpy.int64),
+            "multiplicities": numpy.array([esa.multiplicity for esa in esa_spectra], dtype=numpy.int64),
+            "offsets": offsets,
+            "absorption_energies": energies,
+            "transition_moments": transition_moments
+        }
+        if compressed:
+            numpy.savez_compressed(npzpath, **arrays)
+        else:
+            numpy.savez(npzpath, **arrays)
+
     def save_to_json(self, jsonpath, compact=False):
         '''
         This method saves the data in ta_spectrum into a JSON file specified in jsonpath. The structure of the JSON file is as follows:
@@ -166,7 +424,8 @@ class Loader:
             "esa1":
             {
                 "time": 0,                                          // float
-                "state_number": 1                                   // integer
+                "state_number": 1,                                  // integer
+                "multiplicity": 1,                                  // integer
                 "absorption_energies": [0.1, 0.4],                  // float array
                 "transition_moments": [0.001, 0.54]                 // float array
             },
@@ -185,14 +444,16 @@ class Loader:
             Whether the json enconding should be compact. If not, an indentation level of 4 is used.
 
         '''
+        self._check_savable()
         json_dict = {}
 
         for e, esa_spectrum in enumerate(self.ta_spectrum.esa_spectra):
             json_key = "esa" + str(e)
             esa_dict = {"time": esa_spectrum.time}
-            esa_dict["absorption_energies"] = tuple(esa_spectrum.energies)
-            esa_dict["transition_moments"] = tuple(esa_spectrum.transition_moments)
-            esa_dict["state_number"] = esa_spectrum.state_num
+            esa_dict["absorption_energies"] = [float(e) for e in esa_spectrum.energies]
+            esa_dict["transition_moments"] = [float(t) for t in esa_spectrum.transition_moments]
+            esa_dict["state_number"] = int(esa_spectrum.state_num)
+            esa_dict["multiplicity"] = int(esa_spectrum.multiplicity)
             json_dict[json_key] = esa_dict
 
         json_indent = 4
@@ -0,0 +1,185 @@
+'''
+
+Level of detail for TA spectra with more timesteps than pixels
+
+If a spectral density has more timesteps or wavelengths than the rendered image has pixels, matplotlib has to resample it, which is slow and prone to aliasing. The functions in this module reduce the density to the pixel grid beforehand by taking the mean or the maximum over bins of neighbouring entries.
+
+For repeated renders, e.g. of zoomed sub-ranges, a DensityPyramid stores the density at successively halved time resolutions. A render then starts from the coarsest level that still has at least as many bins as pixels in the requested range, such that its cost depends on the number of pixels rather than the number of timesteps.
+
+Methods
+-------
+bin_rows(values, target, mode, weights=None)
+    Reduce the rows of a 2D array to at most target bins.
+bin_density(density, times, shape, mode, weights=None)
+    Reduce a density to at most the given shape.
+
+'''
+
+import numpy
+import dynamictaxes.spectral_density as sd
+
+
+BINNING_MODES = ("mean", "max", "none")
+
+
+def bin_rows(values, target, mode, weights=None):
+    '''
+    This function reduces the rows of a 2D array to at most target bins of neighbouring rows whose sizes differ by at most one row.
+
+    Parameters
+    ----------
+    values : ndarray
+        2D ndarray whose rows are binned.
+    target : int
+        The maximum number of bins.
+    mode : str
+        mean or max.
+    weights : ndarray, optional
+        1D ndarray of the weight of each row in the mean, e.g. the number of timesteps it already represents. If None, all rows have the weight 1. Default None
+
+    Returns
+    -------
+    binned : ndarray
+        2D ndarray of shape (bins, values.shape[1]).
+    binned_weights : ndarray
+        1D ndarray of the summed weights of each bin.
+    starts : ndarray
+        1D ndarray of the index of the first row of each bin.
+    '''
+    num_rows = values.shape[0]
+    if num_rows <= target:
+        return values, numpy.ones(num_rows) if weights is None else weights, numpy.arange(num_rows)
+    starts = numpy.unique(numpy.floor(numpy.linspace(0, num_rows, int(target) + 1)[:-1]).astype(numpy.int64))
+    return _reduce_rows(values, starts, mode, weights) + (starts,)
+
+def _reduce_rows(values, starts, mode, weights):
+    if weights is None:
+        binned_weights = numpy.diff(numpy.append(starts, values.shape[0])).astype(float)
+    else:
+        binned_weights = numpy.add.reduceat(weights, starts)
+    if mode == "max":
+        binned = numpy.maximum.reduceat(values, starts, axis=0)
+    else:
+        # Unit weights do not need a weighted copy of the values
+        binned = numpy.add.reduceat(values if weights is None else values * weights[:, None], starts, axis=0, dtype=float)
+        binned /= binned_weights[:, None]
+    return binned, binned_weights
+
+def bin_density(density, times, shape, mode, weights=None):
+    '''
+    This function reduces a density of shape (timesteps, wavelengths) to at most the given shape. The time of each bin is the weighted mean of its times.
+
+    Parameters
+    ----------
+    density : ndarray
+        2D ndarray of shape (len(times), wavelengths).
+    times : ndarray
+        1D ndarray of the times of the rows.
+    shape : int, int
+        The maximum number of timesteps and wavelengths.
+    mode : str
+        mean or max.
+    weights : ndarray, optional
+        1D ndarray of the number of timesteps each row represents. If None, every row is one timestep. Default None
+
+    Returns
+    -------
+    density : ndarray
+        The binned density.
+    times : ndarray
+        1D ndarray of the time of each bin.
+    '''
+    times = numpy.asarray(times, dtype=float)
+    density, binned_weights, starts = bin_rows(density, shape[0], mode, weights)
+    if len(starts) < len(times):
+        times = numpy.add.reduceat(times if weights is None else times * weights, starts) / binned_weights
+    if density.shape[1] > shape[1]:
+        density = bin_rows(density.T, shape[1], mode)[0].T
+    return density, times
+
+
+class DensityPyramid:
+    '''
+    This class stores a spectral density at successively halved time resolutions. Level 0 is the density itself, which is not copied, and every further level combines pairs of bins of the previous level. The levels are computed when they are first needed and all of them together need about as much memory as the density. They are computed chunk by chunk, and levels that exceed the memory budget are memory mapped like the density, see dynamictaxes.spectral_density.allocate_density.
+
+    Attributes
+    ----------
+    mode : str
+        mean or max.
+    levels : list
+        List of the computed (times, weights, density) tuples, where weights is the number of timesteps of each bin or None for level 0.
+
+    memory_budget : int
+        Memory in bytes available for each level and the temporary arrays, or None if there is no limit.
+    directory : str
+        The directory of memory mapped levels, or None for the default temporary directory.
+
+    Methods
+    -------
+    select(start, stop, shape)
+        Return the density of the timesteps start to stop-1 reduced to at most the given shape.
+    '''
+
+    def __init__(self, times, density, mode="mean", memory_budget=None, directory=None):
+        if mode not in ("mean", "max"):
+            raise ValueError("Unknown binning mode " + str(mode) + ". Allowed values are mean and max")
+        self.mode = mode
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.levels = [(numpy.asarray(times, dtype=float), None, density)]
+
+    def _get_level(self, level):
+        while len(self.levels) <= level:
+            times, weights, density = self.levels[-1]
+            self.levels.append(self._halve(times, weights, density))
+        return self.levels[level]
+
+    def _halve(self, times, weights, density):
+        # Pairs of rows are combined with strided views, which is much faster than reduceat with many short bins
+        pairs = len(times) // 2
+        if weights is None:
+            weights = numpy.ones(len(times))
+        even, odd = weights[0:2*pairs:2], weights[1:2*pairs:2]
+        binned_weights = numpy.concatenate((even + odd, weights[2*pairs:]))
+        binned_times = numpy.concatenate((times[0:2*pairs:2] * even + times[1:2*pairs:2] * odd, times[2*pairs:] * weights[2*pairs:])) / binned_weights
+        binned = sd.allocate_density((len(binned_weights), density.shape[1]), self.memory_budget, self.directory)
+        for start, stop in sd.row_chunks(pairs, 2 * density.shape[1], self.memory_budget):
+            even_rows, odd_rows = density[2*start:2*stop:2], density[2*start+1:2*stop:2]
+            if self.mode == "max":
+                numpy.maximum(even_rows, odd_rows, out=binned[start:stop])
+            else:
+                # All bins of a level have the same weight except the last one, which is corrected below
+                numpy.add(even_rows, odd_rows, out=binned[start:stop])
+                binned[start:stop] *= 0.5
+        if self.mode == "mean" and pairs > 0 and even[-1] != odd[-1]:
+            binned[pairs-1] = (density[2*pairs-2] * even[-1] + density[2*pairs-1] * odd[-1]) / (even[-1] + odd[-1])
+        if len(times) % 2 == 1:
+            binned[-1] = density[-1]
+        return binned_times, binned_weights, binned
+
+    def select(self, start, stop, shape):
+        '''
+        This method returns the density of the timesteps start to stop-1 reduced to at most the given shape. It is computed from the coarsest level with at least shape[0] bins in the range, whose bins at the ends of the range may contain less than one pixel of timesteps outside of the range.
+
+        Parameters
+        ----------
+        start : int
+            Index of the first timestep.
+        stop : int
+            Index after the last timestep.
+        shape : int, int
+            The maximum number of timesteps and wavelengths.
+
+        Returns
+        -------
+        density : ndarray
+            The reduced density.
+        times : ndarray
+            1D ndarray of the time of each bin.
+        '''
+        level = 0
+        while (stop - start) >> (level + 1) >= shape[0]:
+            level += 1
+        times, weights, density = self._get_level(level)
+        first, last = start >> level, -(-stop >> level)
+        return bin_density(density[first:last], times[first:last], shape, self.mode, None if weights is None else weights[first:last])
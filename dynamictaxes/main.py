@@ -12,17 +12,20 @@ load_configs()
     Load the configs from default.config
 gen_pytext(lines)
     Generate the Python executable from the DT script.
+write_pyscript(args_dict)
+    Write the Python executable for the execution on a cluster.
 make_qsub_script(args_dict)
     Generate the qsub script for sending the job to the cluster
 prepare_script(args_dict)
     Make prepations for Python executable generation
 exec_script(args)
-    Execute a Python executable either locally or on the cluster
+    Execute a script either locally or on the cluster
 main()
     Main executable function.
 '''
 
 import dynamictaxes
+import dynamictaxes.dtsl as dtsl
 import os
 import re
 import sys
@@ -72,15 +75,60 @@ def get_qsub_template_path():
     real_path = real_path[:real_path.rfind("/")]
     return real_path + "/qsub_template.txt"
 
+def parse_config_value(val):
+    '''
+    This function converts the string value of a config into a float, int or bool if it has the respective format.
+
+    Parameters
+    ----------
+    val : str
+        The value as written in default.config or a DT script.
+
+    Returns
+    -------
+    val : float, int, bool or str
+        The converted value.
+    '''
+    float_regex = re.compile("-?[0-9]+\\.[0-9]+")
+    int_regex = re.compile("-?[0-9]+")
+    bool_regex = re.compile("True|False")
+    if float_regex.fullmatch(val):
+        return float(val)
+    elif int_regex.fullmatch(val):
+        return int(val)
+    elif bool_regex.fullmatch(val):
+        return val == "True"
+    return val
+
+def parse_set_config(line):
+    '''
+    This function splits a DT line of the form "set config <key> to <value>" or "set config <key> = <value>" into key and converted value.
+
+    Parameters
+    ----------
+    line : str
+        The DT line.
+
+    Returns
+    -------
+    key : str
+        The config key.
+    val : float, int, bool or str
+        The converted value.
+    '''
+    line = line.replace("set config", "").strip()
+    if "=" in line:
+        line_list = [l.strip() for l in line.split("=", 1)]
+    else:
+        line_list = [l.strip() for l in line.split(" to ", 1)]
+    return line_list[0], parse_config_value(line_list[1])
+
 def load_configs():
     '''
     This function loads the configs from default.config into the local configs.
     '''
     config_path = get_config_path()
     config_dict = {}
-    float_regex = re.compile("[0-9]+\.[0-9]+")
-    int_regex = re.compile("[0-9]+")
-    bool_regex = re.compile("True|False")
     with open(config_path, 'r') as cf:
         lines = cf.readlines()
         for line in lines:
@@ -89,16 +137,8 @@ def load_configs():
                 continue
             if line[0] == '#':
                 continue
-            content = [l.strip() for l in line.split("=")]
-            val = content[1]
-            if float_regex.match(val):
-                config_dict[content[0]] = float(val)
-            elif int_regex.match(val):
-                config_dict[content[0]] = int(val)
-            elif bool_regex.match(val):
-                config_dict[content[0]] = bool(val)
-            else:
-                config_dict[content[0]] = val
+            content = [l.strip() for l in line.split("=", 1)]
+            config_dict[content[0]] = parse_config_value(content[1])
 
     dynamictaxes.set_config(config_dict)
     return dynamictaxes.get_config("username") == "USERNAME" or dynamictaxes.get_config("exec_mode") == "EXEC_MODE" or dynamictaxes.get_config("conda_env") == "CONDA_ENV"
@@ -117,90 +157,62 @@ def gen_pytext(lines):
     pytext : str
         The content of the Python executable.
     '''
-    pytext = "# This is an automatically generated temp file that is used for program execution.\n\nimport dynamictaxes as dt\ndt.init_configs()\n\n"
-    loader_exists = False
-    esa_shortcut = False
-    for line in lines:
-        if len(line) == 0:
-            continue
-        if line[0] == '#':
-            continue
-        if '#' in line:
-            line = line.split('#')[0]
-
-        if line.startswith("set config"):
-            line = line.replace("set config", "").strip()
-            line_list = None
-            if "=" in line:
-                line_list = [l.strip() for l in line.split("=")]
-            else:
-                line_list = [l.strip() for l in line.split(" to ")]
-            pytext += "dt.set_config_key(\"" + line_list[0] + "\", \"" + line_list[1] + "\")\n"
-        if line.startswith("load") or line.startswith("read"):
-            if not loader_exists:
-                pytext += "loader = dt.Loader()\n"
-                loader_exists = True
-            line = line[4:].strip()
-            if line.endswith(".json"):
-                pytext += "loader.load_from_json(\"" + line + "\")\n"
-            else:
-                pytext += "loader.load_from_dir(\"" + line + "\")\n"
-
-        elif line.startswith("save json to"):
-            if not loader_exists:
-                raise Exception("Must load data first before in can be saved to JSON")
-            line = line[len("save json to"):].strip()
-            jsonpath = line.split()[0]
-            compact = str('compact' in line.lower())
-            pytext += "loader.save_to_json(\"" + jsonpath + "\", compact=" + compact + ")\n"
-
-        elif line.startswith("render"):
-            if not loader_exists:
-                raise Exception("Must load data first before it can be rendered.")
-            line_list = line.split()
-            if line_list[1].lower() == 'ta':
-                assert line_list[2] == "to", f"Illegal syntax. Must be like \"render ta to ...\""
-                path = line_list[3]
-                pytext += "loader.ta_spectrum.render(\"" + path + "\")\n"
-            elif line_list[1].lower() == "all" and line_list[2].lower() == "esa":
-                assert line_list[3] == "to", f"Illegal syntax. Must be like \"render all esa to ...\""
-                path = line_list[4]
-                if not esa_shortcut:
-                    pytext += "esa_spectra = loader.ta_spectrum.esa_spectra\n"
-                    esa_shortcut = True    
-                pytext += "for i, esa in enumerate(esa_spectra):\n"
-                pytext += "    esa.render(\"" + path + "_\" + str(i))\n"
-            elif line_list[1].lower() == "every" and line_list[3].lower() == "esa":
-                dist = line_list[2]
-                offset = "0"
-                if '+' in line_list[2]:
-                    dist = line_list[2].split("+")[0]
-                    offset = line_list[2].split("+")[1]
-                assert dist.isdigit() and offset.isdigit() and line_list[4] == "to", f"Illegal syntax. Must be like \"render every 2[+1] esa to ...\""
-                path = line_list[5]
-                assert int(line_list[2]) > 0, f"Stepsize in ESA rendering must be positive."
-                if not esa_shortcut:
-                    pytext += "esa_spectra = loader.ta_spectrum.esa_spectra\n"
-                    esa_shortcut = True
-                pytext += "for i in range(" + offset + ", len(esa_spectra), " + dist + "):\n"
-                pytext += "    esa_spectra[i].render(\"" + path + "_\" + str(i))\n"
-            elif line_list[1].lower() == "esa" and line_list[2].isdigit():
-                assert line_list[3] == "to", f"Illegal syntax. Must be like \"render esa 5 to ...\""
-                path = line_list[4]
-                if not esa_shortcut:
-                    pytext += "esa_spectra = loader.ta_spectrum.esa_spectra\n"
-                    esa_shortcut = True
-                pytext += "esa_spectra[" + line_list[2] + "].render(\"" + path + "\")\n"
-            elif line_list[1].lower() == "slice":
-                assert line_list[2] == "at" and line_list[3] == "wavelength" and line_list[4].isdigit() and line_list[5] == "to", f"Illegal syntax. Must be like \"render slice at wavelength 250 to ...\""
-                path = line_list[6]
-                pytext += "loader.ta_spectrum.render_mono_slice(" + line_list[4] + ", \"" + path + "\")\n"
-            elif (line_list[1].lower() == "averaged" or line_list[1].lower() == "avg") and line_list[2] == "slice":
-                assert line_list[3] == "at" and line_list[4] == "wavelength" and line_list[5].isdigit() and line_list[6] == "spanning" and line_list[7].isdigit() and line_list[8] == "to", f"Illegal syntax. Must be like \"render avg slice at wavelength 250 spanning 50 to ...\""
-                path = line_list[9]
-                pytext += "loader.ta_spectrum.render_avg_slice(" + line_list[5] + ", " + line_list[7] + ", \"" + path + "\")\n"
-
-    return pytext
+    return dtsl.to_pytext(dtsl.parse_script(lines))
+
+def fill_qsub_template(pyscript, selftime, command=None, cleanup=True):
+    '''
+    This function fills the qsub template for a single job or job array. The number of nodes and cores per node are taken from the configs cluster_nodes and cluster_ppn.
+
+    Parameters
+    ----------
+    pyscript : str
+        The name of the python executable (without .py)
+    selftime : str
+        The time of execution in ms for naming consistency
+    command : str, optional
+        The command executed by the job. Default "python <pyscript>.py"
+    cleanup : bool, optional
+        Whether all temporary files of this execution are deleted at the end of the job. Default True
+
+    Returns
+    -------
+    template : str
+        The filled template.
+    '''
+    if command is None:
+        command = "python " + pyscript + ".py"
+    template = ""
+    with open(get_qsub_template_path(), "r") as tempf:
+        template = "".join(tempf.readlines())
+    template = template.replace("{nodes}", str(dynamictaxes.get_config("cluster_nodes") or 1))
+    template = template.replace("{ppn}", str(dynamictaxes.get_config("cluster_ppn") or 1))
+    template = template.replace("{command}", command)
+    template = template.replace("{cleanup}", "rm -rf *{selftime}*" if cleanup else "")
+    template = template.replace("{username}", dynamictaxes.get_config("username"))
+    template = template.replace("{conda_env}", dynamictaxes.get_config("conda_env"))
+    template = template.replace("{conda_installation}", get_conda_path())
+    template = template.replace("{pyscript}", pyscript)
+    template = template.replace("{selftime}", selftime)
+    return template
+
+def write_pyscript(args_dict):
+    '''
+    This function writes the Python executable pytemp<selftime>.py of the parsed DTSL commands, which is needed for the execution on a cluster.
+
+    Parameters
+    ----------
+    args_dict : dict
+        A dictionary of arguments. In this function, only the keys 'commands' and 'selftime' matter.
+
+    Returns
+    -------
+    args_dict : dict
+        The modified dictionary of arguments. The key 'pyscript' is set.
+    '''
+    args_dict["pyscript"] = "pytemp" + args_dict["selftime"]
+    with open(args_dict["pyscript"]+".py", "w") as pf:
+        pf.write(dtsl.to_pytext(args_dict["commands"]))
+    return args_dict
 
 def make_qsub_script(args_dict):
     '''
@@ -217,14 +229,7 @@ def make_qsub_script(args_dict):
     args_dict : dict
         A dictionary of arguments. In this function, only the keys 'username', 'conda_env', 'pyscript', 'selftime' and 'qsubscript' matter.
     '''
-    template = ""
-    with open(get_qsub_template_path(), "r") as tempf:
-        template = "".join(tempf.readlines())
-    template = template.replace("{username}", dynamictaxes.get_config("username"))
-    template = template.replace("{conda_env}", dynamictaxes.get_config("conda_env"))
-    template = template.replace("{conda_installation}", get_conda_path())
-    template = template.replace("{pyscript}", args_dict["pyscript"])
-    template = template.replace("{selftime}", args_dict["selftime"])
+    template = fill_qsub_template(args_dict["pyscript"], args_dict["selftime"])
     args_dict["qsubscript"] = "dttemp" + args_dict["selftime"]
     with open(args_dict["qsubscript"]+".sh", "w") as qsubf:
         qsubf.write(template)
@@ -232,7 +237,7 @@ def make_qsub_script(args_dict):
 
 def prepare_script(args_dict):
     '''
-    This function does all the preparative work generation of the python text. If the --script flag is set, the given file is sent to gen_pytext for generation of the python executable. Otherwise, a pseudoscript in DTSL is generated and sent to gen_pytext. See README for allowed flags and their effects.
+    This function does all the preparative work for the execution. If the --script flag is set, the given file is parsed into a list of DTSL commands. Otherwise, a pseudoscript in DTSL is generated and parsed. For the execution on a cluster, the commands are translated into a Python executable and a qsub script. See README for allowed flags and their effects.
 
     Parameters
     ----------
@@ -257,22 +262,26 @@ def prepare_script(args_dict):
         subprocess.run(["nano", config_path])
         args_dict["noexec"] = True
         return args_dict
+    if "--daemon" in args:
+        import dynamictaxes.daemon as daemon
+        daemon.serve()
+        args_dict["noexec"] = True
+        return args_dict
+    if "--daemon-stop" in args:
+        import dynamictaxes.daemon as daemon
+        if not daemon.stop():
+            print("No Dynamic-Taxes daemon is running.")
+        args_dict["noexec"] = True
+        return args_dict
     if "--script" in args:
         script_path = args[args.index("--script")+1]
         lines = [] 
         with open(script_path, 'r') as sf:
             lines = sf.readlines()
         lines = [l.replace("\n", "").strip() for l in lines]
-        if "set config exec_mode to local" in lines:
-            args_dict['local'] = True
-            args_dict['cluster'] = False
-        elif "set config exec_mode to cluster" in lines:
-            args_dict['cluster'] = True
-            args_dict['local'] = False
-        pytext = gen_pytext(lines)
-        args_dict["pyscript"] = "pytemp" + args_dict["selftime"]
-        with open(args_dict["pyscript"]+".py", "w") as pf:
-            pf.write(pytext)
+        for line in lines:
+            if line.startswith("set config"):
+                dynamictaxes.set_config_key(*parse_set_config(line))
     args_dict["noexec"] = "--noexec" in args
     if "--ta" in args:
         args_dict["ta"] = args[args.index("--ta")+1]
@@ -284,6 +293,10 @@ def prepare_script(args_dict):
         args_dict["load-json"] = args[args.index("--load-json")+1]
     if "--save-json" in args:
         args_dict["save-json"] = args[args.index("--save-json")+1]
+    if "--load-npz" in args:
+        args_dict["load-npz"] = args[args.index("--load-npz")+1]
+    if "--save-npz" in args:
+        args_dict["save-npz"] = args[args.index("--save-npz")+1]
 
     if not "--script" in args:
         pseudoscript = []
@@ -291,16 +304,18 @@ def prepare_script(args_dict):
             pseudoscript.append("load " + args_dict["load-dir"])
         if "load-json" in args_dict:
             pseudoscript.append("load " + args_dict["load-json"])
+        if "load-npz" in args_dict:
+            pseudoscript.append("load " + args_dict["load-npz"])
         if "save-json" in args_dict:
             pseudoscript.append("save json to " + args_dict["save-json"])
+        if "save-npz" in args_dict:
+            pseudoscript.append("save npz to " + args_dict["save-npz"])
         if "ta" in args_dict:
             pseudoscript.append("render ta to " + args_dict["ta"])
         if "esa" in args_dict:
             pseudoscript.append("render all esa to " + args_dict["esa"])
-        pytext = gen_pytext(pseudoscript)
-        args_dict["pyscript"] = "pytemp" + args_dict["selftime"]
-        with open(args_dict["pyscript"]+".py", "w") as pf:
-            pf.write(pytext)
+        lines = pseudoscript
+    args_dict["commands"] = dtsl.parse_script(lines)
 
     args_dict["cluster"] = dynamictaxes.get_config("exec_mode") == "cluster"
     args_dict["local"] = dynamictaxes.get_config("exec_mode") == "local"
@@ -312,23 +327,33 @@ def prepare_script(args_dict):
         args_dict["cluster"] = False
 
     if args_dict["cluster"]:
-        args_dict = make_qsub_script(args_dict)
+        import dynamictaxes.cluster as cluster
+        if cluster.uses_job_arrays(lines):
+            args_dict = cluster.make_cluster_jobs(lines, args_dict)
+        else:
+            args_dict = write_pyscript(args_dict)
+            args_dict = make_qsub_script(args_dict)
+    elif args_dict["noexec"]:
+        args_dict = write_pyscript(args_dict)
     return args_dict  
 
 def exec_script(args):
     '''
-    This function executes the script employing the specified execution circumstances.
+    This function executes the script employing the specified execution circumstances. Local scripts are forwarded to the daemon if it is running and executed in the current process otherwise. Errors of forwarded scripts are raised in this process as well, such that dt exits with a non-zero status.
 
     Parameters
     ----------
     args : dict
         Dictionary of arguments
     '''
-    if args["cluster"]:
+    if args["cluster"] and args.get("job_array", False):
+        subprocess.run(["bash", args["qsubscript"]+".sh"])
+    elif args["cluster"]:
         subprocess.run(["qsub", args["qsubscript"]+".sh"])
     elif args["local"]:
-        subprocess.run(["python", args["pyscript"]+".py"])
-        subprocess.run(["rm", "-f", "*"+args["selftime"]+"*"])
+        import dynamictaxes.daemon as daemon
+        if not daemon.forward(args["commands"]):
+            dtsl.run(args["commands"])
 
 def main():
     '''
@@ -0,0 +1,200 @@
+'''
+
+Movies of the time evolution of ESA spectra
+
+This module renders a sequence of ESA spectra into a single video or GIF. The figure and its artists are created once, and the static parts (axes, ticks and labels) are drawn only once into a background image. For every timestep, only the data of the absorption curve, the bands, the bars, the legend and the title is updated and drawn on top of the background (blitting). The raw frames are streamed into an ffmpeg pipe, for GIFs as well as for videos, such that neither intermediate image files are written nor the frames are held in memory. Only if ffmpeg is not installed, GIFs are written with Pillow, which has to keep all frames until the end and is therefore limited to GIF_FALLBACK_FRAMES frames.
+
+Methods
+-------
+open_frame_writer(path, fps, width, height, num_frames=None)
+    Return a writer for raw RGBA frames suitable for the file ending of path.
+render_esa_movie(esa_spectra, path, indices=None, filetype='mp4', fps=None)
+    Render the ESA spectra with the given indices into one movie.
+
+'''
+
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.spectral_density as sd
+
+
+GIF_FALLBACK_FRAMES = 1000
+
+
+class FFMpegFrameWriter:
+    '''
+    This class streams raw RGBA frames into an ffmpeg process, which encodes them into a video or GIF. GIF frames are encoded one by one, each with its own palette, so ffmpeg does not have to buffer the movie either.
+
+    Methods
+    -------
+    write(frame)
+        Encode one frame.
+    close()
+        Finish the video.
+    '''
+
+    def __init__(self, path, fps, width, height):
+        import subprocess
+        import matplotlib
+        # Most codecs require even dimensions, odd frames are padded by one pixel
+        command = [matplotlib.rcParams['animation.ffmpeg_path'], "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba", "-s", str(width) + "x" + str(height), "-r", str(fps), "-i", "-"]
+        if path.lower().endswith(".gif"):
+            command += ["-vf", "split[a][b];[a]palettegen=stats_mode=single[p];[b][p]paletteuse=new=1", "-f", "gif"]
+        elif not path.lower().endswith((".webm", ".apng")):
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+        self._process = subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self._process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise RuntimeError("ffmpeg failed with exit code " + str(self._process.returncode))
+
+
+class GIFFrameWriter:
+    '''
+    This class writes GIFs with Pillow if ffmpeg is not installed. Pillow can only write a GIF at once, so all frames are kept in memory as palette images until the writer is closed. It accepts at most GIF_FALLBACK_FRAMES frames, longer movies have to be streamed with ffmpeg.
+
+    Methods
+    -------
+    write(frame)
+        Add one frame.
+    close()
+        Write the GIF.
+    '''
+
+    def __init__(self, path, fps, width, height):
+        self._path = path
+        self._duration = int(round(1000 / fps))
+        self._frames = []
+
+    def write(self, frame):
+        from PIL import Image
+        if len(self._frames) >= GIF_FALLBACK_FRAMES:
+            raise RuntimeError(_gif_limit_message(self._path))
+        self._frames.append(Image.fromarray(numpy.ascontiguousarray(frame[:, :, :3])).quantize(method=Image.Quantize.FASTOCTREE))
+
+    def close(self):
+        if len(self._frames) > 0:
+            self._frames[0].save(self._path, save_all=True, append_images=self._frames[1:], duration=self._duration, loop=0)
+        self._frames = []
+
+
+def _gif_limit_message(path):
+    return "Without ffmpeg, GIFs are limited to " + str(GIF_FALLBACK_FRAMES) + " frames, because they are held in memory. Install ffmpeg to write " + path + "."
+
+def open_frame_writer(path, fps, width, height, num_frames=None):
+    '''
+    This function returns a writer for raw RGBA frames of the given size. All formats are written with ffmpeg. If it is not installed, GIFs of up to GIF_FALLBACK_FRAMES frames are written with Pillow instead.
+
+    Parameters
+    ----------
+    path : str
+        The path of the movie including the file ending.
+    fps : float
+        Frames per second.
+    width : int
+        Width of the frames in pixels.
+    height : int
+        Height of the frames in pixels.
+    num_frames : int, optional
+        The number of frames, which is checked against the limit of Pillow before any frame is rendered. Default None
+
+    Returns
+    -------
+    writer : FFMpegFrameWriter or GIFFrameWriter
+        The writer.
+    '''
+    import matplotlib.animation as animation
+    if not animation.writers.is_available("ffmpeg"):
+        if path.lower().endswith(".gif"):
+            if num_frames is not None and num_frames > GIF_FALLBACK_FRAMES:
+                raise RuntimeError(_gif_limit_message(path))
+            return GIFFrameWriter(path, fps, width, height)
+        raise RuntimeError("ffmpeg is required to write " + path + ". Install ffmpeg or render a GIF instead.")
+    return FFMpegFrameWriter(path, fps, width, height)
+
+def render_esa_movie(esa_spectra, path, indices=None, filetype='mp4', fps=None):
+    '''
+    This function renders the ESA spectra with the given indices as the frames of one movie. Each frame looks like the image of ExcitedStateAbsorptionSpectrum.render, except that the y-axis is fixed to the maximum over all frames and the time is shown in the title. The render settings are taken from the first spectrum. The frames are drawn by an animated dynamictaxes.renderers.ESARenderer, whose figure is independent of pyplot, so no figures are left open.
+
+    Parameters
+    ----------
+    esa_spectra : list
+        List of ESA spectra.
+    path : str
+        The path of the movie. If it has no file ending, filetype is added.
+    indices : iterable, optional
+        The indices of the spectra that are rendered. If None, all spectra are rendered. Default None
+    filetype : str, optional
+        The file ending, e.g. mp4 or gif. Default mp4
+    fps : float, optional
+        Frames per second. If None, the config movie_fps is used. Default None
+
+    Returns
+    -------
+    path : str
+        The path of the movie.
+    '''
+    import dynamictaxes.renderers as renderers
+
+    if indices is None:
+        indices = range(len(esa_spectra))
+    indices = list(indices)
+    if len(indices) == 0:
+        raise ValueError("A movie needs at least one ESA spectrum.")
+    if fps is None:
+        fps = dt.get_config("movie_fps")
+    if fps is None:
+        fps = 25
+    first = esa_spectra[indices[0]]
+    path = first.prepare_path(path, filetype)
+
+    # The absorption of all frames is evaluated in one batch to find the fixed limit of the y-axis
+    frames = [esa_spectra[i] for i in indices]
+    offsets, energies, transition_moments = sd.pack_esa_spectra(frames)
+    heights = numpy.array(transition_moments, dtype=float)
+    if first.normalise_peakheight:
+        for f in range(len(frames)):
+            frame_heights = heights[offsets[f]:offsets[f+1]]
+            if len(frame_heights) > 0:
+                frame_heights /= numpy.amax(frame_heights)
+    wavelength_space = numpy.linspace(first.wavelength_range[0], first.wavelength_range[1], num=first.resolution)
+    absorption = sd.spectral_density(wavelength_space, offsets, energies, heights, first.peak_breadth, tolerance=first.density_tolerance)
+    ymax = float(numpy.amax(absorption)) * 1.1 if absorption.size > 0 else 1.0
+    if not ymax > 0:
+        ymax = 1.0
+    time_unit = dt.get_config("timestep_unit")
+
+    def title(esa):
+        return "t = " + str(round(float(esa.time), 6)) + " " + str(time_unit)
+
+    # Animated artists are skipped by canvas.draw() and drawn for every frame on top of the background
+    renderer = renderers.ESARenderer(first.linegraph_size, animated=True)
+    renderer.fig.set_dpi(first.dpi)
+    renderer.update(first, ylim=(0.0, ymax), title=title(first))
+    renderer.fig.tight_layout()
+    canvas = renderer.fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(renderer.fig.bbox)
+    width, height = canvas.get_width_height()
+
+    writer = open_frame_writer(path, fps, width, height, len(frames))
+    try:
+        for esa in frames:
+            renderer.update(esa, ylim=(0.0, ymax), title=title(esa))
+            canvas.restore_region(background)
+            for artist in renderer.animated_artists():
+                renderer.ax.draw_artist(artist)
+            writer.write(numpy.asarray(canvas.buffer_rgba()))
+    except BaseException:
+        # If ffmpeg has exited early, closing the pipe fails as well, but the first error is the informative one
+        try:
+            writer.close()
+        except Exception:
+            pass
+        raise
+    writer.close()
+    return path
@@ -0,0 +1,167 @@
+'''
+
+A cache for parsed QChem OUT-Files
+
+The cache is stored as a JSON file in the data directory. Each entry is keyed by the file name and contains the size and modification time of the file at the time of parsing, optionally a SHA-1 hash of its content, and the parsed record as returned by dynamictaxes.loader.parse_out_file. When a directory is loaded again, only files whose entry is missing or outdated have to be parsed.
+
+'''
+
+import hashlib
+import json
+import os
+
+
+CACHE_NAME = ".dtcache.json"
+CACHE_VERSION = 1
+
+
+def file_hash(path):
+    '''
+    This function calculates the SHA-1 hash of a file without reading it into memory as a whole.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+
+    Returns
+    -------
+    hash : str
+        The hexadecimal SHA-1 hash of the file content.
+    '''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ParseCache:
+    '''
+    This class stores parsed records of the OUT-Files of one directory.
+
+    Attributes
+    ----------
+    path : str
+        Path of the cache file.
+    use_hash : bool
+        Whether the content hash of a file is compared in addition to its size and modification time.
+    entries : dict
+        Dictionary of all cache entries keyed by file name.
+    modified : bool
+        Whether the entries have changed since the cache was loaded.
+
+    Methods
+    -------
+    load()
+        Read the cache file if it exists.
+    save()
+        Write the cache file if entries have changed.
+    lookup(outfile)
+        Return the cached record of a file or None if it is missing or outdated.
+    store(outfile, record)
+        Store the record of a file.
+    prune(outfiles)
+        Remove all entries of files that are not in outfiles.
+    '''
+
+    def __init__(self, dirpath, use_hash=False):
+        self.path = os.path.join(dirpath, CACHE_NAME)
+        self.use_hash = use_hash
+        self.entries = {}
+        self.modified = False
+
+    def load(self):
+        '''
+        Reads the cache file. A missing, unreadable or outdated cache file is treated as an empty cache.
+        '''
+        self.entries = {}
+        self.modified = False
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as cachefile:
+                cache_dict = json.load(cachefile)
+        except (OSError, ValueError):
+            return
+        if cache_dict.get("version") != CACHE_VERSION:
+            return
+        self.entries = cache_dict.get("entries", {})
+
+    def save(self):
+        '''
+        Writes the cache file if entries have changed. The file is replaced atomically, and a cache that cannot be written is skipped with a warning.
+        '''
+        if not self.modified:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as cachefile:
+                json.dump({"version": CACHE_VERSION, "entries": self.entries}, cachefile)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Could not write parse cache " + self.path + ": " + str(e))
+            return
+        self.modified = False
+
+    def _stat(self, outfile):
+        stat = os.stat(outfile)
+        return stat.st_size, stat.st_mtime_ns
+
+    def lookup(self, outfile):
+        '''
+        Returns the cached record of the given file if its size, modification time and, if use_hash is True, content hash are unchanged.
+
+        Parameters
+        ----------
+        outfile : str
+            The path of the OUT-File.
+
+        Returns
+        -------
+        record : dict or None
+            The cached record or None if the entry is missing or outdated.
+        '''
+        entry = self.entries.get(os.path.basename(outfile))
+        if entry is None:
+            return None
+        size, mtime = self._stat(outfile)
+        if entry["size"] != size or entry["mtime"] != mtime:
+            return None
+        if self.use_hash:
+            if entry.get("hash") != file_hash(outfile):
+                return None
+        return entry["record"]
+
+    def store(self, outfile, record):
+        '''
+        Stores the record of the given file together with its current size, modification time and, if use_hash is True, content hash.
+
+        Parameters
+        ----------
+        outfile : str
+            The path of the OUT-File.
+        record : dict
+            The parsed record.
+        '''
+        size, mtime = self._stat(outfile)
+        entry = {"size": size, "mtime": mtime, "record": record}
+        if self.use_hash:
+            entry["hash"] = file_hash(outfile)
+        self.entries[os.path.basename(outfile)] = entry
+        self.modified = True
+
+    def prune(self, outfiles):
+        '''
+        Removes the entries of all files that are not in the given list, e.g. because they have been deleted.
+
+        Parameters
+        ----------
+        outfiles : list
+            List of paths of all current OUT-Files.
+        '''
+        names = set(os.path.basename(of) for of in outfiles)
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+                self.modified = True
@@ -0,0 +1,239 @@
+'''
+
+Direct raster output of TA spectra
+
+This module writes a spectral density as a colour-mapped image without matplotlib axes. The density is quantised to 256 levels and written as an 8-bit palette image, whose palette is a lookup table of the colourmap. The image is written block by block of rows, such that apart from the density itself only one block of pixels is held in memory. This allows writing densities that are far too large for imshow. Memory mapped densities are read sequentially in blocks of timesteps, their palette indices are transposed through a memory mapped scratch file.
+
+Methods
+-------
+colourmap_lut(name, levels=256)
+    Return the RGB lookup table of a matplotlib colourmap.
+quantise(values, vmin, vmax, levels=256)
+    Map values linearly to palette indices.
+write_png(path, blocks, width, height, palette, compresslevel=6)
+    Write blocks of palette indices as a PNG file.
+write_tiff(path, blocks, width, height, palette)
+    Write blocks of palette indices as an uncompressed TIFF file.
+write_density(path, density, cmap_name, filetype=None, vmin=None, vmax=None, scratch_dir=None)
+    Write a spectral density as a colour-mapped image with time on the x-axis.
+
+'''
+
+import struct
+import tempfile
+import zlib
+import numpy
+
+
+BLOCK_ELEMENTS = 4000000
+
+
+def colourmap_lut(name, levels=256):
+    '''
+    This function returns the lookup table of a matplotlib colourmap.
+
+    Parameters
+    ----------
+    name : str
+        The name of the colourmap.
+    levels : int, optional
+        The number of colours. Default 256
+
+    Returns
+    -------
+    lut : ndarray
+        uint8 ndarray of shape (levels, 3) of RGB colours.
+    '''
+    import matplotlib
+    cmap = matplotlib.colormaps[name]
+    return numpy.rint(cmap(numpy.linspace(0.0, 1.0, levels))[:, :3] * 255).astype(numpy.uint8)
+
+def quantise(values, vmin, vmax, levels=256):
+    '''
+    This function maps values linearly from [vmin, vmax] to the palette indices 0 to levels-1. Values outside of the interval are clipped.
+
+    Parameters
+    ----------
+    values : ndarray
+        The values.
+    vmin : float
+        The value mapped to index 0.
+    vmax : float
+        The value mapped to index levels-1.
+    levels : int, optional
+        The number of palette entries. Default 256
+
+    Returns
+    -------
+    indices : ndarray
+        uint8 ndarray of the same shape as values.
+    '''
+    scale = (levels - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    indices = numpy.subtract(values, vmin, dtype=float)
+    indices *= scale
+    indices += 0.5
+    numpy.clip(indices, 0, levels - 1, out=indices)
+    return indices.astype(numpy.uint8)
+
+def _png_chunk(of, chunk_type, data):
+    of.write(struct.pack(">I", len(data)))
+    of.write(chunk_type)
+    of.write(data)
+    of.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+def write_png(path, blocks, width, height, palette, compresslevel=6):
+    '''
+    This function writes an 8-bit palette PNG file. The rows are compressed and written as they arrive.
+
+    Parameters
+    ----------
+    path : str
+        The path of the PNG file.
+    blocks : iterable
+        uint8 ndarrays of shape (rows, width) of palette indices, from the top row to the bottom row.
+    width : int
+        The width of the image.
+    height : int
+        The height of the image, which has to be the total number of rows of all blocks.
+    palette : ndarray
+        uint8 ndarray of shape (colours, 3) with at most 256 colours.
+    compresslevel : int, optional
+        The zlib compression level between 0 and 9. Default 6
+    '''
+    compressor = zlib.compressobj(compresslevel)
+    rows = 0
+    with open(path, "wb") as of:
+        of.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(of, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        _png_chunk(of, b"PLTE", numpy.ascontiguousarray(palette, dtype=numpy.uint8).tobytes())
+        for block in blocks:
+            # Every row starts with the filter type, 0 means that the row is stored unfiltered
+            filtered = numpy.zeros((block.shape[0], width + 1), dtype=numpy.uint8)
+            filtered[:, 1:] = block
+            rows += block.shape[0]
+            data = compressor.compress(filtered.tobytes())
+            if len(data) > 0:
+                _png_chunk(of, b"IDAT", data)
+        _png_chunk(of, b"IDAT", compressor.flush())
+        _png_chunk(of, b"IEND", b"")
+    if rows != height:
+        raise ValueError("Expected " + str(height) + " rows, got " + str(rows))
+
+def write_tiff(path, blocks, width, height, palette):
+    '''
+    This function writes an uncompressed 8-bit palette TIFF file. Every block is written as one strip as it arrives, the directory of the file is written at the end.
+
+    Parameters
+    ----------
+    path : str
+        The path of the TIFF file.
+    blocks : iterable
+        uint8 ndarrays of shape (rows, width) of palette indices, from the top row to the bottom row. All blocks but the last need the same number of rows.
+    width : int
+        The width of the image.
+    height : int
+        The height of the image, which has to be the total number of rows of all blocks.
+    palette : ndarray
+        uint8 ndarray of shape (colours, 3) with at most 256 colours.
+    '''
+    if width * height > 0xffffffff - 2**20:
+        raise ValueError("The image is too large for a TIFF file.")
+    offsets, counts = [], []
+    rows_per_strip = None
+    with open(path, "wb") as of:
+        of.write(b"II*\x00\x00\x00\x00\x00")
+        for block in blocks:
+            if rows_per_strip is None:
+                rows_per_strip = block.shape[0]
+            offsets.append(of.tell())
+            data = numpy.ascontiguousarray(block, dtype=numpy.uint8).tobytes()
+            counts.append(len(data))
+            of.write(data)
+        if sum(counts) != width * height:
+            raise ValueError("Expected " + str(height) + " rows, got " + str(sum(counts) // max(1, width)))
+
+        # The colour map has 256 entries per channel with 16 bits each
+        colour_map = numpy.zeros((3, 256), dtype=numpy.uint16)
+        colour_map[:, :len(palette)] = numpy.asarray(palette, dtype=numpy.uint16).T * 257
+        if of.tell() % 2 == 1:
+            of.write(b"\x00")
+        arrays = {}
+        for tag, values, fmt in ((273, offsets, "<I"), (279, counts, "<I"), (320, colour_map.ravel(), "<H")):
+            if len(values) * struct.calcsize(fmt) > 4:
+                arrays[tag] = of.tell()
+                of.write(numpy.asarray(values, dtype=fmt).tobytes())
+
+        def entry(tag, field_type, values):
+            fmt = "<H" if field_type == 3 else "<I"
+            if tag in arrays:
+                return struct.pack("<HHII", tag, field_type, len(values), arrays[tag])
+            value = b"".join(struct.pack(fmt, int(v)) for v in values)
+            return struct.pack("<HHI", tag, field_type, len(values)) + value.ljust(4, b"\x00")
+
+        entries = [entry(256, 4, [width]), entry(257, 4, [height]), entry(258, 3, [8]), entry(259, 3, [1]), entry(262, 3, [3]), entry(273, 4, offsets), entry(277, 3, [1]), entry(278, 4, [rows_per_strip or height]), entry(279, 4, counts), entry(320, 3, colour_map.ravel())]
+        ifd_offset = of.tell()
+        of.write(struct.pack("<H", len(entries)) + b"".join(entries) + struct.pack("<I", 0))
+        of.seek(4)
+        of.write(struct.pack("<I", ifd_offset))
+
+def write_density(path, density, cmap_name, filetype=None, vmin=None, vmax=None, scratch_dir=None):
+    '''
+    This function writes a spectral density as a colour-mapped image with one pixel per entry. Time runs from left to right and the wavelength from bottom to top, as in TransientAbsorptionSpectrum.render. The density is read in blocks of wavelengths, so no transposed or flipped copy of the whole density is made. A numpy.memmap is instead read once in blocks of timesteps, whose palette indices are written into a memory mapped scratch file of one byte per entry, from which the image is written.
+
+    Parameters
+    ----------
+    path : str
+        The path of the image.
+    density : ndarray
+        2D ndarray of shape (timesteps, wavelength_res).
+    cmap_name : str
+        The name of the matplotlib colourmap.
+    filetype : str, optional
+        png, tif or tiff. If None, it is taken from the file ending of path. Default None
+    vmin : float, optional
+        The value shown with the lowest colour. If None, the minimum of the density is used. Default None
+    vmax : float, optional
+        The value shown with the highest colour. If None, the maximum of the density is used. Default None
+    scratch_dir : str, optional
+        The directory of the scratch file for memory mapped densities. If None or empty, the default temporary directory is used. Default None
+    '''
+    if filetype is None:
+        filetype = path.rsplit(".", 1)[-1]
+    filetype = filetype.lower()
+    if filetype not in ("png", "tif", "tiff"):
+        raise ValueError("Raw images can only be written as png or tiff, not " + filetype)
+    width, height = density.shape
+    mapped = isinstance(density, numpy.memmap)
+    time_rows = max(1, BLOCK_ELEMENTS // max(1, height))
+    if mapped and (vmin is None or vmax is None) and density.size > 0:
+        lows, highs = zip(*[(numpy.amin(density[t:t+time_rows]), numpy.amax(density[t:t+time_rows])) for t in range(0, width, time_rows)])
+        vmin = float(min(lows)) if vmin is None else vmin
+        vmax = float(max(highs)) if vmax is None else vmax
+    if vmin is None:
+        vmin = float(numpy.amin(density)) if density.size > 0 else 0.0
+    if vmax is None:
+        vmax = float(numpy.amax(density)) if density.size > 0 else 1.0
+    palette = colourmap_lut(cmap_name)
+    block_rows = max(1, BLOCK_ELEMENTS // max(1, width))
+
+    if mapped and density.size > 0:
+        # Reading blocks of wavelengths would read the whole file once per block
+        indices = numpy.memmap(tempfile.TemporaryFile(dir=scratch_dir or None), dtype=numpy.uint8, mode='w+', shape=(height, width))
+        for t in range(0, width, time_rows):
+            indices[:, t:t+time_rows] = quantise(density[t:t+time_rows], vmin, vmax).T[::-1]
+
+        def blocks():
+            for top in range(0, height, block_rows):
+                yield indices[top:top+block_rows]
+    else:
+        def blocks():
+            # Image row r shows wavelength index height-1-r
+            for top in range(0, height, block_rows):
+                stop = height - top
+                start = max(0, stop - block_rows)
+                yield quantise(density[:, start:stop], vmin, vmax).T[::-1]
+
+    if filetype == "png":
+        write_png(path, blocks(), width, height, palette)
+    else:
+        write_tiff(path, blocks(), width, height, palette)
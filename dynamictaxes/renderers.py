@@ -0,0 +1,372 @@
+'''
+
+Reusable renderers for ESA spectra, slices and TA spectra
+
+Creating a matplotlib figure and configuring its axes often takes longer than drawing the data itself. The renderers in this module therefore create their figure and artists once and only update the data of the artists for every image. Each renderer is used in two steps, update(...) sets the data and save(path) writes the image. The figures are drawn on Agg canvases that are independent of pyplot, so they are never shown and never have to be closed.
+
+The render methods of ExcitedStateAbsorptionSpectrum and TransientAbsorptionSpectrum use the renderers of the current session, which are returned by get_renderer.
+
+Methods
+-------
+get_renderer(renderer_class, size)
+    Return the renderer of this session for the given class and figure size.
+close_renderers()
+    Discard all renderers of this session.
+
+'''
+
+import numpy
+
+
+_renderers = {}
+
+
+def get_renderer(renderer_class, size):
+    '''
+    This function returns the renderer of the given class and figure size of this session. It is created on first use and reused afterwards.
+
+    Parameters
+    ----------
+    renderer_class : type
+        ESARenderer, SliceRenderer or TARenderer.
+    size : float, float
+        Width and height of the figure in inches.
+
+    Returns
+    -------
+    renderer : Renderer
+        The renderer.
+    '''
+    key = (renderer_class, float(size[0]), float(size[1]))
+    if key not in _renderers:
+        _renderers[key] = renderer_class(size)
+    return _renderers[key]
+
+def close_renderers():
+    '''
+    This function discards all renderers of this session and frees their figures.
+    '''
+    _renderers.clear()
+
+
+class Renderer:
+    '''
+    Base class of all renderers. It owns a figure with a single axes on an Agg canvas.
+
+    Attributes
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    ax : matplotlib.axes.Axes
+        The axes.
+
+    Methods
+    -------
+    save(path, dpi)
+        Save the current image to path.
+    '''
+
+    def __init__(self, size):
+        import matplotlib.figure as figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = figure.Figure(figsize=size)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+
+    def save(self, path, dpi):
+        '''
+        This method saves the current image to path.
+
+        Parameters
+        ----------
+        path : str
+            The path of the image including the file ending.
+        dpi : int
+            The resolution of the image.
+
+        Returns
+        -------
+        renderer : Renderer
+            This renderer.
+        '''
+        self.fig.savefig(path, bbox_inches='tight', dpi=dpi)
+        return self
+
+
+class ESARenderer(Renderer):
+    '''
+    This class renders ESA spectra as line graphs. The absorption curve, the bands and the bars are kept as artists whose data is replaced for every spectrum. Bands are drawn with half of the opacity of their wavelength colour, and so are the bars if bands are drawn as well.
+
+    If the renderer is animated, all artists that change between spectra are excluded from figure draws, such that the static parts can be drawn once into a background, onto which the artists are blitted for every spectrum, see dynamictaxes.movie.
+
+    Methods
+    -------
+    update(esa, ylim=None, title=None)
+        Show the given ESA spectrum.
+    animated_artists()
+        Return the artists that change between spectra.
+    '''
+
+    def __init__(self, size, animated=False):
+        super().__init__(size)
+        import matplotlib
+        import matplotlib.collections as collections
+        self.animated = animated
+        self.ax.margins(x=0, y=0)
+        self.ax.set_xlabel("Wavelength [nm]")
+        self.ax.set_ylabel("Rel. Transition Moment")
+        self._curve = collections.LineCollection([], linewidths=matplotlib.rcParams['lines.linewidth'], capstyle=matplotlib.rcParams['lines.solid_capstyle'], animated=animated)
+        self.ax.add_collection(self._curve)
+        self._bars = collections.LineCollection([], animated=animated)
+        self.ax.add_collection(self._bars)
+        self._title = self.ax.set_title("", animated=animated)
+        self._band_lines = []
+        self._num_bands = 0
+        self._grid = None
+        self._legend = None
+        self._legend_labels = None
+
+    def update(self, esa, ylim=None, title=None):
+        '''
+        This method replaces the data of all artists by the data of the given ESA spectrum. The render settings are taken from the spectrum.
+
+        Parameters
+        ----------
+        esa : dynamictaxes.excited_state_absorption_spectrum.ExcitedStateAbsorptionSpectrum
+            The ESA spectrum.
+        ylim : float, float, optional
+            The limits of the y-axis. If None, they are fitted to the absorption curve. Default None
+        title : str, optional
+            The title. If None, the title is left unchanged. Default None
+
+        Returns
+        -------
+        renderer : ESARenderer
+            This renderer.
+        '''
+        import matplotlib.lines as lines
+        wavelength_range = esa.wavelength_range
+        wavelength_space = numpy.linspace(wavelength_range[0], wavelength_range[1], num=esa.resolution)
+        norm_tm = numpy.array(esa.transition_moments, dtype=float)
+        if esa.normalise_peakheight and len(norm_tm) > 0:
+            norm_tm /= numpy.amax(norm_tm)
+        with numpy.errstate(divide='ignore'):
+            centres = 1239.841 / numpy.asarray(esa.energies, dtype=float)
+        gaussians = esa.gaussian(wavelength_space[None, :], centres[:, None], norm_tm[:, None])
+        absorption = numpy.sum(gaussians, axis=0)
+
+        # The colours of the absorption curve only change with the wavelength grid
+        grid = (float(wavelength_range[0]), float(wavelength_range[1]), int(esa.resolution))
+        if grid != self._grid:
+            ci = numpy.arange(esa.resolution-1) * (wavelength_range[1] - wavelength_range[0]) / esa.resolution + wavelength_range[0]
+            self._curve.set_colors(esa.col(ci))
+            self.ax.set_xlim(wavelength_range[0], wavelength_range[1])
+            self._grid = grid
+        points = numpy.column_stack((wavelength_space, absorption))
+        self._curve.set_segments(numpy.stack((points[:-1], points[1:]), axis=1))
+        if ylim is None:
+            ylim = (0.0, numpy.amax(absorption)*1.1)
+        self.ax.set_ylim(*ylim)
+        if title is not None:
+            self._title.set_text(title)
+
+        peak_styles = [s.strip() for s in esa.peak_style.split(",")]
+        draw_bands = 'gauss' in peak_styles or 'band' in peak_styles
+        draw_bars = 'bar' in peak_styles
+        colours = numpy.array(esa.col(centres)) if len(centres) > 0 else numpy.zeros((0, 4))
+        if draw_bands:
+            colours[:, 3] = 0.5
+        handle_colours, labels = [], []
+        while draw_bands and len(self._band_lines) < len(gaussians):
+            self._band_lines.append(self.ax.plot([], [], animated=self.animated)[0])
+        self._num_bands = len(gaussians) if draw_bands else 0
+        for i, line in enumerate(self._band_lines):
+            line.set_visible(i < self._num_bands)
+        for i, g in enumerate(gaussians):
+            label = esa.get_multiplicity_label(esa.multiplicity) + "$_" + str(esa.state_num) + " \\rightarrow$ " + esa.reformat_state_label(esa.excited_state_labels[i])
+            if draw_bands:
+                line = self._band_lines[i]
+                line.set_data(wavelength_space, g)
+                line.set_color(colours[i])
+                handle_colours.append(colours[i])
+                labels.append(label)
+            if draw_bars:
+                handle_colours.append(colours[i])
+                labels.append(label)
+        self._bars.set_visible(draw_bars)
+        if draw_bars:
+            self._bars.set_segments([[(c, 0.0), (c, h)] for c, h in zip(centres, norm_tm)])
+            self._bars.set_colors(colours)
+
+        # Laying out the labels of a legend is expensive, so the legend is only rebuilt when the labels change
+        if labels != self._legend_labels:
+            if self._legend is not None:
+                self._legend.remove()
+            self._legend = self.ax.legend([lines.Line2D([], []) for _ in labels], labels) if len(labels) > 0 else None
+            if self._legend is not None:
+                self._legend.set_animated(self.animated)
+            self._legend_labels = labels
+        if self._legend is not None:
+            for handle, colour in zip(self._legend.legend_handles, handle_colours):
+                handle.set_color(colour)
+        return self
+
+    def animated_artists(self):
+        '''
+        This method returns the artists that change between spectra in the order in which they are drawn.
+
+        Returns
+        -------
+        artists : list
+            The visible artists.
+        '''
+        artists = [self._curve] + self._band_lines[:self._num_bands]
+        if self._bars.get_visible():
+            artists.append(self._bars)
+        if self._legend is not None:
+            artists.append(self._legend)
+        return artists + [self._title]
+
+
+class SliceRenderer(Renderer):
+    '''
+    This class renders the time evolution of the intensity at one wavelength or averaged over an interval, optionally with bands of one and two standard deviations.
+
+    Methods
+    -------
+    update(times, intensities, stdev=None, title="", time_unit="fs", colour=None, linewidth=None)
+        Show the given intensities.
+    '''
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.ax.margins(0, 0)
+        self.ax.set_ylabel("Transition Moment")
+        self._line = self.ax.plot([], [])[0]
+        self._bands = []
+
+    def update(self, times, intensities, stdev=None, title="", time_unit="fs", colour=None, linewidth=None):
+        '''
+        This method replaces the data of the slice.
+
+        Parameters
+        ----------
+        times : ndarray
+            1D ndarray of the times.
+        intensities : ndarray
+            1D ndarray of the intensities at these times.
+        stdev : ndarray, optional
+            1D ndarray of standard deviations. If given, bands of one and two standard deviations are drawn around the intensities. Default None
+        title : str, optional
+            The title. Default ""
+        time_unit : str, optional
+            The unit of the times. Default fs
+        colour : str or ndarray, optional
+            The colour of the line and the bands. Default None
+        linewidth : float, optional
+            The width of the line. Default None
+
+        Returns
+        -------
+        renderer : SliceRenderer
+            This renderer.
+        '''
+        times = numpy.asarray(times, dtype=float)
+        intensities = numpy.asarray(intensities, dtype=float)
+        self._line.set_data(times, intensities)
+        if colour is not None:
+            self._line.set_color(colour)
+        if linewidth is not None:
+            self._line.set_linewidth(linewidth)
+
+        # Filled areas cannot be resized, they are replaced
+        for band in self._bands:
+            band.remove()
+        self._bands = []
+        self.ax.relim()
+        if stdev is not None:
+            stdev = numpy.asarray(stdev, dtype=float)
+            for width in (1, 2):
+                band = self.ax.fill_between(times, intensities-width*stdev, intensities+width*stdev, color=colour, alpha=0.2, linewidth=0)
+                self._bands.append(band)
+            if len(times) > 0:
+                self.ax.update_datalim([(numpy.amin(times), numpy.amin(intensities-2*stdev)), (numpy.amax(times), numpy.amax(intensities+2*stdev))])
+        self.ax.autoscale_view()
+        self.ax.set_xlabel("Time [" + time_unit + "]")
+        self.ax.set_title(title)
+        return self
+
+
+class TARenderer(Renderer):
+    '''
+    This class renders TA spectra as colour maps of the spectral density over time and wavelength. Evenly spaced times are shown as an image whose data is replaced, non-uniform times as a mesh.
+
+    Methods
+    -------
+    update(density, times, timestep, wavelength_range, title="", time_unit="fs", interpolation=None, cmap=None, extent=None)
+        Show the given spectral density.
+    '''
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.ax.set_ylabel("Wavelength [nm]")
+        self._image = None
+        self._mesh = None
+
+    def update(self, density, times, timestep, wavelength_range, title="", time_unit="fs", interpolation=None, cmap=None, extent=None):
+        '''
+        This method replaces the shown spectral density.
+
+        Parameters
+        ----------
+        density : ndarray
+            2D ndarray of shape (len(times), wavelength_res) of the spectral density.
+        times : ndarray
+            1D ndarray of the distinct times in ascending order.
+        timestep : float
+            Time between two spectra if the times are evenly spaced.
+        wavelength_range : float, float
+            Lower and upper end of the wavelength range.
+        title : str, optional
+            The title. Default ""
+        time_unit : str, optional
+            The unit of the times. Default fs
+        interpolation : str, optional
+            The interpolation of the image. Default None
+        cmap : str, optional
+            The name of the colourmap. Default None
+        extent : float, float, float, float, optional
+            The time and wavelength ranges of the image. If given, the density is shown as an image with this extent regardless of the times, which is used for binned densities of evenly spaced times. Default None
+
+        Returns
+        -------
+        renderer : TARenderer
+            This renderer.
+        '''
+        if self._mesh is not None:
+            self._mesh.remove()
+            self._mesh = None
+        if extent is None and (len(times) < 3 or numpy.allclose(numpy.diff(times), timestep, rtol=1e-6, atol=0)):
+            extent = (times[0], times[0] + timestep*len(times), wavelength_range[0], wavelength_range[1])
+        if extent is not None:
+            data = numpy.flip(density.T, axis=0)
+            if self._image is None:
+                self._image = self.ax.imshow(data, aspect='auto', interpolation=interpolation, extent=extent, cmap=cmap)
+            else:
+                self._image.set_data(data)
+                self._image.set_extent(extent)
+                self._image.set_interpolation(interpolation)
+                self._image.set_cmap(cmap)
+                self._image.autoscale()
+                self._image.set_visible(True)
+        else:
+            # Non-uniform times cannot be shown as an image
+            if self._image is not None:
+                self._image.set_visible(False)
+            nm_vals = numpy.linspace(wavelength_range[0], wavelength_range[1], num=density.shape[1])
+            self.ax.relim(visible_only=True)
+            self._mesh = self.ax.pcolormesh(times, nm_vals, density.T, shading='nearest', cmap=cmap)
+            self.ax.autoscale_view()
+        self.ax.set_xlabel("Time [" + time_unit + "]")
+        self.ax.set_title(title)
+        return self
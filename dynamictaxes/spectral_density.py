@@ -0,0 +1,403 @@
+'''
+
+Batched evaluation of spectral densities
+
+This module contains the vectorised engine that evaluates the Gaussian bands of many ESA spectra at once. The energies and transition moments of all spectra are packed into flat (ragged) arrays together with an offset array, so that the spectral density of a whole trajectory can be computed in a few broadcast NumPy operations. The work is split into chunks of timesteps to keep the memory footprint bounded. If a memory budget is given, the chunks are sized to fit into it, and densities that are larger than the budget are written into memory mapped scratch files, see allocate_density.
+
+Methods
+-------
+pack_esa_spectra(esa_spectra)
+    Packs the energies and transition moments of a sequence of ESA spectra into flat arrays.
+pad_chunk(offsets, values, start, stop)
+    Builds a padded 2D array from a chunk of a ragged array.
+get_chunk_size(num_states, num_points, chunk_size=None, memory_budget=None)
+    Determines the number of timesteps that are evaluated at once.
+row_chunks(num_rows, num_cols, memory_budget=None)
+    Yields the bounds of chunks of rows of a density.
+allocate_density(shape, memory_budget=None, directory=None)
+    Returns a zeroed density array, which is memory mapped if it exceeds the budget.
+truncation_distance(peak_breadth, tolerance)
+    Returns the distance from the centre beyond which a Gaussian is below the tolerance.
+spectral_density(nm_vals, offsets, energies, transition_moments, peak_breadth, chunk_size=None, out=None, tolerance=None, memory_budget=None)
+    Calculates the spectral density of all packed spectra at the given wavelengths.
+sparse_spectral_density(nm_vals, offsets, energies, transition_moments, peak_breadth, tolerance, chunk_size=None, out=None, memory_budget=None)
+    Calculates the spectral density by evaluating each Gaussian only near its centre.
+averaged_slice(offsets, energies, transition_moments, peak_breadth, lower, upper, chunk_size=None, memory_budget=None)
+    Calculates the exact mean and standard deviation of all packed spectra over a wavelength interval.
+
+'''
+
+import tempfile
+import numpy
+
+
+HC_EV_NM = 1239.841
+CHUNK_ELEMENTS = 4000000
+# The evaluation of a chunk holds up to about this many temporary arrays of CHUNK_ELEMENTS floats
+CHUNK_TEMPORARIES = 4
+
+
+def pack_esa_spectra(esa_spectra):
+    '''
+    This function packs the energies and transition moments of a sequence of ESA spectra into flat arrays. The excitations of spectrum i are stored in the entries offsets[i] to offsets[i+1] of the flat arrays. Sequences that already store their data in this form, such as dynamictaxes.trajectory_store.TrajectoryStore, provide a packed() method whose result is returned directly.
+
+    Parameters
+    ----------
+    esa_spectra : list
+        List of ExcitedStateAbsorptionSpectrum objects or a sequence with a packed() method.
+
+    Returns
+    -------
+    offsets : ndarray
+        Integer ndarray of shape (len(esa_spectra)+1,) with the start index of each spectrum in the flat arrays.
+    energies : ndarray
+        Flat ndarray of all excitation energies.
+    transition_moments : ndarray
+        Flat ndarray of all transition moments.
+    '''
+    if hasattr(esa_spectra, "packed"):
+        return esa_spectra.packed()
+    counts = numpy.array([len(esa.energies) for esa in esa_spectra], dtype=numpy.int64)
+    offsets = numpy.zeros(len(counts)+1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    if len(esa_spectra) == 0:
+        return offsets, numpy.zeros(0), numpy.zeros(0)
+    energies = numpy.concatenate([numpy.asarray(esa.energies, dtype=float).ravel() for esa in esa_spectra])
+    transition_moments = numpy.concatenate([numpy.asarray(esa.transition_moments, dtype=float).ravel() for esa in esa_spectra])
+    return offsets, energies, transition_moments
+
+def pad_chunk(offsets, values, start, stop, fill=0.0):
+    '''
+    This function builds a padded 2D array from the entries of a ragged array that belong to the spectra with index start to stop-1. Missing entries are filled with fill.
+
+    Parameters
+    ----------
+    offsets : ndarray
+        Offset array as returned by pack_esa_spectra.
+    values : ndarray
+        Flat array of values as returned by pack_esa_spectra.
+    start : int
+        Index of the first spectrum in the chunk.
+    stop : int
+        Index after the last spectrum in the chunk.
+    fill : float, optional
+        Value of padded entries. Default 0.0
+
+    Returns
+    -------
+    padded : ndarray
+        The padded array of shape (stop-start, max number of excitations in the chunk)
+    mask : ndarray
+        Boolean ndarray of the same shape that is True for all entries that are not padding.
+    '''
+    counts = offsets[start+1:stop+1] - offsets[start:stop]
+    width = int(numpy.amax(counts)) if len(counts) > 0 else 0
+    mask = numpy.arange(width)[None, :] < counts[:, None]
+    padded = numpy.full(mask.shape, fill, dtype=float)
+    padded[mask] = values[offsets[start]:offsets[stop]]
+    return padded, mask
+
+def get_chunk_size(num_states, num_points, chunk_size=None, memory_budget=None):
+    '''
+    This function determines the number of timesteps that are evaluated in one batch. If chunk_size is not given or not positive, it is chosen such that the temporary arrays contain at most CHUNK_ELEMENTS entries, or such that they need at most about memory_budget bytes if a budget is given.
+
+    Parameters
+    ----------
+    num_states : int
+        Maximum number of excitations per spectrum.
+    num_points : int
+        Number of wavelengths at which the spectra are evaluated.
+    chunk_size : int, optional
+        Requested chunk size. Default None
+    memory_budget : int, optional
+        Memory in bytes available for the temporary arrays. If None or not positive, CHUNK_ELEMENTS is used. Default None
+
+    Returns
+    -------
+    chunk_size : int
+        The number of timesteps per chunk.
+    '''
+    if chunk_size is not None and int(chunk_size) > 0:
+        return int(chunk_size)
+    max_elements = CHUNK_ELEMENTS
+    if memory_budget is not None and memory_budget > 0:
+        max_elements = int(memory_budget) // (8 * CHUNK_TEMPORARIES)
+    return max(1, max_elements // max(1, num_states * num_points))
+
+def row_chunks(num_rows, num_cols, memory_budget=None):
+    '''
+    This function yields the bounds of consecutive chunks of rows of a density of shape (num_rows, num_cols), such that the temporary arrays of each chunk fit into the memory budget. Densities that are memory mapped are read chunk by chunk with these bounds.
+
+    Parameters
+    ----------
+    num_rows : int
+        Number of rows (timesteps).
+    num_cols : int
+        Number of columns (wavelengths).
+    memory_budget : int, optional
+        Memory in bytes available for the temporary arrays, see get_chunk_size. Default None
+
+    Yields
+    ------
+    start : int
+        Index of the first row of the chunk.
+    stop : int
+        Index after the last row of the chunk.
+    '''
+    chunk_size = get_chunk_size(1, num_cols, memory_budget=memory_budget)
+    for start in range(0, num_rows, chunk_size):
+        yield start, min(num_rows, start + chunk_size)
+
+def allocate_density(shape, memory_budget=None, directory=None):
+    '''
+    This function returns a zeroed float array of the given shape. If it needs more than memory_budget bytes, it is memory mapped onto an anonymous temporary file instead of being held in memory. The file is removed by the operating system as soon as the array is no longer referenced.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array.
+    memory_budget : int, optional
+        Memory in bytes available for the array. If None or not positive, the array is always held in memory. Default None
+    directory : str, optional
+        The directory of the temporary file. If None or empty, the default temporary directory is used. Default None
+
+    Returns
+    -------
+    density : ndarray or numpy.memmap
+        The array.
+    '''
+    nbytes = 8 * int(numpy.prod(shape))
+    if memory_budget is None or memory_budget <= 0 or nbytes <= memory_budget or nbytes == 0:
+        return numpy.zeros(shape)
+    scratch = tempfile.TemporaryFile(dir=directory or None)
+    return numpy.memmap(scratch, dtype=float, mode='w+', shape=shape)
+
+def truncation_distance(peak_breadth, tolerance):
+    '''
+    This function returns the distance d from the centre beyond which exp(-2 (d / peak_breadth)^2) is smaller than tolerance.
+
+    Parameters
+    ----------
+    peak_breadth : float
+        Breadth of the Gaussians in nm.
+    tolerance : float
+        Relative tolerance between 0 and 1.
+
+    Returns
+    -------
+    distance : float
+        The truncation distance in nm.
+    '''
+    if not 0 < tolerance < 1:
+        raise ValueError("The density tolerance must be between 0 and 1, got " + str(tolerance))
+    return peak_breadth * numpy.sqrt(-0.5 * numpy.log(tolerance))
+
+def spectral_density(nm_vals, offsets, energies, transition_moments, peak_breadth, chunk_size=None, out=None, tolerance=None, memory_budget=None):
+    '''
+    This function calculates the spectral density of all packed spectra at the given wavelengths. Each excitation contributes a Gaussian of the form height * exp(-2 ((nm - centre) / peak_breadth)^2). If a positive tolerance is given, the Gaussians are truncated, see sparse_spectral_density.
+
+    Parameters
+    ----------
+    nm_vals : ndarray
+        1D ndarray of wavelengths in nm at which the spectra are to be evaluated.
+    offsets : ndarray
+        Offset array as returned by pack_esa_spectra.
+    energies : ndarray
+        Flat array of excitation energies in eV.
+    transition_moments : ndarray
+        Flat array of transition moments.
+    peak_breadth : float
+        Breadth of the Gaussians in nm.
+    chunk_size : int, optional
+        Number of timesteps evaluated at once. If None, it is determined automatically. Default None
+    out : ndarray, optional
+        Array of shape (len(offsets)-1, len(nm_vals)) into which the result is written. Default None
+    tolerance : float, optional
+        Relative tolerance of the truncated evaluation. If None or 0, all Gaussians are evaluated at all wavelengths. Default None
+    memory_budget : int, optional
+        Memory in bytes available for the temporary arrays if chunk_size is not given, see get_chunk_size. Default None
+
+    Returns
+    -------
+    density : ndarray
+        The spectral density as a 2D ndarray of shape (len(offsets)-1, len(nm_vals))
+    '''
+    if tolerance is not None and float(tolerance) > 0:
+        return sparse_spectral_density(nm_vals, offsets, energies, transition_moments, peak_breadth, tolerance, chunk_size=chunk_size, out=out, memory_budget=memory_budget)
+    nm_vals = numpy.asarray(nm_vals, dtype=float)
+    num_spectra = len(offsets) - 1
+    if out is None:
+        out = numpy.zeros((num_spectra, len(nm_vals)))
+    if num_spectra == 0:
+        return out
+
+    max_states = int(numpy.amax(offsets[1:] - offsets[:-1]))
+    chunk_size = get_chunk_size(max_states, len(nm_vals), chunk_size, memory_budget)
+
+    # Only the excitations of the current chunk are read from the flat arrays, which may be memory mapped.
+    for start in range(0, num_spectra, chunk_size):
+        stop = min(num_spectra, start + chunk_size)
+        chunk_energies, mask = pad_chunk(offsets, energies, start, stop)
+        chunk_heights, _ = pad_chunk(offsets, transition_moments, start, stop)
+        with numpy.errstate(divide='ignore'):
+            chunk_centres = HC_EV_NM / chunk_energies
+        exponent = nm_vals[None, None, :] - chunk_centres[:, :, None]
+        exponent /= peak_breadth
+        exponent *= exponent
+        exponent *= -2
+        numpy.exp(exponent, out=exponent)
+        out[start:stop] = numpy.einsum('ij,ijk->ik', chunk_heights, exponent)
+    return out
+
+def sparse_spectral_density(nm_vals, offsets, energies, transition_moments, peak_breadth, tolerance, chunk_size=None, out=None, memory_budget=None):
+    '''
+    This function calculates the spectral density of all packed spectra like spectral_density, but each Gaussian is only evaluated at the wavelengths within truncation_distance(peak_breadth, tolerance) of its centre. Excitations whose window does not overlap the wavelengths are skipped entirely. The window of each excitation is found by binary search in the sorted wavelengths, and the values of all windows of a chunk are added into the result with a single bincount.
+
+    Every neglected value of a Gaussian is smaller than tolerance times its height, hence the absolute error of the density of a spectrum is bounded by tolerance times the sum of the absolute transition moments of that spectrum.
+
+    Parameters
+    ----------
+    nm_vals : ndarray
+        1D ndarray of wavelengths in nm at which the spectra are to be evaluated. They do not need to be sorted.
+    offsets : ndarray
+        Offset array as returned by pack_esa_spectra.
+    energies : ndarray
+        Flat array of excitation energies in eV.
+    transition_moments : ndarray
+        Flat array of transition moments.
+    peak_breadth : float
+        Breadth of the Gaussians in nm.
+    tolerance : float
+        Relative tolerance between 0 and 1.
+    chunk_size : int, optional
+        Number of timesteps evaluated at once. If None, it is determined automatically. Default None
+    out : ndarray, optional
+        Array of shape (len(offsets)-1, len(nm_vals)) into which the result is written. Default None
+    memory_budget : int, optional
+        Memory in bytes available for the temporary arrays if chunk_size is not given, see get_chunk_size. Default None
+
+    Returns
+    -------
+    density : ndarray
+        The spectral density as a 2D ndarray of shape (len(offsets)-1, len(nm_vals))
+    '''
+    nm_vals = numpy.asarray(nm_vals, dtype=float)
+    num_spectra = len(offsets) - 1
+    num_points = len(nm_vals)
+    if out is None:
+        out = numpy.zeros((num_spectra, num_points))
+    if num_spectra == 0 or num_points == 0:
+        return out
+
+    distance = truncation_distance(peak_breadth, float(tolerance))
+    order = None
+    sorted_nm = nm_vals
+    if numpy.any(nm_vals[1:] < nm_vals[:-1]):
+        order = numpy.argsort(nm_vals, kind='stable')
+        sorted_nm = nm_vals[order]
+
+    max_states = int(numpy.amax(offsets[1:] - offsets[:-1]))
+    # Estimate the number of wavelengths per window to bound the temporary arrays like in spectral_density
+    window_points = min(num_points, int(numpy.searchsorted(sorted_nm, sorted_nm[0] + 2 * distance, side='right')) + 1)
+    chunk_size = get_chunk_size(1, max(max_states * window_points, num_points), chunk_size, memory_budget)
+
+    for start in range(0, num_spectra, chunk_size):
+        stop = min(num_spectra, start + chunk_size)
+        chunk_energies = numpy.asarray(energies[offsets[start]:offsets[stop]], dtype=float)
+        chunk_heights = numpy.asarray(transition_moments[offsets[start]:offsets[stop]], dtype=float)
+        rows = numpy.repeat(numpy.arange(stop - start), offsets[start+1:stop+1] - offsets[start:stop])
+        with numpy.errstate(divide='ignore'):
+            centres = HC_EV_NM / chunk_energies
+        lo = numpy.searchsorted(sorted_nm, centres - distance, side='left')
+        hi = numpy.searchsorted(sorted_nm, centres + distance, side='right')
+        active = (hi > lo) & (chunk_heights != 0)
+        if not numpy.any(active):
+            out[start:stop] = 0.0
+            continue
+        lo, hi, rows, centres, heights = lo[active], hi[active], rows[active], centres[active], chunk_heights[active]
+
+        # All windows of the chunk are evaluated with the same width. Windows at the upper end are shifted down, and the entries outside of each window are discarded.
+        width = int(numpy.amax(hi - lo))
+        points = numpy.minimum(lo, num_points - width)[:, None] + numpy.arange(width)
+        values = (sorted_nm[points] - centres[:, None]) / peak_breadth
+        values *= values
+        values *= -2
+        numpy.exp(values, out=values)
+        values *= heights[:, None]
+        values[(points < lo[:, None]) | (points >= hi[:, None])] = 0.0
+
+        indices = points + (rows * num_points)[:, None]
+        chunk = numpy.bincount(indices.ravel(), weights=values.ravel(), minlength=(stop - start) * num_points).reshape(stop - start, num_points)
+        if order is None:
+            out[start:stop] = chunk
+        else:
+            out[start:stop][:, order] = chunk
+    return out
+
+def averaged_slice(offsets, energies, transition_moments, peak_breadth, lower, upper, chunk_size=None, memory_budget=None):
+    '''
+    This function calculates the mean and the standard deviation of the spectral density of all packed spectra over the wavelength interval [lower, upper] in closed form. With s = peak_breadth / sqrt(2), each excitation contributes h * exp(-((nm - c) / s)^2), whose integral is given by the error function. The square of the density is a double sum over pairs of excitations, and the product of two Gaussians is again a Gaussian, which is integrated in the same way.
+
+    Parameters
+    ----------
+    offsets : ndarray
+        Offset array as returned by pack_esa_spectra.
+    energies : ndarray
+        Flat array of excitation energies in eV.
+    transition_moments : ndarray
+        Flat array of transition moments.
+    peak_breadth : float
+        Breadth of the Gaussians in nm.
+    lower : float
+        Lower end of the interval in nm.
+    upper : float
+        Upper end of the interval in nm. Must be larger than lower.
+    chunk_size : int, optional
+        Number of timesteps evaluated at once. If None, it is determined automatically. Default None
+    memory_budget : int, optional
+        Memory in bytes available for the temporary arrays if chunk_size is not given, see get_chunk_size. Default None
+
+    Returns
+    -------
+    mean : ndarray
+        1D ndarray of shape (len(offsets)-1,) of the mean intensities over the interval.
+    std : ndarray
+        1D ndarray of shape (len(offsets)-1,) of the standard deviations over the interval.
+    '''
+    from scipy.special import erf
+    if upper <= lower:
+        raise ValueError("The upper end of the interval must be larger than the lower end.")
+    num_spectra = len(offsets) - 1
+    mean = numpy.zeros(num_spectra)
+    square_mean = numpy.zeros(num_spectra)
+    if num_spectra == 0:
+        return mean, numpy.zeros(num_spectra)
+
+    width = upper - lower
+    s = peak_breadth / numpy.sqrt(2.0)
+    max_states = int(numpy.amax(offsets[1:] - offsets[:-1]))
+    chunk_size = get_chunk_size(max_states * max_states, 1, chunk_size, memory_budget)
+
+    for start in range(0, num_spectra, chunk_size):
+        stop = min(num_spectra, start + chunk_size)
+        chunk_energies, mask = pad_chunk(offsets, energies, start, stop)
+        chunk_heights, _ = pad_chunk(offsets, transition_moments, start, stop)
+        # Padding and excitations without energy do not contribute, their centres are set to 0 to avoid inf - inf
+        valid = mask & (chunk_energies != 0)
+        centres = numpy.zeros(chunk_energies.shape)
+        centres[valid] = HC_EV_NM / chunk_energies[valid]
+        heights = numpy.where(valid, chunk_heights, 0.0)
+
+        # Integral of h * exp(-((x - c) / s)^2) from lower to upper
+        integrals = 0.5 * numpy.sqrt(numpy.pi) * s * (erf((upper - centres) / s) - erf((lower - centres) / s))
+        mean[start:stop] = numpy.sum(heights * integrals, axis=1) / width
+
+        # Integral of the product of two Gaussians, which is centred at the mean of both centres with width s / sqrt(2)
+        pair_heights = heights[:, :, None] * heights[:, None, :]
+        pair_heights *= numpy.exp(-0.5 * ((centres[:, :, None] - centres[:, None, :]) / s)**2)
+        pair_centres = 0.5 * (centres[:, :, None] + centres[:, None, :])
+        s_pair = s / numpy.sqrt(2.0)
+        pair_integrals = 0.5 * numpy.sqrt(numpy.pi) * s_pair * (erf((upper - pair_centres) / s_pair) - erf((lower - pair_centres) / s_pair))
+        square_mean[start:stop] = numpy.sum(pair_heights * pair_integrals, axis=(1, 2)) / width
+
+    return mean, numpy.sqrt(numpy.maximum(square_mean - mean * mean, 0.0))
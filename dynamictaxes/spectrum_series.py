@@ -0,0 +1,284 @@
+'''
+
+Time-indexed container for ESA spectra
+
+The SpectrumSeries class holds the ESA spectra of a TA spectrum ordered by time. Spectra that are appended in order are stored directly. A spectrum that is appended out of order only marks the series as unsorted, and the series is sorted once when it is next read. Merging many trajectories therefore costs a single sort instead of one sort per render.
+
+Spectra with identical times, e.g. from merging several trajectories, are handled according to the config duplicate_times:
+
+keep
+    All spectra are kept in the order in which they were added.
+first
+    Only the spectrum that was added first is kept.
+last
+    Only the spectrum that was added last is kept.
+error
+    A ValueError is raised.
+
+Methods
+-------
+get_duplicate_policy()
+    Return the policy for spectra with identical times.
+select_spectra(times, policy)
+    Return the indices of the spectra that are kept under a duplicate policy.
+locate(times, time)
+    Return the index of the time closest to a given time.
+time_slice(times, start, stop)
+    Return the slice of all times in a closed interval.
+
+'''
+
+import numpy
+import dynamictaxes as dt
+
+
+DUPLICATE_POLICIES = ("keep", "first", "last", "error")
+
+
+def get_duplicate_policy():
+    '''
+    This function returns the policy for spectra with identical times, which is set in the config duplicate_times.
+
+    Returns
+    -------
+    policy : str
+        One of keep, first, last and error.
+    '''
+    policy = dt.get_config("duplicate_times")
+    if policy is None:
+        return "keep"
+    policy = str(policy).lower()
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError("Unknown duplicate_times policy " + policy + ". Allowed values are " + ", ".join(DUPLICATE_POLICIES))
+    return policy
+
+def select_spectra(times, policy):
+    '''
+    This function returns the indices of the spectra that are kept under the given duplicate policy.
+
+    Parameters
+    ----------
+    times : ndarray
+        Times of all spectra in ascending order. Spectra with identical times have to be in the order in which they were added.
+    policy : str
+        One of keep, first, last and error.
+
+    Returns
+    -------
+    indices : ndarray
+        Integer ndarray of the indices of all kept spectra in ascending order.
+    '''
+    times = numpy.asarray(times, dtype=float)
+    if policy == "keep" or len(times) < 2:
+        return numpy.arange(len(times))
+    duplicate = times[1:] == times[:-1]
+    if not numpy.any(duplicate):
+        return numpy.arange(len(times))
+    if policy == "error":
+        raise ValueError("Multiple ESA spectra at time " + str(times[1:][duplicate][0]))
+    if policy == "first":
+        keep = numpy.concatenate(([True], ~duplicate))
+    else:
+        keep = numpy.concatenate((~duplicate, [True]))
+    return numpy.flatnonzero(keep)
+
+def locate(times, time):
+    '''
+    This function returns the index of the time closest to the given time in O(log n).
+
+    Parameters
+    ----------
+    times : ndarray
+        Times in ascending order.
+    time : float
+        The time that is searched.
+
+    Returns
+    -------
+    index : int
+        The index of the closest time. If two times are equally close, the earlier one is returned.
+    '''
+    if len(times) == 0:
+        raise IndexError("Cannot locate a time in an empty series")
+    index = int(numpy.searchsorted(times, time, side='left'))
+    if index == len(times):
+        return index - 1
+    if index > 0 and time - times[index-1] <= times[index] - time:
+        return index - 1
+    return index
+
+def time_slice(times, start, stop):
+    '''
+    This function returns the slice of all times t with start <= t <= stop in O(log n).
+
+    Parameters
+    ----------
+    times : ndarray
+        Times in ascending order.
+    start : float
+        The lower end of the interval.
+    stop : float
+        The upper end of the interval.
+
+    Returns
+    -------
+    s : slice
+        The slice of the indices of all times in the interval.
+    '''
+    return slice(int(numpy.searchsorted(times, start, side='left')), int(numpy.searchsorted(times, stop, side='right')))
+
+
+class SpectrumSeries:
+    '''
+    This class stores ESA spectra ordered by time. It supports len(), iteration and indexing like a list. Appending a spectrum that is earlier than the last one marks the series as unsorted, and it is sorted when it is next read. Spectra with identical times are handled according to get_duplicate_policy.
+
+    Attributes
+    ----------
+    times : ndarray
+        Times of all spectra in ascending order.
+    version : int
+        A counter that changes whenever spectra are added or reordered. Caches derived from the series, such as the spectral density of a TA spectrum, compare it to detect changes.
+
+    Methods
+    -------
+    append(esa_spectrum)
+        Add an ESA spectrum.
+    extend(esa_spectra)
+        Add multiple ESA spectra.
+    sort(key=None)
+        Sort the series if necessary.
+    locate(time)
+        Return the index of the spectrum closest to the given time.
+    time_slice(start, stop)
+        Return the slice of all spectra with start <= time <= stop.
+    between(start, stop)
+        Return the list of all spectra with start <= time <= stop.
+    '''
+
+    def __init__(self, esa_spectra=()):
+        self._spectra = []
+        self._times = []
+        self._times_array = None
+        self._dirty = False
+        self._version = 0
+        self.extend(esa_spectra)
+
+    def append(self, esa_spectrum):
+        '''
+        This method adds an ESA spectrum. If it is not later than the last spectrum, the series is sorted when it is next read.
+
+        Parameters
+        ----------
+        esa_spectrum : dynamictaxes.excited_state_absorption_spectrum.ExcitedStateAbsorptionSpectrum
+            The ESA spectrum.
+        '''
+        time = float(esa_spectrum.time)
+        if len(self._times) > 0 and time <= self._times[-1]:
+            self._dirty = True
+        self._spectra.append(esa_spectrum)
+        self._times.append(time)
+        self._times_array = None
+        self._version += 1
+
+    def extend(self, esa_spectra):
+        '''
+        This method adds multiple ESA spectra.
+
+        Parameters
+        ----------
+        esa_spectra : iterable
+            The ESA spectra.
+        '''
+        for esa_spectrum in esa_spectra:
+            self.append(esa_spectrum)
+
+    def sort(self, key=None):
+        '''
+        This method sorts the series by time and applies the duplicate policy if spectra have been added out of order. The key is ignored, it exists for compatibility with lists.
+        '''
+        if not self._dirty:
+            return
+        times = numpy.array(self._times, dtype=float)
+        order = numpy.argsort(times, kind='stable')
+        order = order[select_spectra(times[order], get_duplicate_policy())]
+        self._spectra = [self._spectra[i] for i in order]
+        self._times = [self._times[i] for i in order]
+        self._times_array = None
+        self._dirty = False
+        self._version += 1
+
+    @property
+    def version(self):
+        self.sort()
+        return self._version
+
+    @property
+    def times(self):
+        self.sort()
+        if self._times_array is None:
+            self._times_array = numpy.array(self._times, dtype=float)
+        return self._times_array
+
+    def __len__(self):
+        self.sort()
+        return len(self._spectra)
+
+    def __getitem__(self, index):
+        self.sort()
+        return self._spectra[index]
+
+    def __iter__(self):
+        self.sort()
+        return iter(self._spectra)
+
+    def locate(self, time):
+        '''
+        This method returns the index of the spectrum closest to the given time.
+
+        Parameters
+        ----------
+        time : float
+            The time that is searched.
+
+        Returns
+        -------
+        index : int
+            The index of the spectrum.
+        '''
+        return locate(self.times, time)
+
+    def time_slice(self, start, stop):
+        '''
+        This method returns the slice of all spectra with start <= time <= stop.
+
+        Parameters
+        ----------
+        start : float
+            The lower end of the interval.
+        stop : float
+            The upper end of the interval.
+
+        Returns
+        -------
+        s : slice
+            The slice of the indices of the spectra.
+        '''
+        return time_slice(self.times, start, stop)
+
+    def between(self, start, stop):
+        '''
+        This method returns all spectra with start <= time <= stop.
+
+        Parameters
+        ----------
+        start : float
+            The lower end of the interval.
+        stop : float
+            The upper end of the interval.
+
+        Returns
+        -------
+        esa_spectra : list
+            The ESA spectra in the interval.
+        '''
+        return self[self.time_slice(start, stop)]
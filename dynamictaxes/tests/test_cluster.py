@@ -0,0 +1,70 @@
+'''
+Tests for splitting DT scripts into PBS job arrays.
+'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import dynamictaxes as dt
+import dynamictaxes.cluster as cluster
+from dynamictaxes.tests.test_loader import write_out_file
+
+
+class TestCluster(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        dt.set_config_key("username", "user")
+        dt.set_config_key("conda_env", "env")
+        dt.set_config_key("cluster_shard_size", 3)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        os.mkdir("data")
+        for i in range(7):
+            write_out_file(os.path.join("data", "traj_%04d.out" % i), [2.0 + 0.1*i, 3.0], [0.3])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def run_task(self, pyscript, task=None):
+        env = dict(os.environ, MPLBACKEND="Agg")
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(cluster.__file__)))
+        command = [sys.executable, pyscript + ".py"]
+        if task is not None:
+            command.append(str(task))
+        subprocess.run(command, check=True, env=env, capture_output=True)
+
+    def test_uses_job_arrays(self):
+        self.assertTrue(cluster.uses_job_arrays(["load data", "render ta to ta"]))
+        self.assertFalse(cluster.uses_job_arrays(["load data.json", "render ta to ta"]))
+        dt.set_config_key("cluster_shard_size", 0)
+        self.assertFalse(cluster.uses_job_arrays(["load data", "render all esa to esa"]))
+
+    def test_job_chain(self):
+        lines = ["load data", "save json to all.json", "render every 2 esa to frames/esa"]
+        args = cluster.make_cluster_jobs(lines, {"selftime": "123"})
+        self.assertTrue(args["job_array"])
+        with open(args["qsubscript"] + ".sh") as f:
+            submit = f.read()
+        self.assertIn("qsub -t 0-2 dttemp123_parse.sh", submit)
+        self.assertIn("afterokarray:$PARSE_JOB", submit)
+        self.assertIn("qsub -t 0-1 -W depend=afterok:$REDUCE_JOB dttemp123_render.sh", submit)
+
+        for task in range(3):
+            self.run_task("pytemp123_parse", task)
+        self.run_task("pytemp123")
+        for task in range(2):
+            self.run_task("pytemp123_render", task)
+
+        loader = dt.Loader()
+        loader.load_from_json("all.json")
+        self.assertEqual([esa.time for esa in loader.ta_spectrum.esa_spectra], [0.05*i for i in range(7)])
+        self.assertEqual(sorted(os.listdir("frames")), ["esa_" + str(i) + ".png" for i in (0, 2, 4, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests for the persistent worker daemon.
+'''
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import dynamictaxes as dt
+import dynamictaxes.daemon as daemon
+import dynamictaxes.dtsl as dtsl
+import dynamictaxes.loader as loader
+from dynamictaxes.tests.test_loader import write_out_file
+
+
+@unittest.skipUnless(hasattr(daemon.socket, "AF_UNIX"), "Unix sockets are not available")
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.datadir = os.path.join(self.tmpdir.name, "data")
+        os.mkdir(self.datadir)
+        for i in range(3):
+            write_out_file(os.path.join(self.datadir, "traj_%04d.out" % i), [2.0 + 0.1*i, 3.0], [0.3])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_dataset_cache(self):
+        d = daemon._Daemon()
+        commands = dtsl.parse_script(["set config load_cache to False", "load " + self.datadir, "save json to out.json"])
+        with unittest.mock.patch.object(loader, "parse_out_file", wraps=loader.parse_out_file) as parse:
+            d.execute(self.tmpdir.name, commands)
+            d.execute(self.tmpdir.name, commands)
+            self.assertEqual(parse.call_count, 3)
+            write_out_file(os.path.join(self.datadir, "traj_0003.out"), [2.5, 3.0], [0.3])
+            d.execute(self.tmpdir.name, commands)
+            self.assertEqual(parse.call_count, 7)
+        self.assertEqual(len(d.datasets), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "out.json")))
+
+    def test_forward(self):
+        socket_path = os.path.join(self.tmpdir.name, "dt.sock")
+        self.assertFalse(daemon.forward([], socket_path))
+        cwd = os.getcwd()
+        thread = threading.Thread(target=daemon.serve, args=(socket_path,), daemon=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            commands = dtsl.parse_script(["set config load_cache to False", "load " + self.datadir, "save npz to " + os.path.join(self.tmpdir.name, "out.npz")])
+            self.assertTrue(daemon.forward(commands, socket_path))
+            with self.assertRaisesRegex(RuntimeError, "missing.json"):
+                daemon.forward(dtsl.parse_script(["load " + os.path.join(self.tmpdir.name, "missing.json")]), socket_path)
+            self.assertTrue(daemon.stop(socket_path))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "out.npz")))
+        self.assertFalse(os.path.exists(socket_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+'''
+Tests for the DTSL parser and the in-process executor.
+'''
+
+import os
+import tempfile
+import unittest
+import dynamictaxes as dt
+import dynamictaxes.dtsl as dtsl
+from dynamictaxes.tests.test_loader import write_out_file
+
+
+class TestDTSL(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_parse_script(self):
+        lines = ["# comment", "", "set config dpi to 100", "load data # trailing", "save npz to a.npz compressed", "render every 3+1 esa to esa/frame", "render esa movie to esa.gif", "render ta raw to ta.tif", "render avg slice at wavelength 400 spanning 20 to avg"]
+        commands = dtsl.parse_script(lines)
+        self.assertEqual(commands, [("set_config", "dpi", 100), ("load_dir", "data"), ("save_npz", "a.npz", True), ("render_esa_batch", 1, 3, "esa/frame"), ("render_esa_movie", "esa.gif"), ("render_ta_raw", "ta.tif"), ("render_avg_slice", 400, 20, "avg")])
+        self.assertEqual(dtsl.parse_script(["load data", "save npz to b", "save json to c.json compact"])[1:], [("save_npz", "b", False), ("save_json", "c.json", True)])
+        with self.assertRaises(Exception):
+            dtsl.parse_script(["render ta to ta"])
+        with self.assertRaises(AssertionError):
+            dtsl.parse_script(["load data", "render every 0 esa to esa"])
+
+    def test_run_matches_pytext(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datadir = os.path.join(tmpdir, "data")
+            os.mkdir(datadir)
+            for i in range(4):
+                write_out_file(os.path.join(datadir, "traj_%04d.out" % i), [2.0 + 0.1*i, 3.0], [0.3])
+            in_process = os.path.join(tmpdir, "in_process.json")
+            generated = os.path.join(tmpdir, "generated.json")
+
+            loader = dtsl.run(dtsl.parse_script(["set config load_cache to True", "load " + datadir, "save json to " + in_process]))
+            self.assertTrue(dt.get_config("load_cache"))
+            self.assertEqual(len(loader.ta_spectrum.esa_spectra), 4)
+
+            pytext = dtsl.to_pytext(dtsl.parse_script(["set config load_cache to True", "load " + datadir, "save json to " + generated]))
+            exec(pytext, {})
+            with open(in_process) as a, open(generated) as b:
+                self.assertEqual(a.read(), b.read())
+
+            dtsl.run([])
+            self.assertFalse(dt.get_config("load_cache"))
+
+
+if __name__ == '__main__':
+    unittest.main()
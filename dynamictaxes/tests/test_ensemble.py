@@ -0,0 +1,128 @@
+'''
+Tests for ensemble averaging over many trajectories.
+'''
+
+import os
+import tempfile
+import unittest
+import matplotlib
+matplotlib.use('Agg')
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.dtsl as dtsl
+import dynamictaxes.ensemble as ensemble
+
+
+class TestEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        dt.set_config_key("wavelength_res", 60)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sources = []
+        self.densities = []
+        rng = numpy.random.default_rng(5)
+        for traj in range(4):
+            loader = dt.Loader()
+            for i in range(5 + traj):
+                loader.add_record({
+                    "time": i * 0.5 + rng.uniform(-0.1, 0.1),
+                    "state_number": 1,
+                    "multiplicity": 1,
+                    "absorption_energies": list(rng.uniform(1.5, 4.5, size=3)),
+                    "transition_moments": list(rng.uniform(0.0, 1.0, size=3))
+                })
+            path = os.path.join(self.tmpdir.name, "traj_" + str(traj) + ".json")
+            loader.save_to_json(path)
+            self.sources.append(path)
+            self.densities.append((loader.ta_spectrum.get_times(), numpy.array(loader.ta_spectrum.get_spectral_density())))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def reference(self):
+        times = numpy.concatenate([t for t, d in self.densities])
+        density = numpy.concatenate([d for t, d in self.densities])
+        bins = numpy.rint(times / 0.5).astype(int)
+        mean = numpy.array([density[bins == b].mean(axis=0) for b in numpy.unique(bins)])
+        var = numpy.array([density[bins == b].var(axis=0) for b in numpy.unique(bins)])
+        return numpy.unique(bins) * 0.5, mean, var
+
+    def test_mean_and_variance(self):
+        times, mean, var = self.reference()
+        for workers in (1, 2):
+            accumulator = ensemble.accumulate_ensemble(self.sources, 0.5, workers=workers)
+            self.assertEqual(accumulator.num_trajectories, 4)
+            self.assertTrue(numpy.allclose(accumulator.get_times(), times))
+            self.assertTrue(numpy.allclose(accumulator.mean(), mean))
+            self.assertTrue(numpy.allclose(accumulator.variance(), var, atol=1e-12))
+
+    def test_variance_with_large_mean(self):
+        rng = numpy.random.default_rng(3)
+        times = numpy.zeros(6)
+        densities = [1e8 + rng.normal(0.0, 1e-3, size=(6, 60)) for _ in range(2)]
+        accumulators = [ensemble.EnsembleAccumulator(0.5) for _ in range(2)]
+        for accumulator, density in zip(accumulators, densities):
+            for start in (0, 3):
+                accumulator.add_density(times[start:start+3], density[start:start+3])
+        accumulators[0].merge(accumulators[1])
+        reference = numpy.concatenate(densities).var(axis=0)
+        self.assertTrue(numpy.allclose(accumulators[0].variance()[0], reference, rtol=1e-3, atol=0))
+
+    def test_merge_requires_same_grid(self):
+        with self.assertRaises(ValueError):
+            ensemble.EnsembleAccumulator(0.5).merge(ensemble.EnsembleAccumulator(0.25))
+
+    def test_render_ensemble(self):
+        pattern = os.path.join(self.tmpdir.name, "traj_*.json")
+        out = os.path.join(self.tmpdir.name, "out")
+        loader = dtsl.run(dtsl.parse_script(["set config wavelength_res to 60", "load ensemble " + pattern + " timestep 0.5", "render ta to " + out + "/ta", "render avg slice at wavelength 400 spanning 20 to " + out + "/avg"]))
+        self.assertIsInstance(loader.ta_spectrum, ensemble.EnsembleSpectrum)
+        self.assertTrue(os.path.isfile(os.path.join(out, "ta.png")))
+        self.assertTrue(os.path.isfile(os.path.join(out, "avg.png")))
+        self.assertEqual(len(loader.ta_spectrum.get_times()), 8)
+        for save in (loader.save_to_json, loader.save_to_npz):
+            with self.assertRaisesRegex(ValueError, "ensemble"):
+                save(os.path.join(out, "ensemble"))
+        self.assertEqual(sorted(os.listdir(out)), ["avg.png", "ta.png"])
+
+    def test_mono_slice_stdev(self):
+        import dynamictaxes.renderers as renderers
+        times, mean, var = self.reference()
+        spectrum = ensemble.accumulate_ensemble(self.sources, 0.5, workers=1).to_ta_spectrum()
+        self.assertTrue(numpy.allclose(spectrum.get_stdev_density(), numpy.sqrt(var), atol=1e-6))
+        self.assertIs(spectrum.get_stdev_density(), spectrum.get_stdev_density())
+        wavelength = spectrum.wavelength_range[0] + 7 * (spectrum.wavelength_range[1] - spectrum.wavelength_range[0]) / 59
+        intensities, stdev = spectrum.get_mono_slice(wavelength)
+        self.assertTrue(numpy.allclose(intensities, mean[:, 7]))
+        self.assertTrue(numpy.allclose(stdev, numpy.sqrt(var[:, 7]), atol=1e-6))
+        spectrum.render_mono_slice(wavelength, os.path.join(self.tmpdir.name, "mono"))
+        self.assertEqual(len(renderers.get_renderer(renderers.SliceRenderer, spectrum.linegraph_size)._bands), 2)
+        self.assertIsNone(dt.TransientAbsorptionSpectrum().get_mono_slice(400)[1])
+
+    def test_add_density_memory_budget(self):
+        import unittest.mock
+        times, density = self.densities[3]
+        accumulator = ensemble.EnsembleAccumulator(0.5)
+        with unittest.mock.patch.object(ensemble.sd, "row_chunks", wraps=ensemble.sd.row_chunks) as row_chunks:
+            accumulator.add_density(times, density, memory_budget=16 * density.shape[1])
+        self.assertEqual(row_chunks.call_args[0][2], 16 * density.shape[1])
+        reference = ensemble.EnsembleAccumulator(0.5)
+        reference.add_density(times, density)
+        self.assertTrue(numpy.allclose(accumulator.means, reference.means))
+        self.assertTrue(numpy.array_equal(accumulator.counts, reference.counts))
+
+    def test_render_ensemble_binned(self):
+        import dynamictaxes.renderers as renderers
+        spectrum = ensemble.accumulate_ensemble(self.sources, 0.5, workers=1).to_ta_spectrum()
+        spectrum.ta_size = (0.02, 0.02)
+        spectrum.dpi = 100
+        spectrum.binning = "mean"
+        spectrum.render(os.path.join(self.tmpdir.name, "binned"))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir.name, "binned.png")))
+        renderer = renderers.get_renderer(renderers.TARenderer, spectrum.ta_size)
+        self.assertEqual(renderer._image.get_array().shape, (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
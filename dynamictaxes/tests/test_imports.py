@@ -0,0 +1,40 @@
+'''
+Tests for the lazy imports of the package.
+'''
+
+import os
+import subprocess
+import sys
+import unittest
+import dynamictaxes as dt
+
+
+def imported_modules(code):
+    '''
+    Runs code in a fresh interpreter and returns the heavy modules that were imported.
+    '''
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(dt.__file__))))
+    check = code + "; import sys; print(','.join(m for m in ('numpy', 'matplotlib') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, env=env, check=True)
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+class TestImports(unittest.TestCase):
+
+    def test_package_import(self):
+        self.assertEqual(imported_modules("import dynamictaxes, dynamictaxes.main"), [])
+
+    def test_conversion_does_not_import_matplotlib(self):
+        self.assertEqual(imported_modules("import dynamictaxes as dt; dt.init_configs(); dt.Loader(); dt.ExcitedStateAbsorptionSpectrum()"), ["numpy"])
+
+    def test_lazy_attributes(self):
+        import dynamictaxes.loader
+        self.assertIs(dt.loader, dynamictaxes.loader)
+        self.assertIsInstance(dt.Loader(), dynamictaxes.loader.Loader)
+        with self.assertRaises(AttributeError):
+            dt.does_not_exist
+
+
+if __name__ == '__main__':
+    unittest.main()
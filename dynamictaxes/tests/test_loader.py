@@ -0,0 +1,130 @@
+'''
+Tests for loading QChem OUT-Files.
+'''
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.loader as loader
+
+
+def write_out_file(path, excitation_energies, strengths, padding_lines=0):
+    '''
+    Writes a minimal QChem-like OUT-File with the sections read by the loader.
+    '''
+    lines = ["Welcome to Q-Chem", "$molecule", "0 1", "O 0.0 0.0 0.0", "$end"]
+    lines += ["filler line " + str(i) for i in range(padding_lines)]
+    lines += ["", "TDDFT Excitation Energies", ""]
+    for i, e in enumerate(excitation_energies):
+        lines.append(" Excited state %3d: excitation energy (eV) =    %.4f" % (i+1, e))
+        lines.append(" Total energy for state %3d:              -76.00000000 au" % (i+1))
+        lines.append("    Multiplicity: Singlet")
+        lines.append("")
+    lines.append("                    Transition Moments Between Ground and Excited States")
+    lines.append(" " + "-" * 68)
+    lines.append("    States   X           Y           Z           Strength(a.u.)")
+    lines.append(" " + "-" * 68)
+    for i in range(len(excitation_energies)):
+        lines.append("    0 %4d    0.100000    0.100000    0.100000    0.010000" % (i+1))
+    lines.append("")
+    lines.append("                    Transition Moments Between Excited States")
+    lines.append(" " + "-" * 68)
+    lines.append("    States   X           Y           Z           Strength(a.u.)")
+    lines.append(" " + "-" * 68)
+    for i in range(1, len(excitation_energies)):
+        for j in range(i+1, len(excitation_energies)+1):
+            strength = strengths[j-2] if i == 1 else 0.5
+            lines.append("    %d %4d    0.100000    0.100000    0.100000    %.6f" % (i, j, strength))
+    lines.append(" " + "-" * 68)
+    lines.append("Thank you very much for using Q-Chem.")
+    with open(path, "w") as of:
+        of.write("\n".join(lines) + "\n")
+
+
+class TestLoader(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dirpath = self.tmpdir.name
+        rng = numpy.random.default_rng(1)
+        self.expected = {}
+        for step in (0, 20, 40, 60):
+            energies = numpy.sort(rng.uniform(2.0, 8.0, size=20))
+            strengths = rng.uniform(0.0, 1.0, size=19)
+            write_out_file(os.path.join(self.dirpath, "traj_" + str(step) + ".out"), energies, strengths)
+            self.expected[step * 0.05] = (numpy.round(energies, 4)[1:] - numpy.round(energies[0], 4), numpy.round(strengths, 6))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check_loaded(self, l):
+        self.assertEqual(len(l.ta_spectrum.esa_spectra), len(self.expected))
+        for esa in l.ta_spectrum.esa_spectra:
+            energies, strengths = self.expected[esa.time]
+            self.assertEqual(esa.multiplicity, 1)
+            self.assertTrue(numpy.allclose(esa.energies, energies))
+            self.assertTrue(numpy.allclose(esa.transition_moments, strengths))
+
+    def test_parse_out_file(self):
+        record = loader.parse_out_file(os.path.join(self.dirpath, "traj_20.out"))
+        self.assertEqual(record['time'], 1.0)
+        self.assertEqual(len(record['absorption_energies']), 19)
+        self.assertEqual(len(record['transition_moments']), 19)
+
+    def test_parse_stops_after_last_section(self):
+        path = os.path.join(self.dirpath, "traj_20.out")
+        with open(path, "a") as of:
+            of.write(" Excited state  21: excitation energy (eV) =    9.0000\n")
+        record = loader.parse_out_file(path)
+        self.assertEqual(len(record['absorption_energies']), 19)
+
+    def test_serial_and_parallel_load(self):
+        serial = dt.Loader()
+        serial.load_from_dir(self.dirpath, workers=1)
+        self.check_loaded(serial)
+        parallel = dt.Loader()
+        parallel.load_from_dir(self.dirpath, workers=2)
+        self.check_loaded(parallel)
+        self.assertEqual([e.time for e in serial.ta_spectrum.esa_spectra], [e.time for e in parallel.ta_spectrum.esa_spectra])
+
+    def test_failed_file_is_reported(self):
+        with open(os.path.join(self.dirpath, "broken_80.out"), "w") as of:
+            of.write("This is not a QChem file\n")
+        l = dt.Loader()
+        l.load_from_dir(self.dirpath, workers=2)
+        self.check_loaded(l)
+        self.assertEqual(len(l.failed_files), 1)
+        self.assertTrue(l.failed_files[0][0].endswith("broken_80.out"))
+
+    def test_parse_cache(self):
+        # The cache is opt-in, a default load does not write into the data directory
+        dt.Loader().load_from_dir(self.dirpath, workers=1)
+        self.assertFalse(os.path.isfile(os.path.join(self.dirpath, ".dtcache.json")))
+
+        first = dt.Loader()
+        first.load_from_dir(self.dirpath, use_cache=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.dirpath, ".dtcache.json")))
+
+        def fail(outfile):
+            return outfile, None, "parsed again"
+
+        with unittest.mock.patch.object(loader, "_parse_out_file_safe", fail):
+            cached = dt.Loader()
+            cached.load_from_dir(self.dirpath, workers=1, use_cache=True)
+            self.check_loaded(cached)
+            self.assertEqual(len(cached.failed_files), 0)
+
+            path = os.path.join(self.dirpath, "traj_40.out")
+            os.utime(path, ns=(0, 0))
+            changed = dt.Loader()
+            changed.load_from_dir(self.dirpath, workers=1, use_cache=True)
+            self.assertEqual(len(changed.failed_files), 1)
+            self.assertEqual(changed.failed_files[0][0], os.path.abspath(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
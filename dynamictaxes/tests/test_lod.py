@@ -0,0 +1,63 @@
+'''
+Tests for reducing spectral densities to the pixel grid.
+'''
+
+import unittest
+import numpy
+import dynamictaxes.lod as lod
+
+
+class TestBinning(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.default_rng(3)
+        self.times = numpy.arange(1000) * 0.5
+        self.density = rng.random((1000, 30))
+
+    def test_bin_rows(self):
+        for mode, reduce in (("mean", numpy.mean), ("max", numpy.amax)):
+            binned, weights, starts = lod.bin_rows(self.density, 7, mode)
+            self.assertEqual(binned.shape, (7, 30))
+            self.assertEqual(weights.sum(), 1000)
+            bounds = numpy.append(starts, 1000)
+            for i in range(7):
+                self.assertTrue(numpy.allclose(binned[i], reduce(self.density[bounds[i]:bounds[i+1]], axis=0)))
+        binned, weights, starts = lod.bin_rows(self.density, 1000, "mean")
+        self.assertIs(binned, self.density)
+
+    def test_bin_density(self):
+        binned, times = lod.bin_density(self.density, self.times, (10, 6), "mean")
+        self.assertEqual(binned.shape, (10, 6))
+        self.assertTrue(numpy.allclose(times, self.times.reshape(10, 100).mean(axis=1)))
+        self.assertTrue(numpy.allclose(binned, self.density.reshape(10, 100, 6, 5).mean(axis=(1, 3))))
+
+    def test_pyramid(self):
+        for mode, reduce in (("mean", numpy.mean), ("max", numpy.amax)):
+            pyramid = lod.DensityPyramid(self.times, self.density, mode)
+            binned, times = pyramid.select(0, 1000, (125, 30))
+            direct, direct_times = lod.bin_density(self.density, self.times, (125, 30), mode)
+            self.assertTrue(numpy.allclose(binned, direct))
+            self.assertTrue(numpy.allclose(times, direct_times))
+            self.assertEqual(len(pyramid.levels), 4)
+
+            # Sub-ranges aligned with the bins of a level are exact
+            binned, times = pyramid.select(256, 512, (16, 30))
+            self.assertTrue(numpy.allclose(binned, reduce(self.density[256:512].reshape(16, 16, 30), axis=1)))
+            self.assertTrue(numpy.allclose(times, self.times[256:512].reshape(16, 16).mean(axis=1)))
+        with self.assertRaises(ValueError):
+            lod.DensityPyramid(self.times, self.density, "none")
+
+    def test_pyramid_odd_lengths(self):
+        pyramid = lod.DensityPyramid(self.times[:999], self.density[:999])
+        pyramid.select(0, 999, (10, 30))
+        for level in range(1, len(pyramid.levels)):
+            times, weights, density = pyramid.levels[level]
+            starts = numpy.arange(0, 999, 2**level)
+            sizes = numpy.diff(numpy.append(starts, 999))
+            self.assertTrue(numpy.array_equal(weights, sizes))
+            self.assertTrue(numpy.allclose(density, numpy.add.reduceat(self.density[:999], starts, axis=0) / sizes[:, None]))
+            self.assertTrue(numpy.allclose(times, numpy.add.reduceat(self.times[:999], starts) / sizes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+'''
+Tests for computing and reading spectral densities out of core.
+'''
+
+import os
+import tempfile
+import unittest
+import matplotlib
+matplotlib.use('Agg')
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.ensemble as ensemble
+import dynamictaxes.spectral_density as sd
+
+
+class TestOutOfCore(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(11)
+        self.ta = dt.TransientAbsorptionSpectrum()
+        for i in range(40):
+            esa = dt.ExcitedStateAbsorptionSpectrum()
+            # Every fourth time appears twice, such that duplicates are averaged
+            esa.time = (i - i // 4) * 0.5
+            esa.energies = rng.uniform(1.5, 4.5, size=4)
+            esa.transition_moments = rng.uniform(0.0, 1.0, size=4)
+            self.ta.add_esa_spectrum(esa)
+        self.ta.wavelength_res = 80
+        self.times, self.density = (numpy.array(a) for a in self.ta.get_render_density())
+        self.raw_density = numpy.array(self.ta.get_spectral_density())
+        self.nm = numpy.linspace(300, 700, num=7)
+        self.slices = self.ta.interpolate_density(self.nm), self.ta.get_avg_slice(500, 50, mode="grid")
+        self.ta.memory_budget = 0.005
+        self.ta.invalidate()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_allocate_density(self):
+        self.assertNotIsInstance(sd.allocate_density((10, 10), 800), numpy.memmap)
+        self.assertNotIsInstance(sd.allocate_density((10, 10)), numpy.memmap)
+        mapped = sd.allocate_density((10, 11), 800, self.tmpdir.name)
+        self.assertIsInstance(mapped, numpy.memmap)
+        self.assertEqual(numpy.count_nonzero(mapped), 0)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+        chunks = list(sd.row_chunks(100, 10, memory_budget=8 * sd.CHUNK_TEMPORARIES * 30))
+        self.assertEqual(chunks[:2], [(0, 3), (3, 6)])
+        self.assertEqual(chunks[-1], (99, 100))
+
+    def test_density_is_memory_mapped(self):
+        for tolerance in (0, 1e-8):
+            self.ta.density_tolerance = tolerance
+            density = self.ta.get_spectral_density()
+            self.assertIsInstance(density, numpy.memmap)
+            self.assertFalse(density.flags.writeable)
+            self.assertTrue(numpy.allclose(density, self.raw_density))
+        times, density = self.ta.get_render_density()
+        self.assertIs(self.ta.get_render_density()[1], density)
+        self.assertIsInstance(density, numpy.memmap)
+        self.assertTrue(numpy.array_equal(times, self.times))
+        self.assertTrue(numpy.allclose(density, self.density))
+
+    def test_slices(self):
+        self.assertTrue(numpy.allclose(self.ta.interpolate_density(self.nm), self.slices[0]))
+        mean, stdev = self.ta.get_avg_slice(500, 50, mode="grid")
+        self.assertTrue(numpy.allclose(mean, self.slices[1][0]))
+        self.assertTrue(numpy.allclose(stdev, self.slices[1][1]))
+
+    def test_pyramid(self):
+        pyramid = self.ta.get_density_pyramid("mean")
+        self.assertIsInstance(pyramid.select(0, len(self.times), (8, 80))[0], numpy.ndarray)
+        self.assertIsInstance(pyramid.levels[1][2], numpy.memmap)
+        for level in range(1, len(pyramid.levels)):
+            starts = numpy.arange(0, len(self.times), 2**level)
+            sizes = numpy.diff(numpy.append(starts, len(self.times)))
+            self.assertTrue(numpy.allclose(pyramid.levels[level][2], numpy.add.reduceat(self.density, starts, axis=0) / sizes[:, None]))
+
+    def test_render_raw(self):
+        from PIL import Image
+        import dynamictaxes.raster as raster
+        expected = raster.colourmap_lut(self.ta.cmap_name)[raster.quantise(self.density, self.density.min(), self.density.max())].transpose(1, 0, 2)[::-1]
+        raster.BLOCK_ELEMENTS, block_elements = 170, raster.BLOCK_ELEMENTS
+        try:
+            for name in ("raw.png", "raw.tif"):
+                path = os.path.join(self.tmpdir.name, name)
+                self.ta.render_raw(path)
+                with Image.open(path) as image:
+                    self.assertTrue(numpy.allclose(numpy.asarray(image.convert("RGB")), expected, atol=1))
+        finally:
+            raster.BLOCK_ELEMENTS = block_elements
+
+    def test_ensemble(self):
+        in_memory = ensemble.EnsembleAccumulator(0.5, wavelength_range=self.ta.wavelength_range, wavelength_res=80, peak_breadth=self.ta.peak_breadth)
+        in_memory.add_density(self.ta.get_times(), self.raw_density)
+        out_of_core = ensemble.EnsembleAccumulator(0.5, wavelength_range=self.ta.wavelength_range, wavelength_res=80, peak_breadth=self.ta.peak_breadth)
+        out_of_core.add_density(self.ta.get_times(), self.ta.get_spectral_density())
+        self.assertTrue(numpy.array_equal(in_memory.counts, out_of_core.counts))
+        self.assertTrue(numpy.allclose(in_memory.mean(), out_of_core.mean()))
+
+
+if __name__ == '__main__':
+    unittest.main()
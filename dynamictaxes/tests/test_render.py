@@ -0,0 +1,174 @@
+'''
+Tests for rendering spectra with the Agg backend.
+'''
+
+import os
+import tempfile
+import unittest
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy
+import dynamictaxes as dt
+
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ta = dt.TransientAbsorptionSpectrum()
+        for i in range(6):
+            esa = dt.ExcitedStateAbsorptionSpectrum()
+            esa.time = i * 0.5
+            esa.energies = numpy.linspace(1.5 + i / 10, 4.0, num=3)
+            esa.transition_moments = numpy.array([0.2, 0.5, 0.3])
+            esa.excited_state_labels = ["S2", "S3", "S4"]
+            self.ta.add_esa_spectrum(esa)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_esa_render_does_not_leak_figures(self):
+        figures = len(plt.get_fignums())
+        path = os.path.join(self.tmpdir.name, "esa", "esa_0")
+        self.ta.esa_spectra[0].render(path)
+        self.assertTrue(os.path.isfile(path + ".png"))
+        self.assertEqual(len(plt.get_fignums()), figures)
+
+    def test_render_esa_batch(self):
+        path = os.path.join(self.tmpdir.name, "frames", "esa")
+        for workers in (1, 2):
+            paths = self.ta.render_esa_batch(range(1, 6, 2), path, workers=workers)
+            self.assertEqual(paths, [path + "_" + str(i) + ".png" for i in (1, 3, 5)])
+            for p in paths:
+                self.assertTrue(os.path.isfile(p))
+
+    def test_render_ta_irregular_times(self):
+        esa = dt.ExcitedStateAbsorptionSpectrum()
+        esa.time = 10.0
+        esa.energies = numpy.array([2.0])
+        esa.transition_moments = numpy.array([0.4])
+        self.ta.add_esa_spectrum(esa)
+        self.ta.add_esa_spectrum(self.ta.esa_spectra[2])
+        path = os.path.join(self.tmpdir.name, "ta")
+        self.ta.render(path)
+        self.assertTrue(os.path.isfile(path + ".png"))
+        self.assertEqual(self.ta.timestep, 0.5)
+
+    def test_render_esa_movie(self):
+        from PIL import Image
+        figures = len(plt.get_fignums())
+        esa = dt.ExcitedStateAbsorptionSpectrum()
+        esa.time = 3.0
+        esa.energies = numpy.array([2.0, 2.5, 3.0, 3.5])
+        esa.transition_moments = numpy.array([0.1, 0.2, 0.3, 0.4])
+        esa.excited_state_labels = ["S2", "S3", "S4", "S5"]
+        self.ta.add_esa_spectrum(esa)
+        path = self.ta.render_esa_movie(os.path.join(self.tmpdir.name, "movie", "esa"), filetype='gif', fps=5)
+        self.assertEqual(path, os.path.join(self.tmpdir.name, "movie", "esa.gif"))
+        with Image.open(path) as movie:
+            self.assertEqual(movie.n_frames, 7)
+        self.assertEqual(len(plt.get_fignums()), figures)
+        with self.assertRaises(ValueError):
+            self.ta.render_esa_movie(path, indices=[])
+
+    def test_render_esa_movie_keeps_first_error(self):
+        import unittest.mock
+        import dynamictaxes.movie as movie
+
+        class FailingWriter:
+            def write(self, frame):
+                raise ValueError("encoding failed")
+
+            def close(self):
+                raise BrokenPipeError()
+
+        with unittest.mock.patch.object(movie, "open_frame_writer", lambda *args: FailingWriter()):
+            with self.assertRaisesRegex(ValueError, "encoding failed"):
+                self.ta.render_esa_movie(os.path.join(self.tmpdir.name, "broken.mp4"))
+
+    def test_gif_writers(self):
+        import unittest.mock
+        import matplotlib.animation as animation
+        import dynamictaxes.movie as movie
+        path = os.path.join(self.tmpdir.name, "long.gif")
+        with unittest.mock.patch.object(animation.writers, "is_available", lambda name: False):
+            self.assertIsInstance(movie.open_frame_writer(path, 25, 10, 10, movie.GIF_FALLBACK_FRAMES), movie.GIFFrameWriter)
+            with self.assertRaisesRegex(RuntimeError, "ffmpeg"):
+                movie.open_frame_writer(path, 25, 10, 10, movie.GIF_FALLBACK_FRAMES + 1)
+        with unittest.mock.patch.object(animation.writers, "is_available", lambda name: True), unittest.mock.patch("subprocess.Popen") as popen:
+            writer = movie.open_frame_writer(path, 25, 10, 10, 5000)
+        self.assertIsInstance(writer, movie.FFMpegFrameWriter)
+        command = popen.call_args[0][0]
+        self.assertEqual(command[-3:], ["-f", "gif", path])
+        self.assertIn("paletteuse", command[-4])
+
+    def test_renderers_are_reused(self):
+        import dynamictaxes.renderers as renderers
+        renderers.close_renderers()
+        self.ta.render_avg_slice(450, 50, os.path.join(self.tmpdir.name, "avg"))
+        self.ta.render_mono_slice(450, os.path.join(self.tmpdir.name, "mono"))
+        slice_renderer = renderers.get_renderer(renderers.SliceRenderer, self.ta.linegraph_size)
+        self.assertEqual(len(slice_renderer.ax.collections), 0)
+        self.assertEqual(len(slice_renderer.ax.lines), 1)
+
+        for i in range(3):
+            self.ta.esa_spectra[i].render(os.path.join(self.tmpdir.name, "esa_" + str(i)))
+        esa_renderer = renderers.get_renderer(renderers.ESARenderer, self.ta.esa_spectra[0].linegraph_size)
+        self.assertEqual(len([key for key in renderers._renderers if key[0] is renderers.ESARenderer]), 1)
+        self.assertEqual(len(esa_renderer.ax.get_legend().get_texts()), 6)
+        for name in ("avg", "mono", "esa_0", "esa_1", "esa_2"):
+            self.assertTrue(os.path.isfile(os.path.join(self.tmpdir.name, name + ".png")))
+
+    def test_esa_bar_colours(self):
+        import dynamictaxes.renderers as renderers
+        esa = self.ta.esa_spectra[0]
+        renderer = renderers.ESARenderer(esa.linegraph_size)
+        esa.peak_style = "gauss, bar"
+        renderer.update(esa)
+        numpy.testing.assert_allclose(renderer._bars.get_colors()[:, 3], 0.5)
+        numpy.testing.assert_allclose([matplotlib.colors.to_rgba(handle.get_color())[3] for handle in renderer.ax.get_legend().legend_handles], 0.5)
+        esa.peak_style = "bar"
+        renderer.update(esa)
+        numpy.testing.assert_allclose(renderer._bars.get_colors()[:, 3], 1.0)
+
+    def test_render_binned(self):
+        import dynamictaxes.renderers as renderers
+        self.ta.ta_size = (0.02, 0.02)
+        self.ta.dpi = 100
+        renderer = renderers.get_renderer(renderers.TARenderer, self.ta.ta_size)
+        for binning in ("mean", "max", "none"):
+            self.ta.binning = binning
+            self.ta.render(os.path.join(self.tmpdir.name, "ta_" + binning))
+            self.assertEqual(renderer._image.get_array().shape, (500, 6) if binning == "none" else (2, 2))
+        self.ta.binning = "max"
+        self.ta.render(os.path.join(self.tmpdir.name, "ta_range"), time_range=(1.0, 2.0))
+        self.assertEqual(list(renderer._image.get_extent()[:2]), [1.0, 2.5])
+        self.assertEqual(numpy.amax(renderer._image.get_array()), numpy.amax(self.ta.get_spectral_density()[2:5]))
+        with self.assertRaises(ValueError):
+            self.ta.render(os.path.join(self.tmpdir.name, "ta_empty"), time_range=(5.0, 6.0))
+
+    def test_render_raw(self):
+        from PIL import Image
+        import dynamictaxes.raster as raster
+        times, density = self.ta.get_render_density()
+        expected = raster.colourmap_lut(self.ta.cmap_name)[raster.quantise(density, density.min(), density.max())].transpose(1, 0, 2)[::-1]
+        for name in ("raw", "raw.tiff"):
+            path = os.path.join(self.tmpdir.name, name)
+            self.ta.render_raw(path)
+            with Image.open(path if "." in name else path + ".png") as image:
+                self.assertEqual(image.mode, "P")
+                self.assertTrue(numpy.array_equal(numpy.asarray(image.convert("RGB")), expected))
+        raster.BLOCK_ELEMENTS, block_elements = 7, raster.BLOCK_ELEMENTS
+        try:
+            path = os.path.join(self.tmpdir.name, "blocks.tif")
+            self.ta.render_raw(path)
+            with Image.open(path) as image:
+                self.assertTrue(numpy.array_equal(numpy.asarray(image.convert("RGB")), expected))
+        finally:
+            raster.BLOCK_ELEMENTS = block_elements
+
+
+if __name__ == '__main__':
+    unittest.main()
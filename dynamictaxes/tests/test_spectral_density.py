@@ -0,0 +1,216 @@
+'''
+Tests for the batched spectral density engine.
+'''
+
+import unittest
+import unittest.mock
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.spectral_density as sd
+
+
+def make_ta_spectrum(num_spectra=40, seed=0):
+    rng = numpy.random.default_rng(seed)
+    ta = dt.TransientAbsorptionSpectrum()
+    for i in range(num_spectra):
+        esa = dt.ExcitedStateAbsorptionSpectrum()
+        num_states = int(rng.integers(1, 8))
+        esa.time = i * 0.5
+        esa.energies = rng.uniform(1.0, 6.0, size=num_states)
+        esa.transition_moments = rng.uniform(0.0, 1.0, size=num_states)
+        ta.add_esa_spectrum(esa)
+    return ta
+
+def reference_density(ta):
+    nm_vals = numpy.linspace(ta.wavelength_range[0], ta.wavelength_range[1], num=ta.wavelength_res)
+    reference = numpy.zeros((len(ta.esa_spectra), len(nm_vals)))
+    for i, esa in enumerate(ta.esa_spectra):
+        for e, t in zip(1239.841 / esa.energies, esa.transition_moments):
+            reference[i] += ta.gaussian(nm_vals, e, t)
+    return reference
+
+
+class TestSpectralDensity(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_matches_esa_slice(self):
+        ta = make_ta_spectrum()
+        reference = reference_density(ta)
+        self.assertTrue(numpy.allclose([ta.esa_slice(i) for i in range(len(ta.esa_spectra))], reference, rtol=1e-12, atol=1e-14))
+        nm_vals = numpy.linspace(ta.wavelength_range[0], ta.wavelength_range[1], num=ta.wavelength_res)
+        offsets, energies, transition_moments = sd.pack_esa_spectra(ta.esa_spectra)
+        for chunk_size in (None, 1, 7, 1000):
+            # The cached density does not depend on the chunk size, so the engine is called directly
+            density = sd.spectral_density(nm_vals, offsets, energies, transition_moments, ta.peak_breadth, chunk_size=chunk_size)
+            self.assertEqual(density.shape, reference.shape)
+            self.assertTrue(numpy.allclose(density, reference, rtol=1e-12, atol=1e-14))
+            ta.invalidate()
+            self.assertTrue(numpy.allclose(ta.get_spectral_density(chunk_size=chunk_size), reference, rtol=1e-12, atol=1e-14))
+
+    def test_pack_esa_spectra(self):
+        ta = make_ta_spectrum(num_spectra=5)
+        offsets, energies, transition_moments = sd.pack_esa_spectra(ta.esa_spectra)
+        self.assertEqual(len(offsets), 6)
+        for i, esa in enumerate(ta.esa_spectra):
+            self.assertTrue(numpy.array_equal(energies[offsets[i]:offsets[i+1]], esa.energies))
+            self.assertTrue(numpy.array_equal(transition_moments[offsets[i]:offsets[i+1]], esa.transition_moments))
+
+    def test_esa_evaluate(self):
+        ta = make_ta_spectrum(num_spectra=3)
+        nm_vals = numpy.linspace(150, 1100, 37)
+        for esa in ta.esa_spectra:
+            reference = numpy.zeros(len(nm_vals))
+            for e, t in zip(esa.energies, esa.transition_moments):
+                reference += esa.gaussian(nm_vals, 1239.841 / e, t)
+            self.assertTrue(numpy.allclose(esa.evaluate(nm_vals), reference))
+            self.assertAlmostEqual(esa.evaluate(432.1), esa.evaluate(numpy.array([432.1]))[0])
+
+    def test_ta_evaluate(self):
+        ta = make_ta_spectrum()
+        nm_vals = numpy.array([250.0, 480.5, 900.0])
+        batched = ta.evaluate(nm_vals)
+        self.assertEqual(batched.shape, (len(ta.esa_spectra), 3))
+        for i, esa in enumerate(ta.esa_spectra):
+            self.assertTrue(numpy.allclose(batched[i], esa.evaluate(nm_vals)))
+        self.assertTrue(numpy.allclose(ta.evaluate(480.5), batched[:, 1]))
+
+    def test_empty(self):
+        ta = dt.TransientAbsorptionSpectrum()
+        self.assertEqual(ta.get_spectral_density().shape, (0, ta.wavelength_res))
+
+
+class TestDensityCache(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_cache_invalidation(self):
+        ta = make_ta_spectrum()
+        with unittest.mock.patch.object(sd, "spectral_density", wraps=sd.spectral_density) as density:
+            first = ta.get_spectral_density()
+            self.assertIs(ta.get_spectral_density(), first)
+            self.assertFalse(first.flags.writeable)
+            self.assertEqual(density.call_count, 1)
+
+            dt.set_config_key("peak_breadth", 30)
+            self.assertEqual(ta.get_spectral_density().shape, first.shape)
+            self.assertEqual(density.call_count, 2)
+
+            ta.wavelength_res = 200
+            self.assertEqual(ta.get_spectral_density().shape, (len(ta.esa_spectra), 200))
+            self.assertEqual(density.call_count, 3)
+
+            ta.add_esa_spectrum(make_ta_spectrum(num_spectra=1).esa_spectra[0])
+            self.assertEqual(ta.get_spectral_density().shape, (len(ta.esa_spectra), 200))
+            self.assertEqual(density.call_count, 4)
+
+            ta.esa_spectra.append(make_ta_spectrum(num_spectra=1).esa_spectra[0])
+            self.assertEqual(ta.get_spectral_density().shape, (len(ta.esa_spectra), 200))
+            self.assertEqual(density.call_count, 5)
+
+    def test_sort_only_when_needed(self):
+        ta = make_ta_spectrum(num_spectra=5)
+        version = ta._version
+        ta.sort_esa_spectra()
+        self.assertEqual(ta._version, version)
+
+        early = make_ta_spectrum(num_spectra=1).esa_spectra[0]
+        early.time = -1.0
+        ta.add_esa_spectrum(early)
+        ta.sort_esa_spectra()
+        self.assertIs(ta.esa_spectra[0], early)
+        self.assertTrue(numpy.all(numpy.diff(ta.get_times()) >= 0))
+
+    def test_interpolate_density(self):
+        ta = make_ta_spectrum()
+        nm_vals = numpy.linspace(300, 700, 57)
+        self.assertTrue(numpy.allclose(ta.interpolate_density(nm_vals), ta.evaluate(nm_vals), rtol=0, atol=1e-3))
+        self.assertTrue(numpy.allclose(ta.interpolate_density(float(ta.wavelength_range[0])), ta.evaluate(float(ta.wavelength_range[0]))))
+        outside = numpy.array([100.0, 400.0])
+        self.assertTrue(numpy.array_equal(ta.interpolate_density(outside), ta.evaluate(outside)))
+
+
+class TestAveragedSlice(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_matches_dense_sampling(self):
+        ta = make_ta_spectrum()
+        for centre, span in ((450.0, 20.0), (300.0, 5.0), (600.0, 150.0)):
+            mean, stdev = ta.get_avg_slice(centre, span, mode="analytic")
+            sampled_mean, sampled_stdev = ta.get_avg_slice(centre, span, intres=20001, mode="sampled")
+            self.assertTrue(numpy.allclose(mean, sampled_mean, rtol=0, atol=1e-4))
+            self.assertTrue(numpy.allclose(stdev, sampled_stdev, rtol=0, atol=1e-4))
+
+    def test_chunking_and_modes(self):
+        ta = make_ta_spectrum()
+        packed = sd.pack_esa_spectra(ta.esa_spectra)
+        full = sd.averaged_slice(*packed, ta.peak_breadth, 400.0, 480.0)
+        chunked = sd.averaged_slice(*packed, ta.peak_breadth, 400.0, 480.0, chunk_size=3)
+        self.assertTrue(numpy.allclose(full[0], chunked[0]) and numpy.allclose(full[1], chunked[1]))
+        grid_mean, _ = ta.get_avg_slice(440.0, 40.0, intres=2001, mode="grid")
+        self.assertTrue(numpy.allclose(grid_mean, full[0], rtol=0, atol=1e-3))
+        with self.assertRaises(ValueError):
+            ta.get_avg_slice(440.0, 40.0, mode="unknown")
+        point, zero = ta.get_avg_slice(440.0, 0.0)
+        self.assertTrue(numpy.allclose(point, ta.evaluate(440.0)))
+        self.assertTrue(numpy.all(zero == 0))
+
+
+class TestSparseDensity(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_error_bound(self):
+        ta = make_ta_spectrum()
+        offsets, energies, transition_moments = sd.pack_esa_spectra(ta.esa_spectra)
+        bound = numpy.add.reduceat(numpy.abs(transition_moments), offsets[:-1])
+        nm_vals = numpy.linspace(150, 1500, 3001)
+        dense = sd.spectral_density(nm_vals, offsets, energies, transition_moments, 25.0)
+        for tolerance in (1e-2, 1e-6, 1e-12):
+            sparse = sd.spectral_density(nm_vals, offsets, energies, transition_moments, 25.0, chunk_size=7, tolerance=tolerance)
+            self.assertTrue(numpy.all(numpy.abs(sparse - dense) <= tolerance * bound[:, None] + 1e-15))
+        shuffled = numpy.random.default_rng(1).permutation(len(nm_vals))
+        sparse = sd.sparse_spectral_density(nm_vals[shuffled], offsets, energies, transition_moments, 25.0, 1e-12)
+        self.assertTrue(numpy.allclose(sparse, dense[:, shuffled], rtol=0, atol=1e-10))
+        with self.assertRaises(ValueError):
+            sd.sparse_spectral_density(nm_vals, offsets, energies, transition_moments, 25.0, 2.0)
+
+    def test_error_bound_matches_reference(self):
+        ta = make_ta_spectrum()
+        reference = reference_density(ta)
+        bound = numpy.array([numpy.sum(numpy.abs(esa.transition_moments)) for esa in ta.esa_spectra])
+        for tolerance in (1e-2, 1e-6):
+            ta.density_tolerance = tolerance
+            density = ta.get_spectral_density()
+            self.assertTrue(numpy.all(numpy.abs(density - reference) <= tolerance * bound[:, None] + 1e-15))
+            self.assertTrue(numpy.all(numpy.abs(ta.esa_slice(0) - reference[0]) <= tolerance * bound[0] + 1e-15))
+
+    def test_out_of_range_bands(self):
+        nm_vals = numpy.linspace(400, 500, 11)
+        offsets = numpy.array([0, 2, 3])
+        energies = numpy.array([0.5, 2.8, 10.0])
+        transition_moments = numpy.array([1.0, 1.0, 1.0])
+        sparse = sd.sparse_spectral_density(nm_vals, offsets, energies, transition_moments, 10.0, 1e-8)
+        self.assertTrue(numpy.all(sparse[1] == 0))
+        self.assertTrue(numpy.allclose(sparse[0], numpy.exp(-2 * ((nm_vals - 1239.841 / 2.8) / 10.0)**2)))
+
+    def test_settings(self):
+        ta = make_ta_spectrum()
+        dense = ta.get_spectral_density()
+        dt.set_config_key("density_tolerance", "1e-9")
+        sparse = ta.get_spectral_density()
+        self.assertIsNot(dense, sparse)
+        self.assertTrue(numpy.allclose(dense, sparse, rtol=0, atol=1e-7))
+        self.assertTrue(numpy.allclose(ta.esa_slice(3), dense[3], rtol=0, atol=1e-7))
+        nm_vals = numpy.linspace(300, 700, 41)
+        esa = ta.esa_spectra[3]
+        self.assertTrue(numpy.allclose(esa.evaluate(nm_vals), ta.evaluate(nm_vals)[3], rtol=0, atol=1e-7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Tests for the time-indexed container of ESA spectra.
+'''
+
+import os
+import tempfile
+import unittest
+import numpy
+import dynamictaxes as dt
+import dynamictaxes.spectrum_series as spectrum_series
+import dynamictaxes.trajectory_store as trajectory_store
+
+
+def make_esa(time, energy=2.0):
+    esa = dt.ExcitedStateAbsorptionSpectrum()
+    esa.time = time
+    esa.energies = numpy.array([energy])
+    esa.transition_moments = numpy.array([0.5])
+    esa.excited_state_labels = ["S2"]
+    return esa
+
+
+class TestSpectrumSeries(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+
+    def test_lazy_sort(self):
+        series = spectrum_series.SpectrumSeries(make_esa(t) for t in (0.0, 1.0, 2.0))
+        self.assertFalse(series._dirty)
+        series.append(make_esa(0.5))
+        series.append(make_esa(-1.0))
+        self.assertTrue(series._dirty)
+        self.assertTrue(numpy.array_equal(series.times, [-1.0, 0.0, 0.5, 1.0, 2.0]))
+        self.assertEqual([esa.time for esa in series], [-1.0, 0.0, 0.5, 1.0, 2.0])
+        self.assertFalse(series._dirty)
+
+    def test_version(self):
+        series = spectrum_series.SpectrumSeries(make_esa(t) for t in (0.0, 1.0))
+        version = series.version
+        series.append(make_esa(2.0))
+        self.assertGreater(series.version, version)
+        version = series.version
+        series.append(make_esa(0.5))
+        len(series)
+        self.assertGreater(series.version, version)
+        version = series.version
+        self.assertEqual([esa.time for esa in series], [0.0, 0.5, 1.0, 2.0])
+        self.assertEqual(series.version, version)
+
+    def test_assigned_lists_are_copied(self):
+        ta = dt.TransientAbsorptionSpectrum()
+        spectra = [make_esa(0.0), make_esa(1.0)]
+        ta.esa_spectra = spectra
+        spectra.append(make_esa(2.0))
+        self.assertEqual(len(ta.esa_spectra), 2)
+        ta.esa_spectra.append(make_esa(2.0))
+        self.assertEqual(len(ta.esa_spectra), 3)
+        self.assertEqual(len(spectra), 3)
+
+    def test_lookup(self):
+        series = spectrum_series.SpectrumSeries(make_esa(t) for t in (0.0, 1.0, 1.5, 4.0))
+        self.assertEqual(series.locate(1.2), 1)
+        self.assertEqual(series.locate(1.3), 2)
+        self.assertEqual(series.locate(-5.0), 0)
+        self.assertEqual(series.locate(9.0), 3)
+        self.assertEqual([esa.time for esa in series.between(1.0, 4.0)], [1.0, 1.5, 4.0])
+        self.assertEqual(series.time_slice(2.0, 3.0), slice(3, 3))
+
+    def test_duplicate_policies(self):
+        first, second = make_esa(1.0, energy=2.0), make_esa(1.0, energy=3.0)
+        for policy, expected in (("keep", [first, second]), ("first", [first]), ("last", [second])):
+            dt.set_config_key("duplicate_times", policy)
+            series = spectrum_series.SpectrumSeries([make_esa(0.0), first, second])
+            self.assertEqual(list(series)[1:], expected)
+        dt.set_config_key("duplicate_times", "error")
+        with self.assertRaises(ValueError):
+            len(spectrum_series.SpectrumSeries([first, second]))
+
+    def test_trajectory_store(self):
+        loader = dt.Loader()
+        for t in (0.0, 2.0, 1.0, 1.0):
+            loader.ta_spectrum.add_esa_spectrum(make_esa(t))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.npz")
+            loader.save_to_npz(path)
+            self.assertEqual(len(trajectory_store.TrajectoryStore(path)), 4)
+            dt.set_config_key("duplicate_times", "first")
+            store = trajectory_store.TrajectoryStore(path)
+            self.assertTrue(numpy.array_equal(store.times, [0.0, 1.0, 2.0]))
+            self.assertEqual(store.locate(1.9), 2)
+            self.assertEqual(store.time_slice(0.5, 1.5), slice(1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
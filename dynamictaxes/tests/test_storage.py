@@ -0,0 +1,77 @@
+'''
+Tests for the JSON and NPZ storage formats.
+'''
+
+import json
+import os
+import tempfile
+import unittest
+import numpy
+import dynamictaxes as dt
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        dt.init_configs()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(2)
+        self.loader = dt.Loader()
+        for i in range(30):
+            num_states = int(rng.integers(1, 6))
+            self.loader.add_record({
+                "time": float(i) * 0.05,
+                "state_number": 1,
+                "multiplicity": int(rng.integers(1, 4)),
+                "absorption_energies": list(rng.uniform(0.5, 5.0, size=num_states)),
+                "transition_moments": list(rng.uniform(0.0, 1.0, size=num_states))
+            })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def assertSameSpectra(self, a, b):
+        self.assertEqual(len(a.ta_spectrum.esa_spectra), len(b.ta_spectrum.esa_spectra))
+        for esa_a, esa_b in zip(a.ta_spectrum.esa_spectra, b.ta_spectrum.esa_spectra):
+            self.assertEqual(esa_a.time, esa_b.time)
+            self.assertEqual(esa_a.state_num, esa_b.state_num)
+            self.assertEqual(esa_a.multiplicity, esa_b.multiplicity)
+            self.assertTrue(numpy.array_equal(esa_a.energies, esa_b.energies))
+            self.assertTrue(numpy.array_equal(esa_a.transition_moments, esa_b.transition_moments))
+
+    def test_npz_round_trip(self):
+        for compressed in (False, True):
+            self.loader.save_to_npz(self.path("data.npz"), compressed=compressed)
+            loaded = dt.Loader()
+            loaded.load_from_npz(self.path("data.npz"))
+            self.assertSameSpectra(self.loader, loaded)
+
+    def test_json_npz_json_round_trip(self):
+        self.loader.save_to_json(self.path("data.json"))
+        from_json = dt.Loader()
+        from_json.load_from_json(self.path("data.json"))
+        from_json.save_to_npz(self.path("data.npz"))
+        from_npz = dt.Loader()
+        from_npz.load_from_npz(self.path("data.npz"))
+        from_npz.save_to_json(self.path("data2.json"))
+        self.assertSameSpectra(self.loader, from_npz)
+        with open(self.path("data.json")) as f1, open(self.path("data2.json")) as f2:
+            self.assertEqual(json.load(f1), json.load(f2))
+
+    def test_lazy_npz(self):
+        self.loader.save_to_npz(self.path("data.npz"))
+        lazy = dt.Loader()
+        lazy.load_from_npz(self.path("data.npz"), lazy=True)
+        store = lazy.ta_spectrum.esa_spectra
+        self.assertIsInstance(store.energies, numpy.memmap)
+        self.assertSameSpectra(self.loader, lazy)
+        self.assertEqual(store[-1].time, self.loader.ta_spectrum.esa_spectra[-1].time)
+        self.assertTrue(numpy.allclose(lazy.ta_spectrum.get_spectral_density(), self.loader.ta_spectrum.get_spectral_density()))
+        self.assertTrue(numpy.array_equal(lazy.ta_spectrum.get_times(), self.loader.ta_spectrum.get_times()))
+
+
+if __name__ == '__main__':
+    unittest.main()
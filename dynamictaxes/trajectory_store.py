@@ -0,0 +1,192 @@
+'''
+
+Memory mapped access to trajectories stored in NPZ files
+
+The TrajectoryStore class opens an NPZ file written by Loader.save_to_npz without reading it into memory. Uncompressed arrays are memory mapped directly from the zip archive, so only the parts that are actually accessed are read from disk. ESA spectra are built only when they are accessed, while density and slice computations can use the flat arrays directly.
+
+'''
+
+import struct
+import zipfile
+import numpy
+import numpy.lib.format
+import dynamictaxes as dt
+import dynamictaxes.spectrum_series as spectrum_series
+
+
+ARRAY_NAMES = ("times", "state_numbers", "multiplicities", "offsets", "absorption_energies", "transition_moments")
+
+
+def _map_npz_member(path, zf, info):
+    '''
+    This function memory maps an array stored in an NPZ file. If the member is compressed, it cannot be mapped and is read into memory instead.
+
+    Parameters
+    ----------
+    path : str
+        The path of the NPZ file.
+    zf : zipfile.ZipFile
+        The opened NPZ file.
+    info : zipfile.ZipInfo
+        The member of the array.
+
+    Returns
+    -------
+    array : ndarray or numpy.memmap
+        The (mapped) array.
+    '''
+    if info.compress_type != zipfile.ZIP_STORED:
+        with zf.open(info) as member:
+            return numpy.lib.format.read_array(member)
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = numpy.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        raise ValueError("Arrays of objects cannot be memory mapped")
+    if int(numpy.prod(shape)) == 0:
+        return numpy.zeros(shape, dtype=dtype)
+    order = 'F' if fortran_order else 'C'
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order=order)
+
+
+class TrajectoryStore:
+    '''
+    This class provides read-only, lazy access to the ESA spectra stored in an NPZ file. It supports len(), iteration and indexing like the list of ESA spectra of a TransientAbsorptionSpectrum. Each access builds a new ExcitedStateAbsorptionSpectrum, therefore changes to these objects are not stored.
+
+    Attributes
+    ----------
+    path : str
+        The path of the NPZ file.
+    times : ndarray
+        Times of all spectra in ascending order. Spectra with identical times are handled according to the config duplicate_times, see dynamictaxes.spectrum_series.
+    state_numbers : ndarray
+        State numbers of all spectra.
+    multiplicities : ndarray
+        Multiplicities of all spectra.
+    offsets : ndarray
+        The excitations of spectrum i are stored at the indices offsets[i] to offsets[i+1]-1 of energies and transition_moments.
+    energies : ndarray
+        Flat array of all excitation energies.
+    transition_moments : ndarray
+        Flat array of all transition moments.
+
+    Methods
+    -------
+    packed()
+        Return the offsets, energies and transition moments as flat arrays.
+    sort(key=None)
+        Does nothing, the spectra are always sorted by time.
+    locate(time)
+        Return the index of the spectrum closest to the given time.
+    time_slice(start, stop)
+        Return the slice of all spectra with start <= time <= stop.
+    between(start, stop)
+        Return the list of all spectra with start <= time <= stop.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        arrays = {}
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+                if name in ARRAY_NAMES:
+                    arrays[name] = _map_npz_member(path, zf, info)
+        for name in ARRAY_NAMES:
+            if name not in arrays:
+                raise ValueError("The file " + path + " does not contain the array " + name)
+
+        self.times = arrays["times"]
+        self.state_numbers = arrays["state_numbers"]
+        self.multiplicities = arrays["multiplicities"]
+        self.offsets = arrays["offsets"]
+        self.energies = arrays["absorption_energies"]
+        self.transition_moments = arrays["transition_moments"]
+
+        order = numpy.arange(len(self.times))
+        if numpy.any(numpy.diff(self.times) < 0):
+            order = numpy.argsort(self.times, kind='stable')
+        order = order[spectrum_series.select_spectra(self.times[order], spectrum_series.get_duplicate_policy())]
+        if len(order) != len(self.times) or numpy.any(order != numpy.arange(len(order))):
+            # Files that are not sorted by time or contain dropped duplicates are reordered in memory
+            counts = (self.offsets[1:] - self.offsets[:-1])[order]
+            index = numpy.concatenate([numpy.arange(self.offsets[i], self.offsets[i+1]) for i in order] + [numpy.zeros(0, dtype=numpy.int64)])
+            self.times = self.times[order]
+            self.state_numbers = self.state_numbers[order]
+            self.multiplicities = self.multiplicities[order]
+            self.energies = self.energies[index]
+            self.transition_moments = self.transition_moments[index]
+            self.offsets = numpy.zeros(len(order)+1, dtype=numpy.int64)
+            numpy.cumsum(counts, out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("TrajectoryStore index out of range")
+        start, stop = int(self.offsets[index]), int(self.offsets[index+1])
+        esa = dt.ExcitedStateAbsorptionSpectrum()
+        esa.time = float(self.times[index])
+        esa.state_num = int(self.state_numbers[index])
+        esa.multiplicity = int(self.multiplicities[index])
+        esa.energies = numpy.asarray(self.energies[start:stop])
+        esa.transition_moments = numpy.asarray(self.transition_moments[start:stop])
+        esa.excited_state_labels = ["S" + str(j+2) for j in range(stop-start)]
+        return esa
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def packed(self):
+        '''
+        This method returns the excitation data of all spectra as flat arrays without building any ESA spectra, see dynamictaxes.spectral_density.pack_esa_spectra.
+
+        Returns
+        -------
+        offsets : ndarray
+            Integer ndarray of shape (len(self)+1,)
+        energies : ndarray
+            Flat ndarray of all excitation energies.
+        transition_moments : ndarray
+            Flat ndarray of all transition moments.
+        '''
+        return self.offsets, self.energies, self.transition_moments
+
+    def sort(self, key=None):
+        '''
+        The spectra of a TrajectoryStore are always sorted by time, therefore this method does nothing. It exists for compatibility with lists.
+        '''
+        pass
+
+    def locate(self, time):
+        '''
+        This method returns the index of the spectrum closest to the given time, see dynamictaxes.spectrum_series.locate.
+        '''
+        return spectrum_series.locate(self.times, time)
+
+    def time_slice(self, start, stop):
+        '''
+        This method returns the slice of all spectra with start <= time <= stop, see dynamictaxes.spectrum_series.time_slice.
+        '''
+        return spectrum_series.time_slice(self.times, start, stop)
+
+    def between(self, start, stop):
+        '''
+        This method returns the list of all spectra with start <= time <= stop.
+        '''
+        return self[self.time_slice(start, stop)]
@@ -5,28 +5,31 @@ A class for TA spectra
 '''
 
 import numpy
-import matplotlib.pyplot as plt
-import matplotlib
-import re
 import os
 import dynamictaxes as dt
+import dynamictaxes.batch_render as batch_render
+import dynamictaxes.excited_state_absorption_spectrum as esa
+import dynamictaxes.spectral_density as sd
+import dynamictaxes.spectrum_series as spectrum_series
 
 class TransientAbsorptionSpectrum:
     '''
     This class is used as a storage for all data relevant to a TA spectrum as well as relevant methods.
 
+    Render settings are read from the configs on access unless they have been set explicitly for this instance. The spectral density is cached and shared by all renders. The cache is invalidated when spectra are added or reordered, also through esa_spectra.append, and when the wavelength range, wavelength_res, peak_breadth or density_tolerance change.
+
     Attributes
     ----------
-    esa_spectra : list
-        List of all ESA spectra that make up the TA spectrum.
+    esa_spectra : dynamictaxes.spectrum_series.SpectrumSeries
+        All ESA spectra that make up the TA spectrum, ordered by time. Lists that are assigned are copied into a new SpectrumSeries, so later changes to the assigned list do not affect the TA spectrum; spectra are added with add_esa_spectrum or esa_spectra.append. This can also be a dynamictaxes.trajectory_store.TrajectoryStore, which builds the spectra only on access.
     cmap_name : str
         Name of the colourmap used for rendering. Loaded from default.config
     wavelength_range : float, float
         Lower and upper end of the wavelength range that is rendered. Loaded from default.config
     wavelength_res : int
         Number of resolved points over the wavelength spectrum.
-    timestep : int
-        Time between two consecutive ESA spectra. This is generated automatically from the ESA.time values
+    timestep : float
+        Typical time between two consecutive ESA spectra. This is generated automatically from the ESA.time values, see get_timestep
     time_unit : str
         Unit of timestep. Loaded from default.config
     interpolation : str 
@@ -39,8 +42,14 @@ class TransientAbsorptionSpectrum:
         Title of an averaged slice spectrum. Loaded from default.config
     peak_breadth : float
         Breadth of a single Gaussian peak. Loaded from default.config
+    density_tolerance : float
+        Relative tolerance below which Gaussians are truncated when the spectral density is evaluated. 0 evaluates all Gaussians everywhere. Loaded from default.config
+    memory_budget : float
+        Memory in MiB available for the spectral density and the temporary arrays of its evaluation. Larger densities are computed out of core into memory mapped scratch files and read chunk by chunk. 0 means no limit. Loaded from default.config
     dpi : int
         DPI at which the TA spectrum should be rendered. Loaded from default.config
+    binning : str
+        How the spectral density is reduced to the pixels of the image if it has more timesteps or wavelengths than pixels. One of mean, max and none. Loaded from default.config
     colour : ndarray
         RGBA sytle ndarray that gives the colour of the line in an (averaged) slice spectrum. Loaded from default.config
     linewidth : float
@@ -52,23 +61,52 @@ class TransientAbsorptionSpectrum:
 
     '''
 
+    cmap_name = esa._config_property("cmap_name", "ta_colourmap")
+    wavelength_range = esa._config_property("wavelength_range", "wavelength_range_lower", "wavelength_range_upper")
+    wavelength_res = esa._config_property("wavelength_res", "wavelength_res")
+    time_unit = esa._config_property("time_unit", "timestep_unit")
+    interpolation = esa._config_property("interpolation", "interpolation")
+    title = esa._config_property("title", "ta_title")
+    slice_title = esa._config_property("slice_title", "slice_title")
+    avg_slice_title = esa._config_property("avg_slice_title", "avg_slice_title")
+    peak_breadth = esa._config_property("peak_breadth", "peak_breadth")
+    density_tolerance = esa._config_property("density_tolerance", "density_tolerance")
+    memory_budget = esa._config_property("memory_budget", "density_memory_budget")
+    dpi = esa._config_property("dpi", "dpi")
+    binning = esa._config_property("binning", "ta_binning")
+    colour = esa._config_property("colour", "line_colour")
+    linewidth = esa._config_property("linewidth", "linewidth")
+    ta_size = esa._config_property("ta_size", "ta_width", "ta_height")
+    linegraph_size = esa._config_property("linegraph_size", "linegraph_width", "linegraph_height")
+
     def __init__(self):
-        self.esa_spectra = []
-        self.cmap_name = dt.get_config("ta_colourmap")
-        self.wavelength_range = [dt.get_config("wavelength_range_lower"), dt.get_config("wavelength_range_upper")]
-        self.wavelength_res = dt.get_config("wavelength_res")
+        self._settings = None
+        self._esa_spectra = spectrum_series.SpectrumSeries()
+        self._version = 0
+        self._density_cache = None
+        self._render_cache = None
+        self._pyramid_cache = None
         self.timestep = 500.0
-        self.time_unit = dt.get_config("timestep_unit")
-        self.interpolation = dt.get_config("interpolation")
-        self.title = dt.get_config("ta_title")
-        self.slice_title = dt.get_config("slice_title")
-        self.avg_slice_title = dt.get_config("avg_slice_title")
-        self.peak_breadth = dt.get_config("peak_breadth")
-        self.dpi = dt.get_config("dpi")
-        self.colour = dt.get_config("line_colour")
-        self.linewidth = dt.get_config("linewidth")
-        self.ta_size = (dt.get_config("ta_width"), dt.get_config("ta_height"))
-        self.linegraph_size = (dt.get_config("linegraph_width"), dt.get_config("linegraph_height"))
+
+    @property
+    def esa_spectra(self):
+        return self._esa_spectra
+
+    @esa_spectra.setter
+    def esa_spectra(self, esa_spectra):
+        if not hasattr(esa_spectra, "times"):
+            esa_spectra = spectrum_series.SpectrumSeries(esa_spectra)
+        self._esa_spectra = esa_spectra
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        This method invalidates the cached spectral density. It is called automatically when spectra are added or reordered, but has to be called manually after the data of an ESA spectrum has been modified in place.
+        '''
+        self._version += 1
+        self._density_cache = None
+        self._render_cache = None
+        self._pyramid_cache = None
 
     def __eq__(self, other):
         if len(self.esa_spectra) != len(other.esa_spectra):
@@ -80,12 +118,9 @@ class TransientAbsorptionSpectrum:
 
     def sort_esa_spectra(self):
         '''
-        This method sorts the list of ESA spectra such that they are ordered in time.
+        This method sorts the ESA spectra such that they are ordered in time. Nothing is done if the spectra are already sorted, see dynamictaxes.spectrum_series.SpectrumSeries.
         '''
-        def key(e):
-            return e.time
-
-        self.esa_spectra.sort(key=key)
+        self._esa_spectra.sort()
 
     def add_esa_spectrum(self, esa_spectrum):
         '''
@@ -96,11 +131,66 @@ class TransientAbsorptionSpectrum:
         esa_spectrum : dynamictaxes.excited_state_absorption_spectrum.ExcitedStateAbsorptionSpectrum
             The ESA spectrum.
         '''
-        self.esa_spectra.append(esa_spectrum)
+        if not isinstance(self._esa_spectra, spectrum_series.SpectrumSeries):
+            self._esa_spectra = spectrum_series.SpectrumSeries(self._esa_spectra)
+        self._esa_spectra.append(esa_spectrum)
+        self.invalidate()
+
+    def get_times(self):
+        '''
+        This method returns the times of all ESA spectra.
+
+        Returns
+        -------
+        times : ndarray
+            1D ndarray of the times of all ESA spectra.
+        '''
+        if hasattr(self.esa_spectra, "times"):
+            return numpy.asarray(self.esa_spectra.times, dtype=float)
+        return numpy.array([esa.time for esa in self.esa_spectra], dtype=float)
+
+    def get_timestep(self):
+        '''
+        This method returns the typical time between two consecutive ESA spectra, which is the median distance between distinct times. If there are less than two distinct times, the current timestep is returned.
+
+        Returns
+        -------
+        timestep : float
+            The timestep.
+        '''
+        times = numpy.unique(self.get_times())
+        if len(times) < 2:
+            return self.timestep
+        return float(numpy.median(numpy.diff(times)))
+
+    def evaluate(self, nm, chunk_size=None):
+        '''
+        This method evaluates all ESA spectra at the given wavelengths in one batched call. The excitation data is packed into flat arrays and evaluated chunk by chunk, see dynamictaxes.spectral_density.
+
+        Parameters
+        ----------
+        nm : float or ndarray
+            The wavelength or 1D ndarray of wavelengths in nm at which the spectra are to be evaluated.
+        chunk_size : int, optional
+            Number of timesteps evaluated at once. If None, the config density_chunk_size is used. Default None
+
+        Returns
+        -------
+        ints : ndarray
+            The intensities as a 1D ndarray of shape (timesteps,) for a single wavelength or as a 2D ndarray of shape (timesteps, len(nm)) otherwise.
+        '''
+        if chunk_size is None:
+            chunk_size = dt.get_config("density_chunk_size")
+        nm_vals = numpy.atleast_1d(numpy.asarray(nm, dtype=float))
+        offsets, energies, transition_moments = sd.pack_esa_spectra(self.esa_spectra)
+        ints = sd.spectral_density(nm_vals, offsets, energies, transition_moments, self.peak_breadth, chunk_size=chunk_size, tolerance=self.density_tolerance, memory_budget=self.get_memory_budget())
+        if type(nm) is not numpy.ndarray:
+            return ints[:, 0]
+        return ints
 
     def prepare_path(self, path, filetype):
         '''
-        This method sorts the ESA spectra and prepares the given path to be valid.
+        This method sorts the ESA spectra and prepares the given path for rendering. If the file name has no file ending, filetype is added. Directories of the path that do not exist are created.
 
         Parameters
         ----------
@@ -115,22 +205,19 @@ class TransientAbsorptionSpectrum:
             The prepared path.
         '''
         self.sort_esa_spectra()
-        self.timestep = self.esa_spectra[1].time - self.esa_spectra[0].time
-
-        filepattern = re.compile("[a-zA-Z0-9\-/_\.]*." + filetype)
-        if not filepattern.match(path) or filepattern.match(path).string != path:
-            filepattern2 = re.compile("[a-zA-Z0-9\-/_\.]*.")
-            if not filepattern2.match(path) or filepattern2.match(path).string != path:
-                path += "."
-            path += filetype
-        if "/" in path:
-            directory = path[:path[:-1].rfind("/")]
+        self.timestep = self.get_timestep()
+
+        ending = os.path.splitext(os.path.basename(path))[1][1:]
+        if not ending.isalpha():
+            path += "." + filetype
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
             os.makedirs(directory, exist_ok=True)
         return path
 
-    def render(self, path, filetype='png'):
+    def render(self, path, filetype='png', time_range=None):
         '''
-        This method renders the collected data to a TA spectrum image.
+        This method renders the collected data to a TA spectrum image. Spectra with identical times are averaged. If the times are not evenly spaced, each spectrum is drawn as a column extending halfway to its neighbours. If the spectral density has more timesteps or wavelengths than the image has pixels, it is first reduced to the pixel grid as set by binning, see get_density_pyramid.
 
         Parameters
         ----------
@@ -138,18 +225,199 @@ class TransientAbsorptionSpectrum:
             The path to which the TA spectrum should be saved
         filetype : str, optional
             The filetype of the image. Default png
+        time_range : float, float, optional
+            Lower and upper end of the rendered times. If None, all times are rendered. Default None
         '''
+        import dynamictaxes.lod as lod
         path = self.prepare_path(path, filetype)
+        times, density = self.get_render_density()
+        start, stop = 0, len(times)
+        if time_range is not None:
+            start, stop = numpy.searchsorted(times, time_range[0], side='left'), numpy.searchsorted(times, time_range[1], side='right')
+            if stop <= start:
+                raise ValueError("There are no spectra between " + str(time_range[0]) + " and " + str(time_range[1]) + " " + str(self.time_unit))
+        shown = times[start:stop]
+        extent = None
+        if len(shown) < 3 or numpy.allclose(numpy.diff(shown), self.timestep, rtol=1e-6, atol=0):
+            extent = (shown[0], shown[0] + self.timestep*len(shown), self.wavelength_range[0], self.wavelength_range[1])
+
+        pixels = (int(self.ta_size[0] * self.dpi), int(self.ta_size[1] * self.dpi))
+        binning = str(self.binning or "none").lower()
+        if binning not in lod.BINNING_MODES:
+            raise ValueError("Unknown binning " + binning + ". Allowed values are " + ", ".join(lod.BINNING_MODES))
+        if binning != "none" and (stop - start > pixels[0] or density.shape[1] > pixels[1]):
+            density, shown = self.get_density_pyramid(binning).select(start, stop, pixels)
+        else:
+            density = density[start:stop]
+
+        import dynamictaxes.renderers as renderers
+        renderer = renderers.get_renderer(renderers.TARenderer, self.ta_size)
+        renderer.update(density, shown, self.timestep, self.wavelength_range, title=self.title, time_unit=self.time_unit, interpolation=self.interpolation, cmap=self.cmap_name, extent=extent)
+        renderer.save(path, self.dpi)
+
+    def get_density_pyramid(self, mode=None):
+        '''
+        This method returns the spectral density of get_render_density as a dynamictaxes.lod.DensityPyramid, which reduces it to the pixel grid of a render. The pyramid is cached together with the spectral density, such that repeated renders of sub-ranges only combine about as many timesteps as there are pixels.
+
+        Parameters
+        ----------
+        mode : str, optional
+            mean or max. If None, binning is used. Default None
+
+        Returns
+        -------
+        pyramid : dynamictaxes.lod.DensityPyramid
+            The pyramid.
+        '''
+        import dynamictaxes.lod as lod
+        if mode is None:
+            mode = str(self.binning).lower()
+        times, density = self.get_render_density()
+        key = (self._density_key(), mode)
+        if self._pyramid_cache is None or self._pyramid_cache[0] != key:
+            self._pyramid_cache = (key, lod.DensityPyramid(times, density, mode, memory_budget=self.get_memory_budget(), directory=dt.get_config("density_scratch_dir")))
+        return self._pyramid_cache[1]
+
+    def get_render_density(self):
+        '''
+        This method returns the spectral density as it is rendered, where spectra with identical times are averaged. The result is cached like the spectral density, such that a memory mapped density is only averaged once.
 
+        Returns
+        -------
+        times : ndarray
+            1D ndarray of the distinct times in ascending order.
+        density : ndarray or numpy.memmap
+            2D ndarray of shape (len(times), wavelength_res).
+        '''
+        key = self._density_key()
+        if self._render_cache is not None and self._render_cache[0] == key:
+            return self._render_cache[1], self._render_cache[2]
         density = self.get_spectral_density()
-        fig, ax = plt.subplots(nrows=1, ncols=1, figsize=self.ta_size)
-        ax.imshow(numpy.flip(density.T, axis=0), aspect='auto', interpolation=self.interpolation, extent=(0, self.timestep*len(self.esa_spectra), self.wavelength_range[0], self.wavelength_range[1]))
-        ax.set_xlabel("Time [" + self.time_unit + "]")
-        ax.set_ylabel("Wavelength [nm]")
-        ax.set_title(self.title)
+        times, inverse = numpy.unique(self.get_times(), return_inverse=True)
+        if len(times) < len(inverse):
+            # Spectra with identical times are averaged, chunk by chunk if the density is memory mapped
+            budget = self.get_memory_budget()
+            summed = sd.allocate_density((len(times), density.shape[1]), budget, dt.get_config("density_scratch_dir"))
+            for start, stop in sd.row_chunks(len(inverse), density.shape[1], budget):
+                numpy.add.at(summed, inverse[start:stop], density[start:stop])
+            counts = numpy.bincount(inverse).astype(float)
+            for start, stop in sd.row_chunks(len(times), density.shape[1], budget):
+                summed[start:stop] /= counts[start:stop, None]
+            density = summed
+            density.flags.writeable = False
+        self._render_cache = (key, times, density)
+        return times, density
+
+    def render_raw(self, path, filetype='png'):
+        '''
+        This method writes the TA spectrum as a raw image with one pixel per timestep and wavelength, without axes or labels. The density is mapped through a lookup table of the colourmap and written block by block as an 8-bit palette PNG or TIFF, see dynamictaxes.raster. This is much faster than render and works for densities that are too large for matplotlib. Spectra with identical times are averaged. Non-uniform times are not resampled, every column is one timestep.
+
+        Parameters
+        ----------
+        path : str
+            The path of the image.
+        filetype : str, optional
+            png, tif or tiff. It is only used if path has no file ending. Default png
+        '''
+        import dynamictaxes.raster as raster
+        path = self.prepare_path(path, filetype)
+        times, density = self.get_render_density()
+        if len(times) == 0:
+            raise ValueError("Cannot render a TA spectrum without ESA spectra.")
+        raster.write_density(path, density, self.cmap_name, scratch_dir=dt.get_config("density_scratch_dir"))
+
+    def render_esa_batch(self, indices, path, filetype='png', workers=None):
+        '''
+        This method renders the ESA spectra with the given indices to path_[index], optionally in parallel. See dynamictaxes.batch_render.render_esa_batch.
+
+        Parameters
+        ----------
+        indices : iterable
+            The indices of the ESA spectra that should be rendered.
+        path : str
+            The base path of the images. The index of each spectrum is appended to it.
+        filetype : str, optional
+            The filetype of the images. Default png
+        workers : int, optional
+            Number of worker processes. If None, the config render_workers is used. Default None
+
+        Returns
+        -------
+        paths : list
+            The paths of all rendered images.
+        '''
+        return batch_render.render_esa_batch(self.esa_spectra, indices, path, filetype=filetype, workers=workers)
 
-        plt.savefig(path, bbox_inches='tight', dpi=self.dpi)
-        plt.close()
+    def render_esa_movie(self, path, indices=None, filetype='mp4', fps=None):
+        '''
+        This method renders the ESA spectra with the given indices as the frames of one movie. See dynamictaxes.movie.render_esa_movie.
+
+        Parameters
+        ----------
+        path : str
+            The path of the movie. If it has no file ending, filetype is added.
+        indices : iterable, optional
+            The indices of the ESA spectra that are rendered. If None, all spectra are rendered. Default None
+        filetype : str, optional
+            The file ending, e.g. mp4 or gif. Default mp4
+        fps : float, optional
+            Frames per second. If None, the config movie_fps is used. Default None
+
+        Returns
+        -------
+        path : str
+            The path of the movie.
+        '''
+        import dynamictaxes.movie as movie
+        return movie.render_esa_movie(self.esa_spectra, path, indices=indices, filetype=filetype, fps=fps)
+
+    def get_avg_slice(self, centre, span, intres=100, mode=None):
+        '''
+        This method calculates the mean intensity of all ESA spectra between centre-span and centre+span and its standard deviation over this interval. Three modes are available:
+
+        analytic
+            The integrals over the Gaussians are evaluated exactly with the error function, see dynamictaxes.spectral_density.averaged_slice.
+        sampled
+            The spectra are evaluated exactly at intres points in the interval.
+        grid
+            The spectra are interpolated at intres points in the interval from the cached spectral density, see interpolate_density.
+
+        Parameters
+        ----------
+        centre : float
+            The wavelength in nm around which the interval is centred.
+        span : float
+            Half the width of the interval in nm.
+        intres : int, optional
+            The number of points in the interval for the modes sampled and grid. Default 100
+        mode : str, optional
+            One of analytic, sampled and grid. If None, the config avg_slice_mode is used. Default None
+
+        Returns
+        -------
+        intensities : ndarray
+            1D ndarray of the mean intensity of each timestep.
+        intensities_stdev : ndarray
+            1D ndarray of the standard deviation of each timestep.
+        '''
+        if mode is None:
+            mode = dt.get_config("avg_slice_mode")
+        if mode is None:
+            mode = "analytic"
+        if mode == "analytic":
+            if span <= 0:
+                return self.evaluate(float(centre)), numpy.zeros(len(self.esa_spectra))
+            offsets, energies, transition_moments = sd.pack_esa_spectra(self.esa_spectra)
+            return sd.averaged_slice(offsets, energies, transition_moments, self.peak_breadth, centre-span, centre+span, chunk_size=dt.get_config("density_chunk_size"), memory_budget=self.get_memory_budget())
+
+        nm_slice = numpy.linspace(centre-span, centre+span, num=intres)
+        if mode == "sampled":
+            int_slices = self.evaluate(nm_slice)
+        elif mode == "grid":
+            int_slices = self.interpolate_density(nm_slice)
+        else:
+            raise ValueError("Unknown avg_slice_mode " + str(mode) + ". Allowed values are analytic, sampled and grid")
+        return numpy.average(int_slices, axis=1), numpy.std(int_slices, axis=1)
 
     def render_avg_slice(self, centre, span, path, filetype='png', intres=100):
         '''
@@ -166,31 +434,37 @@ class TransientAbsorptionSpectrum:
         filetype : str, optional
             The filetype of the image. Default png
         intres : int, optional
-            The number of points considered in each timestep for averaging. Default 100
+            The number of points considered in each timestep for averaging if the sampled or grid mode is used, see get_avg_slice. Default 100
 
         '''
         path = self.prepare_path(path, filetype)
 
-        intensities = numpy.zeros(len(self.esa_spectra))
-        intensities_stdev = numpy.zeros(len(self.esa_spectra))
-        nm_slice = numpy.linspace(centre-span, centre+span, num=intres)
-        timestamps = numpy.array([esa.time for esa in self.esa_spectra])
-
-        for i in range(len(intensities)):
-            int_slice = self.esa_spectra[i].evaluate(nm_slice)
-            intensities[i] = numpy.average(int_slice)
-            intensities_stdev[i] = numpy.std(int_slice)
-
-        fig, ax = plt.subplots(nrows=1, ncols=1, figsize=self.linegraph_size)
-        ax.margins(0,0)
-        ax.fill_between(timestamps, intensities-intensities_stdev, intensities+intensities_stdev, color=self.colour, alpha=0.2, linewidth=0)
-        ax.fill_between(timestamps, intensities-2*intensities_stdev, intensities+2*intensities_stdev, color=self.colour, alpha=0.2, linewidth=0)
-        ax.plot(timestamps, intensities, color=self.colour, linewidth=self.linewidth)
-        ax.set_xlabel("Time [" + self.time_unit + "]")
-        ax.set_ylabel("Transition Moment")
-        ax.set_title(self.avg_slice_title.replace("{wavelength}", str(centre)).replace("{span}", str(span)))
-        plt.savefig(path, bbox_inches='tight', dpi=self.dpi)
-        plt.close()
+        timestamps = self.get_times()
+        intensities, intensities_stdev = self.get_avg_slice(centre, span, intres=intres)
+
+        import dynamictaxes.renderers as renderers
+        title = self.avg_slice_title.replace("{wavelength}", str(centre)).replace("{span}", str(span))
+        renderer = renderers.get_renderer(renderers.SliceRenderer, self.linegraph_size)
+        renderer.update(timestamps, intensities, stdev=intensities_stdev, title=title, time_unit=self.time_unit, colour=self.colour, linewidth=self.linewidth)
+        renderer.save(path, self.dpi)
+
+    def get_mono_slice(self, wavelength):
+        '''
+        This method returns the intensity of all ESA spectra at one wavelength, see interpolate_density. A single trajectory has no spread, subclasses like dynamictaxes.ensemble.EnsembleSpectrum also return a standard deviation.
+
+        Parameters
+        ----------
+        wavelength : float
+            The wavelength in nm.
+
+        Returns
+        -------
+        intensities : ndarray
+            1D ndarray of the intensity of each timestep.
+        intensities_stdev : ndarray
+            1D ndarray of the standard deviation of each timestep or None.
+        '''
+        return self.interpolate_density(float(wavelength)), None
 
     def render_mono_slice(self, wavelength, path, filetype='png'):
         '''
@@ -208,37 +482,101 @@ class TransientAbsorptionSpectrum:
         '''
         path = self.prepare_path(path, filetype)
 
-        intensities = numpy.zeros(len(self.esa_spectra))
-        for i in range(len(self.esa_spectra)):
-            intensities[i] = self.esa_spectra[i].evaluate(wavelength)
+        intensities, intensities_stdev = self.get_mono_slice(wavelength)
+        timestamps = self.get_times()
 
-        timestamps = numpy.array([esa.time for esa in self.esa_spectra])
+        import dynamictaxes.renderers as renderers
+        renderer = renderers.get_renderer(renderers.SliceRenderer, self.linegraph_size)
+        renderer.update(timestamps, intensities, stdev=intensities_stdev, title=self.slice_title.replace("{wavelength}", str(wavelength)), time_unit=self.time_unit, colour=self.colour, linewidth=self.linewidth)
+        renderer.save(path, self.dpi)
 
-        fig, ax = plt.subplots(nrows=1, ncols=1, figsize=self.linegraph_size)
-        ax.margins(0,0)
-        ax.plot(timestamps, intensities, color=self.colour, linewidth=self.linewidth)
-        ax.set_xlabel("Time [" + self.time_unit + "]")
-        ax.set_ylabel("Transition Moment")
-        ax.set_title(self.slice_title.replace("{wavelength}", str(wavelength)))
+    def _density_key(self):
+        # Spectra appended through esa_spectra itself change the version of the series, not of this spectrum
+        return (self._version, getattr(self._esa_spectra, "version", None), float(self.wavelength_range[0]), float(self.wavelength_range[1]), int(self.wavelength_res), float(self.peak_breadth), float(self.density_tolerance or 0))
 
-        plt.savefig(path, bbox_inches='tight', dpi=self.dpi)
-        plt.close()
+    def get_memory_budget(self):
+        '''
+        This method returns the memory budget in bytes.
+
+        Returns
+        -------
+        budget : int
+            The memory budget in bytes or None if there is no limit.
+        '''
+        budget = float(self.memory_budget or 0)
+        if budget <= 0:
+            return None
+        return int(budget * 2**20)
 
-    def get_spectral_density(self):
+    def get_spectral_density(self, chunk_size=None):
         '''
-        This function calculates the spectral density as a 2D array of size (timesteps, wavelength_res)
+        This function calculates the spectral density as a 2D array of size (timesteps, wavelength_res). All spectra are evaluated in batches of chunk_size timesteps, which bounds the memory required for the temporary arrays. If density_tolerance is positive, each Gaussian is only evaluated near its centre, see dynamictaxes.spectral_density.sparse_spectral_density. If the density needs more than memory_budget, it is written into a numpy.memmap on a temporary file in the directory density_scratch_dir, see dynamictaxes.spectral_density.allocate_density. The result is cached until the spectra or the relevant settings change and is therefore read-only.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of timesteps evaluated at once. If None, the config density_chunk_size is used, where 0 means that the chunk size is chosen automatically from the memory budget. Default None
 
         Returns
         -------
-        density : ndarray
+        density : ndarray or numpy.memmap
             The spectral density as a 2D ndarray of size (timesteps, wavelength_res)
         '''
-        density = numpy.zeros((len(self.esa_spectra), self.wavelength_res))
-        for i in range(len(self.esa_spectra)):
-            density[i] = self.esa_slice(i)
-        
+        key = self._density_key()
+        if self._density_cache is not None and self._density_cache[0] == key:
+            return self._density_cache[1]
+
+        if chunk_size is None:
+            chunk_size = dt.get_config("density_chunk_size")
+        nm_vals = numpy.linspace(self.wavelength_range[0], self.wavelength_range[1], num=self.wavelength_res)
+        offsets, energies, transition_moments = sd.pack_esa_spectra(self.esa_spectra)
+        budget = self.get_memory_budget()
+        out = sd.allocate_density((len(offsets) - 1, len(nm_vals)), budget, dt.get_config("density_scratch_dir"))
+        density = sd.spectral_density(nm_vals, offsets, energies, transition_moments, self.peak_breadth, chunk_size=chunk_size, out=out, tolerance=self.density_tolerance, memory_budget=budget)
+        density.flags.writeable = False
+        self._density_cache = (key, density)
         return density
 
+    def interpolate_density(self, nm):
+        '''
+        This method evaluates all ESA spectra at the given wavelengths by linear interpolation on the cached spectral density, such that no Gaussians have to be evaluated. If any wavelength lies outside of the wavelength range, the spectra are evaluated exactly, see evaluate.
+
+        Parameters
+        ----------
+        nm : float or ndarray
+            The wavelength or 1D ndarray of wavelengths in nm.
+
+        Returns
+        -------
+        ints : ndarray
+            The intensities as a 1D ndarray of shape (timesteps,) for a single wavelength or as a 2D ndarray of shape (timesteps, len(nm)) otherwise.
+        '''
+        nm_vals = numpy.atleast_1d(numpy.asarray(nm, dtype=float))
+        lower, upper = float(self.wavelength_range[0]), float(self.wavelength_range[1])
+        res = int(self.wavelength_res)
+        if res < 2 or upper <= lower or numpy.any(nm_vals < lower) or numpy.any(nm_vals > upper):
+            return self.evaluate(nm)
+
+        ints = self._interpolate_grid(self.get_spectral_density(), nm_vals)
+        if type(nm) is not numpy.ndarray:
+            return ints[:, 0]
+        return ints
+
+    def _interpolate_grid(self, density, nm_vals):
+        '''
+        Interpolates a density on the wavelength grid linearly at the given wavelengths, which have to lie within the wavelength range.
+        '''
+        lower, upper = float(self.wavelength_range[0]), float(self.wavelength_range[1])
+        res = int(self.wavelength_res)
+        pos = (nm_vals - lower) / (upper - lower) * (res - 1)
+        left = numpy.clip(numpy.floor(pos).astype(numpy.int64), 0, res - 2)
+        weight = pos - left
+        ints = numpy.empty((density.shape[0], len(nm_vals)))
+        for start, stop in sd.row_chunks(density.shape[0], res, self.get_memory_budget()):
+            chunk = density[start:stop]
+            ints[start:stop] = chunk[:, left] * (1.0 - weight) + chunk[:, left+1] * weight
+        return ints
+
     def esa_slice(self, index):
         '''
         This function generates a 1D ndarray of the spectral intensity of one ESA spectrum.
@@ -254,12 +592,8 @@ class TransientAbsorptionSpectrum:
             An ndarray of size (wavelength_res,) containing the spectral intensity of the ESA spectrum
         '''
         nm_vals = numpy.linspace(self.wavelength_range[0], self.wavelength_range[1], num=self.wavelength_res)
-        excitations = 1239.841 / numpy.array(self.esa_spectra[index].energies)
-        transition_moments = numpy.array(self.esa_spectra[index].transition_moments)
-        esa = numpy.zeros(nm_vals.shape)
-        for e, t in zip(excitations, transition_moments):
-            esa += self.gaussian(nm_vals, e, t)
-        return esa
+        offsets, energies, transition_moments = sd.pack_esa_spectra([self.esa_spectra[index]])
+        return sd.spectral_density(nm_vals, offsets, energies, transition_moments, self.peak_breadth, tolerance=self.density_tolerance)[0]
 
     def gaussian(self, xvals, centre, height):
         '''